@@ -0,0 +1,78 @@
+"""
+Benchmark: archive load/lookup cost and size over a simulated year of hourly runs.
+Each simulated run opens the archive, checks a batch of candidates (mostly recently posted
+proxies, as in real feeds), archives the newly posted ones, compacts and closes it.
+The TTL-bounded archive is compared against an archive that never expires entries.
+
+Usage: python benchmarks/bench_archive.py [--days 365] [--posted-per-run 54] [--candidates-per-run 500]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import local_servers # noqa: F401 (puts src/ on sys.path)
+from archive_store import ArchiveStore, archive_key
+
+HOUR = 3600
+
+
+def current_rss_mib():
+    """Resident set size of this process, from /proc (Linux only)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return float('nan')
+
+
+def simulate(label, db_path, args, ttl_seconds, max_entries):
+    rng = random.Random(42)
+    now = [1_700_000_000.0]
+    next_proxy = 0
+    posted_history = [] # Proxy numbers in posting order, to draw repeat candidates from
+    print(f"\n{label}")
+    print(f"{'day':>5} {'entries':>9} {'file KiB':>9} {'open+lookup ms':>15} {'rss MiB':>8}")
+
+    for run in range(args.days * 24):
+        now[0] += HOUR
+        start = time.perf_counter()
+        archive = ArchiveStore(db_path, ttl_seconds=ttl_seconds, max_entries=max_entries, clock=lambda: now[0])
+        # Candidates: proxies posted during the last week (still circulating) plus fresh ones
+        recent = posted_history[-args.posted_per_run * 24 * 7:]
+        candidates = [rng.choice(recent) for _ in range(args.candidates_per_run - args.posted_per_run)] if recent else []
+        for n in candidates:
+            _ = archive_key(str(n), 443, 'ee') in archive
+        lookup_ms = (time.perf_counter() - start) * 1000
+
+        new = range(next_proxy, next_proxy + args.posted_per_run)
+        next_proxy += args.posted_per_run
+        archive.add_many((archive_key(str(n), 443, 'ee'), f'tg://proxy?server={n}&port=443&secret=ee') for n in new)
+        posted_history.extend(new)
+        del posted_history[:-args.posted_per_run * 24 * 7]
+        if ttl_seconds or max_entries:
+            archive.compact()
+
+        if run % (24 * 30) == 24 * 30 - 1 or run == args.days * 24 - 1:
+            print(f"{run // 24 + 1:5d} {len(archive):9d} {os.path.getsize(db_path) / 1024:9.0f} {lookup_ms:15.2f} {current_rss_mib():8.1f}")
+        archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--posted-per-run', type=int, default=54)
+    parser.add_argument('--candidates-per-run', type=int, default=500)
+    parser.add_argument('--ttl-days', type=float, default=30)
+    parser.add_argument('--max-entries', type=int, default=500000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        simulate(f"TTL {args.ttl_days:g} days, cap {args.max_entries}", os.path.join(tmp, 'bounded.db'),
+                 args, args.ttl_days * 24 * HOUR, args.max_entries)
+        simulate("no expiry (grows forever)", os.path.join(tmp, 'unbounded.db'), args, None, None)
+
+
+if __name__ == '__main__':
+    main()
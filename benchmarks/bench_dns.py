@@ -0,0 +1,83 @@
+"""
+Benchmark: AsyncDNSResolver against a local stub nameserver.
+Resolves a set of hostnames from a StubDNSServer that answers after a fixed delay, one query at
+a time and concurrently, then again from the warm cache. Then checks the resolver's answers
+for a known name, an NXDOMAIN name, a name the server never answers (timeout) and a record
+whose TTL runs out.
+
+Usage: python benchmarks/bench_dns.py [--hostnames 200] [--delay 0.02] [--concurrency 100]
+"""
+import argparse
+import logging
+import time
+
+from local_servers import StubDNSServer
+
+from dns_resolver import AsyncDNSResolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def timed_resolve(resolver, hostnames):
+    start = time.perf_counter()
+    resolved = resolver.resolve_many(hostnames)
+    return resolved, time.perf_counter() - start
+
+
+def check_answers(nameserver, server):
+    """Known name, NXDOMAIN, silent name and TTL expiry, with a fake clock for the cache."""
+    clock = FakeClock()
+    resolver = AsyncDNSResolver(nameserver=nameserver, timeout=0.5, min_ttl=60, negative_ttl=300, clock=clock)
+    names = ['known.test', 'missing.test', 'silent.test']
+    resolved = resolver.resolve_many(names)
+    assert resolved == {'known.test': '10.0.0.1', 'missing.test': None, 'silent.test': None}, resolved
+    assert resolver.failures == 1 and 'silent.test' not in resolver.cache, (resolver.failures, resolver.cache)
+    assert resolver.cache['known.test'] == ['10.0.0.1', clock.now + 120], resolver.cache
+    assert resolver.cache['missing.test'] == [None, clock.now + 300], resolver.cache
+
+    queries = server.query_count
+    resolver.resolve_many(['known.test', 'missing.test'])
+    assert server.query_count == queries and resolver.cache_hits == 2, 'cached answers were queried again'
+
+    server.records['known.test'] = ('10.0.0.2', 120)
+    clock.now += 121 # Past the positive TTL, within the negative one
+    resolved = resolver.resolve_many(['known.test', 'missing.test'])
+    assert resolved == {'known.test': '10.0.0.2', 'missing.test': None}, resolved
+    assert server.query_count == queries + 1, 'only the expired record should be queried again'
+    print("answers: known name resolved and cached for its TTL, NXDOMAIN cached for negative_ttl, "
+          "silent name timed out uncached, expired record queried again")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hostnames', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.02, help='stub server answer delay (seconds)')
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    records = {f'proxy{i}.test': (f'10.1.{i >> 8 & 255}.{i & 255}', 3600) for i in range(args.hostnames)}
+    records.update({'known.test': ('10.0.0.1', 120), 'silent.test': None})
+    hostnames = [f'proxy{i}.test' for i in range(args.hostnames)]
+    with StubDNSServer(records, delay=args.delay) as server:
+        nameserver = f'127.0.0.1:{server.port}'
+        print(f"{args.hostnames} hostnames, stub answers after {args.delay * 1000:.0f} ms")
+        print(f"{'mode':<24} {'seconds':>8} {'names/s':>9} {'queries':>8}")
+        for label, concurrency in (('sequential', 1), (f'concurrent ({args.concurrency})', args.concurrency)):
+            resolver = AsyncDNSResolver(nameserver=nameserver, concurrency=concurrency)
+            resolved, seconds = timed_resolve(resolver, hostnames)
+            assert all(resolved[name] == records[name][0] for name in hostnames)
+            print(f"{label:<24} {seconds:>8.3f} {len(hostnames) / seconds:>9.0f} {resolver.queries:>8}")
+        resolved, seconds = timed_resolve(resolver, hostnames)
+        print(f"{'warm cache':<24} {seconds:>8.3f} {len(hostnames) / seconds:>9.0f} {resolver.queries:>8}")
+        check_answers(nameserver, server)
+
+
+if __name__ == '__main__':
+    main()
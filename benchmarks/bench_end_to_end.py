@@ -0,0 +1,162 @@
+"""
+Benchmark: the whole single-run main() pipeline, offline, for several feed sizes.
+Serves synthetic subscription feeds with a controlled share of duplicate lines and of corrupt
+(trailing-'A' padded) secrets from a local HTTP server, posts to a local fake Bot API and
+geolocates against a small generated GeoLite2-Country database. Each size runs main() in a fresh
+child process and working directory, so peak RSS covers that run only (the servers stay in this
+process). Reports end-to-end time, peak RSS, and time, calls (items produced) and calls/s per
+pipeline stage (from the run report); stages are timed exclusively, so they add up to the run time.
+With --channels N, the run posts to N channels from one ingest pass: one takes every proxy, the
+other N - 1 split the countries between them.
+
+Usage: python benchmarks/bench_end_to_end.py [--sizes 1000,10000,50000] [--feeds 4]
+                                              [--duplicate-ratio 0.3] [--corrupt-ratio 0.05]
+                                              [--channels 1] [--set NAME=VALUE ...]
+--set overrides a proxy_poster configuration constant for the runs, e.g. --set PARSE_WORKERS=4.
+Health checks are off, since the synthetic addresses are unreachable (see bench_health_check.py).
+"""
+import argparse
+import ast
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from local_servers import FakeBotAPI, SubscriptionServer, write_test_mmdb
+
+COUNTRIES = [('DE', 'Germany'), ('NL', 'Netherlands'), ('US', 'United States'), ('FI', 'Finland'),
+             ('FR', 'France'), ('GB', 'United Kingdom'), ('IR', 'Iran'), ('TR', 'Turkey')]
+MAPPED_NETWORKS = 240 # 10.0.0.0/16 .. 10.239.0.0/16 have a country; the rest of 10/8 is not found
+FAKE_TLS_DOMAIN = 'cdn.example.com'.encode().hex()
+
+
+def synthetic_feed_lines(size, duplicate_ratio, corrupt_ratio, seed=0):
+    """
+    Generates size proxy links: a duplicate_ratio share repeats an earlier link (possibly of
+    another feed), a corrupt_ratio share has a long secret padded with trailing 'A's (which the
+    secret heuristic skips), and the rest are distinct endpoints spread over the 10/8 networks.
+    """
+    rng = random.Random(seed)
+    lines, unique = [], []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < corrupt_ratio:
+            lines.append(f"tg://proxy?server=10.0.0.{rng.randrange(256)}&port=443&secret={rng.getrandbits(128):032x}{'A' * 40}")
+        elif roll < corrupt_ratio + duplicate_ratio and unique:
+            lines.append(rng.choice(unique))
+        else:
+            n = len(unique)
+            secret = f"ee{n:032x}{FAKE_TLS_DOMAIN}" if n % 3 else f"dd{n:032x}"
+            line = f"tg://proxy?server=10.{n & 255}.{(n >> 8) & 255}.{(n >> 16) & 255}&port={443 + n % 7}&secret={secret}"
+            unique.append(line)
+            lines.append(line)
+    return lines, len(unique)
+
+
+def write_geoip_database(path):
+    write_test_mmdb(path, [(f'10.{i}.0.0/16', {'country': {'iso_code': code, 'names': {'en': name}}})
+                           for i, (code, name) in zip(range(MAPPED_NETWORKS), COUNTRIES * MAPPED_NETWORKS)])
+
+
+def write_channels(path, count):
+    """Writes a channels file: the default channel takes every proxy, count - 1 more split the countries."""
+    channels = [{'chat_id': '@bench'}]
+    channels += [{'chat_id': f'@bench{i}', 'countries': [code for code, _ in COUNTRIES[i - 1::count - 1]]} for i in range(1, count)]
+    with open(path, 'w') as f:
+        json.dump({'channels': channels}, f)
+
+
+def run_child(workdir, api_base_url, overrides):
+    """Runs main() in workdir (this is the child process) and prints one JSON result line."""
+    os.chdir(workdir)
+    logging.getLogger().setLevel(logging.ERROR)
+    import proxy_poster
+    proxy_poster.TELEGRAM_BOT_TOKEN = 'TEST'
+    proxy_poster.TELEGRAM_CHANNEL_ID = '@bench'
+    proxy_poster.TELEGRAM_API_BASE_URL = api_base_url
+    proxy_poster.POST_DELAY_SECONDS = 0
+    proxy_poster.TELEGRAM_CHAT_MESSAGES_PER_MINUTE = 10 ** 9
+    proxy_poster.TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = 10 ** 9
+    proxy_poster.TELEGRAM_SEND_BACKOFF_SECONDS = 0
+    proxy_poster.HEALTH_CHECK_ENABLED = False
+    proxy_poster.DNS_RESOLUTION_ENABLED = False
+    for name, value in overrides.items():
+        setattr(proxy_poster, name, value)
+
+    start = time.perf_counter()
+    proxy_poster.main()
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        'seconds': seconds,
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'stages': proxy_poster.run_metrics.report()['stages'],
+    }))
+
+
+def run_size(size, args, overrides):
+    lines, unique = synthetic_feed_lines(size, args.duplicate_ratio, args.corrupt_ratio, args.seed)
+    routes = {f'/feed/{f}': {'body': '\n'.join(lines[f::args.feeds])} for f in range(args.feeds)}
+    workdir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(workdir, 'data'))
+        write_geoip_database(os.path.join(workdir, 'data', 'GeoLite2-Country.mmdb'))
+        if args.channels > 1:
+            write_channels(os.path.join(workdir, 'data', 'channels.json'), args.channels)
+        with SubscriptionServer(routes) as server, FakeBotAPI() as api:
+            with open(os.path.join(workdir, 'data', 'subscriptions.txt'), 'w') as f:
+                f.write('\n'.join(server.url(path) for path in routes) + '\n')
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', workdir, api.api_url.rsplit('/bot', 1)[0],
+                 json.dumps(overrides)],
+                capture_output=True, text=True,
+            )
+            if child.returncode != 0:
+                raise RuntimeError(f"Benchmark run failed:\n{child.stderr}")
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            result['posts'] = len(api.messages)
+        result['unique'] = unique
+        return result
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--child':
+        return run_child(sys.argv[2], sys.argv[3], json.loads(sys.argv[4]))
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,50000', help="comma-separated total feed lines per run")
+    parser.add_argument('--feeds', type=int, default=4)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.3)
+    parser.add_argument('--corrupt-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--channels', type=int, default=1, help="output channels fed from the one ingest pass")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE')
+    args = parser.parse_args()
+    overrides = {}
+    for assignment in args.set:
+        name, _, value = assignment.partition('=')
+        overrides[name] = ast.literal_eval(value)
+
+    print(f"{args.feeds} feeds, {args.duplicate_ratio:.0%} duplicate lines, {args.corrupt_ratio:.0%} corrupt secrets, "
+          f"{args.channels} channels"
+          + (f", {overrides}" if overrides else ''))
+    for size in (int(size) for size in args.sizes.split(',')):
+        result = run_size(size, args, overrides)
+        print(f"\n{size} lines: {result['unique']} unique proxies, {result['posts']} posts, "
+              f"{result['seconds']:.2f}s end to end ({size / result['seconds']:,.0f} lines/s), "
+              f"peak RSS {result['peak_rss_kib'] / 1024:.1f} MiB")
+        print(f"  {'stage':<16} {'seconds':>8} {'calls':>8} {'calls/s':>10}")
+        for stage, totals in sorted(result['stages'].items(), key=lambda item: -item[1]['seconds']):
+            rate = totals['calls'] / totals['seconds'] if totals['seconds'] else 0
+            print(f"  {stage:<16} {totals['seconds']:>8.3f} {totals['calls']:>8} {rate:>10,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Report: how much canonical endpoint keys shrink the candidate set and the archive.
+Parses the lines of data/archive.txt and counts the distinct proxies under each dedup scheme,
+from the rebuilt raw link (the original main()) to the canonical endpoint key, adding one
+normalization at a time. Then migrates the links into a fresh archive database, and re-keys a copy
+written with the previous key scheme, reporting the entry counts.
+Once the first run has migrated archive.txt, the raw links in data/archive.db are used instead
+(generated links if there is neither). Those hold one link per canonical key already, so the
+shrink is only representative on the original text archive.
+
+Usage: python benchmarks/bench_endpoint_keys.py [--archive data/archive.txt]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from local_servers import read_archive_links # (also puts src/ on sys.path)
+import proxy_poster
+from archive_store import ArchiveStore, archive_key
+from proxy_endpoint import canonical_host, canonical_secret, decode_secret
+
+
+def previous_archive_key(server, port, secret):
+    """The string-normalized key used before canonical endpoints (lowercased server, integer port)."""
+    server = (server or '').strip().lower()
+    port = str(port or '').strip()
+    if port.isdigit():
+        port = str(int(port))
+    digest = hashlib.blake2b(f"{server}\0{port}\0{secret or ''}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def decoded_secret(secret):
+    secret_bytes = decode_secret(secret)
+    return secret_bytes if secret_bytes is not None else secret
+
+
+SCHEMES = [
+    ('raw link (original main())', lambda p: p['raw']),
+    ('+ tag ignored', lambda p: (p['ip'], p['port'], p['secret'])),
+    ('+ host case, port', lambda p: previous_archive_key(p['ip'], p['port'], p['secret'])),
+    ('+ address notation', lambda p: (canonical_host(p['ip']), int(p['port']) if p['port'].isdigit() else p['port'], p['secret'])),
+    ('+ secret encoding', lambda p: (canonical_host(p['ip']), int(p['port']) if p['port'].isdigit() else p['port'], decoded_secret(p['secret']))),
+    ('+ dd prefix (canonical key)', lambda p: p['archive_key']),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', help="text file of proxy links (default: the archive in data/)")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    lines, source = read_archive_links(args.archive)
+    print(f"Links from {source}")
+    proxies = [proxy for proxy in map(proxy_poster.parse_telegram_proxy_link, lines) if proxy]
+    print(f"{len(lines)} lines, {len(proxies)} parsed")
+    print(f"{'dedup scheme':<30} {'distinct':>9} {'shrink':>8}")
+    baseline = None
+    for label, key in SCHEMES:
+        distinct = len({key(proxy) for proxy in proxies})
+        baseline = baseline or distinct
+        print(f"{label:<30} {distinct:>9} {1 - distinct / baseline:>8.1%}")
+
+    canonical = {}
+    for proxy in proxies:
+        canonical.setdefault(proxy['archive_key'], []).append(proxy['raw'])
+    merged = [raws for raws in canonical.values() if len(set(raws)) > 1]
+    print(f"\n{len(merged)} canonical endpoints were written in more than one way, e.g.:")
+    for raws in merged[:3]:
+        for raw in sorted(set(raws)):
+            print(f"  {raw}")
+        print()
+
+    directory = tempfile.mkdtemp()
+    try:
+        text_path = os.path.join(directory, 'archive.txt')
+        with open(text_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        archive = ArchiveStore(os.path.join(directory, 'archive.db'), text_path)
+        print(f"Links migrated into a new archive: {len(archive)} entries")
+        archive.close()
+
+        # An archive written with the previous key scheme, re-keyed on open
+        old_path = os.path.join(directory, 'old.db')
+        connection = sqlite3.connect(old_path)
+        connection.execute('CREATE TABLE archive (key INTEGER PRIMARY KEY, raw TEXT NOT NULL, first_posted REAL NOT NULL, '
+                           'last_posted REAL NOT NULL, last_seen REAL NOT NULL)')
+        now = time.time()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?)',
+                                   ((previous_archive_key(p['ip'], p['port'], p['secret']), p['raw'], now, now, now) for p in proxies))
+        before = connection.execute('SELECT COUNT(*) FROM archive').fetchone()[0]
+        connection.close()
+        start = time.perf_counter()
+        archive = ArchiveStore(old_path)
+        print(f"previous-scheme archive re-keyed: {before} -> {len(archive)} entries in {time.perf_counter() - start:.3f}s")
+        archive.close()
+    finally:
+        shutil.rmtree(directory)
+
+    assert all(archive_key(p['ip'], p['port'], p['secret']) == p['archive_key'] for p in proxies)
+    assert canonical_secret('dd' + '00' * 16) == canonical_secret('00' * 16)
+
+
+if __name__ == '__main__':
+    main()
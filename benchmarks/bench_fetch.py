@@ -0,0 +1,88 @@
+"""
+Benchmark: sequential vs concurrent subscription fetching.
+Spins up several local HTTP servers (one "host" each) serving a mix of slow and fast feeds,
+then times the old one-by-one requests.get loop against get_proxies_from_links.
+
+Usage: python benchmarks/bench_fetch.py [--hosts 4] [--feeds-per-host 12] [--slow-ratio 0.25] [--slow-delay 1.0]
+"""
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import time
+
+from local_servers import SubscriptionServer, synthetic_proxy_lines
+
+import requests
+import proxy_poster
+
+
+def sequential_fetch(links):
+    """The pre-concurrency implementation: one requests.get per link, in order."""
+    raw_proxies = []
+    for link in links:
+        try:
+            response = requests.get(link, timeout=15)
+            response.raise_for_status()
+            raw_proxies.extend(
+                line.strip() for line in response.text.splitlines()
+                if line.strip().startswith('tg://proxy?') or line.strip().startswith('https://t.me/proxy?')
+            )
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching proxies from {link}: {e}")
+    return [p.strip() for p in raw_proxies if p.strip() and not p.strip().startswith('#')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=4)
+    parser.add_argument('--feeds-per-host', type=int, default=12)
+    parser.add_argument('--slow-ratio', type=float, default=0.25)
+    parser.add_argument('--slow-delay', type=float, default=1.0)
+    parser.add_argument('--fast-delay', type=float, default=0.02)
+    parser.add_argument('--lines-per-feed', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=proxy_poster.FETCH_WORKERS)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    slow_every = max(1, round(1 / args.slow_ratio)) if args.slow_ratio > 0 else 0
+    servers = []
+    for h in range(args.hosts):
+        routes = {}
+        for f in range(args.feeds_per_host):
+            n = h * args.feeds_per_host + f
+            slow = slow_every and n % slow_every == 0
+            routes[f'/feed/{f}'] = {
+                'body': '\n'.join(synthetic_proxy_lines(args.lines_per_feed, start=n * args.lines_per_feed // 2)),
+                'delay': args.slow_delay if slow else args.fast_delay,
+            }
+        servers.append(SubscriptionServer(routes))
+
+    with contextlib.ExitStack() as stack:
+        for server in servers:
+            stack.enter_context(server)
+        links = [server.url(path) for server in servers for path in server.routes]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            subscription_file = os.path.join(tmp, 'subscriptions.txt')
+            with open(subscription_file, 'w') as f:
+                f.write('\n'.join(links) + '\n')
+
+            start = time.perf_counter()
+            sequential = sequential_fetch(links)
+            sequential_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            concurrent = proxy_poster.get_proxies_from_links(subscription_file, workers=args.workers)
+            concurrent_seconds = time.perf_counter() - start
+
+    print(f"feeds: {len(links)} on {args.hosts} hosts ({args.slow_ratio:.0%} slow at {args.slow_delay}s), workers: {args.workers}")
+    print(f"sequential: {sequential_seconds:8.2f}s  {len(sequential)} links")
+    print(f"concurrent: {concurrent_seconds:8.2f}s  {len(concurrent)} links  ({sequential_seconds / concurrent_seconds:.1f}x)")
+    print(f"identical output order: {sequential == concurrent}")
+    print(f"identical unique set:   {set(sequential) == set(concurrent)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark: concurrent proxy health checks against local listeners.
+Proxies are spread over loopback addresses (127.0.1.x, one "host" each) whose listeners answer
+the fake-TLS handshake after a random delay, drop a share of connections, never answer, close
+right away, refuse connections or never accept them (connect timeouts).
+Each configuration reports checks/sec, p50/p99 duration of a check attempt and the resulting status counts.
+Finally checks that out-of-range ports and hostnames the idna codec rejects come out dead.
+
+Usage: python benchmarks/bench_health_check.py [--proxies 2000] [--hosts 50] [--max-delay 0.05] [--timeout 1.0]
+"""
+import argparse
+import random
+import socket
+import time
+
+from local_servers import FakeTLSProxyServer, unused_loopback_port
+
+from health_check import STATUS_ALIVE, STATUS_DEAD, ProxyHealthChecker
+
+
+class TimedHealthChecker(ProxyHealthChecker):
+    """Records how long each check attempt took (not counting time spent waiting for a slot)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.durations = []
+
+    async def _check_once(self, host, port, secret):
+        start = time.perf_counter()
+        result = await super()._check_once(host, port, secret)
+        self.durations.append(time.perf_counter() - start)
+        return result
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def build_hosts(count, max_delay, rng):
+    """Returns (listeners for FakeTLSProxyServer, [(behavior, host)]) for count loopback hosts."""
+    listeners, hosts = [], []
+    for i in range(count):
+        host = f'127.0.1.{i + 1}'
+        share = i / count
+        if share < 0.6:
+            behavior = 'ok'
+            listeners.append({'host': host, 'behavior': 'ok', 'delay': rng.uniform(0, max_delay), 'drop_rate': 0.05})
+        elif share < 0.7:
+            behavior = 'silent'
+            listeners.append({'host': host, 'behavior': 'silent'})
+        elif share < 0.8:
+            behavior = 'close'
+            listeners.append({'host': host, 'behavior': 'close'})
+        elif share < 0.9:
+            behavior = 'refused'
+        else:
+            behavior = 'blackhole'
+        hosts.append((behavior, host))
+    return listeners, hosts
+
+
+def check_malformed(hosts, ports, secret):
+    """Feed lines the parser lets through but no socket accepts must come out dead, not end the run."""
+    healthy = next(host for behavior, host in hosts if behavior == 'ok')
+    proxies = [
+        {'ip': healthy, 'port': str(ports[healthy]), 'secret': secret},
+        {'ip': healthy, 'port': '70000', 'secret': secret},
+        {'ip': healthy, 'port': '-1', 'secret': secret},
+        {'ip': 'a' * 64 + '.example.com', 'port': '443', 'secret': secret}, # Label too long for idna
+    ]
+    ProxyHealthChecker(connect_timeout=1.0, retries=0).check_many(proxies)
+    statuses = [proxy['status'] for proxy in proxies]
+    assert statuses == [STATUS_ALIVE, STATUS_DEAD, STATUS_DEAD, STATUS_DEAD], statuses
+    print(f"malformed ports/hostnames: {', '.join(statuses[1:])} (healthy neighbour: {statuses[0]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--proxies', type=int, default=2000)
+    parser.add_argument('--hosts', type=int, default=50)
+    parser.add_argument('--max-delay', type=float, default=0.05, help='max handshake reply delay of healthy listeners')
+    parser.add_argument('--timeout', type=float, default=1.0, help='connect and handshake timeout')
+    parser.add_argument('--retries', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    key = bytes(range(16))
+    domain = 'example.com'
+    secret = 'ee' + key.hex() + domain.encode().hex()
+    listeners, hosts = build_hosts(args.hosts, args.max_delay, rng)
+
+    blackholes = []
+    with FakeTLSProxyServer(listeners, key):
+        ports = {listener['host']: listener['port'] for listener in listeners}
+        for behavior, host in hosts:
+            if behavior == 'refused':
+                ports[host] = unused_loopback_port(host)
+            elif behavior == 'blackhole':
+                # Listening socket that never accepts: once its backlog is full, SYNs are dropped
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.bind((host, 0))
+                sock.listen(0)
+                blackholes.append(sock)
+                ports[host] = sock.getsockname()[1]
+
+        def make_proxies(count):
+            proxies = []
+            for i in range(count):
+                _, host = hosts[i % len(hosts)]
+                proxies.append({'ip': host, 'port': str(ports[host]), 'secret': secret, 'raw': f'proxy-{i}'})
+            return proxies
+
+        print(f"proxies: {args.proxies} on {args.hosts} hosts, timeout {args.timeout}s, retries {args.retries}")
+        print(f"{'mode':<10} {'concurrency':>11} {'checks':>7} {'seconds':>8} {'checks/s':>9} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+        configurations = [
+            ('tcp', 1, min(args.proxies, 100)), # Sequential baseline on a subset
+            ('tcp', 100, args.proxies),
+            ('tcp', 500, args.proxies),
+            ('fake-tls', 1, min(args.proxies, 100)),
+            ('fake-tls', 100, args.proxies),
+            ('fake-tls', 500, args.proxies),
+        ]
+        for mode, concurrency, count in configurations:
+            checker = TimedHealthChecker(concurrency=concurrency, per_host_concurrency=max(1, concurrency // 10),
+                                         connect_timeout=args.timeout, handshake_timeout=args.timeout,
+                                         retries=args.retries, retry_jitter=0.05,
+                                         fake_tls_handshake=(mode == 'fake-tls'))
+            proxies = make_proxies(count)
+            start = time.perf_counter()
+            checker.check_many(proxies)
+            seconds = time.perf_counter() - start
+            statuses = ', '.join(f"{n} {status}" for status, n in sorted(checker.status_counts.items()))
+            print(f"{mode:<10} {concurrency:>11} {count:>7} {seconds:>8.2f} {count / seconds:>9.0f} "
+                  f"{percentile(checker.durations, 0.5) * 1000:>8.1f} {percentile(checker.durations, 0.99) * 1000:>8.1f}  {statuses}")
+
+        check_malformed(hosts, ports, secret)
+
+    for sock in blackholes:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
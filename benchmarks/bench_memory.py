@@ -0,0 +1,100 @@
+"""
+Benchmark: peak memory of the materialized-list ingest path vs the streaming pipeline.
+Serves a synthetic multi-million-line feed from a local HTTP server and measures the peak of
+Python allocations (tracemalloc) while fetching, parsing, deduplicating and archive-checking it.
+
+Usage: python benchmarks/bench_memory.py [--lines 2000000] [--unique 20000] [--feeds 4]
+tracemalloc slows allocation-heavy code down considerably; the default size takes several minutes.
+"""
+import argparse
+import gc
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from local_servers import SubscriptionServer, synthetic_proxy_lines
+
+import requests
+import proxy_poster
+from archive_store import archive_key_from_link
+
+
+def legacy_ingest(links, archived):
+    """The pre-streaming path: whole bodies -> list of lines -> stripped list -> parsed list."""
+    raw_proxies = []
+    for link in links:
+        response = requests.get(link, timeout=15)
+        response.raise_for_status()
+        content = response.text
+        raw_proxies.extend(
+            line.strip() for line in content.splitlines()
+            if line.strip().startswith('tg://proxy?') or line.strip().startswith('https://t.me/proxy?')
+        )
+    raw_proxies = [p.strip() for p in raw_proxies if p.strip() and not p.strip().startswith('#')]
+
+    proxies_to_post = []
+    encountered = set()
+    for original_raw_link in raw_proxies:
+        proxy_details = proxy_poster.parse_telegram_proxy_link(original_raw_link)
+        if not proxy_details or proxy_details['raw'] in encountered:
+            continue
+        encountered.add(proxy_details['raw'])
+        if proxy_details['raw'] in archived:
+            continue
+        proxies_to_post.append(proxy_poster.check_proxy(proxy_details))
+    return len(proxies_to_post)
+
+
+def streaming_ingest(subscription_file, archived):
+    stream = proxy_poster.iter_proxies_to_post(
+        proxy_poster.iter_proxies_from_links(subscription_file), archived
+    )
+    return sum(1 for _ in stream)
+
+
+def measure(label, fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:10s} peak {peak / 2**20:9.1f} MiB  {seconds:7.1f}s  {result} proxies to post")
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=2_000_000)
+    parser.add_argument('--unique', type=int, default=20_000)
+    parser.add_argument('--feeds', type=int, default=4)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    unique_lines = synthetic_proxy_lines(args.unique)
+    per_feed = args.lines // args.feeds
+    routes = {}
+    for f in range(args.feeds):
+        body = '\n'.join(unique_lines[(f * per_feed + i) % args.unique] for i in range(per_feed)) + '\n'
+        routes[f'/feed/{f}'] = {'body': body.encode()}
+    # A quarter of the unique proxies were posted in earlier runs
+    archived = set(unique_lines[::4])
+    archived_keys = {archive_key_from_link(line) for line in archived}
+
+    with SubscriptionServer(routes) as server, tempfile.TemporaryDirectory() as tmp:
+        links = [server.url(path) for path in routes]
+        subscription_file = os.path.join(tmp, 'subscriptions.txt')
+        with open(subscription_file, 'w') as f:
+            f.write('\n'.join(links) + '\n')
+
+        print(f"feed: {per_feed * args.feeds} lines in {args.feeds} subscriptions, {args.unique} unique proxies")
+        legacy_peak = measure('legacy', legacy_ingest, links, archived)
+        streaming_peak = measure('streaming', streaming_ingest, subscription_file, archived_keys)
+        print(f"peak memory reduced {legacy_peak / streaming_peak:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
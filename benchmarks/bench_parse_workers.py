@@ -0,0 +1,72 @@
+"""
+Benchmark: serial vs multi-process parse/dedup (iter_unique_proxies vs iter_unique_proxies_parallel).
+Feeds a synthetic aggregated feed (exact repeats plus variants of the same endpoint written
+differently: upper-case host, extra tag, t.me form) through the serial stage and through the
+process-pool stage with 1, 2, 4 and 8 workers, checks that every run yields exactly the serial
+output and stats, and reports lines/s. Speedups need that many free cores.
+
+Usage: python benchmarks/bench_parse_workers.py [--lines 500000] [--unique 100000] [--workers 1 2 4 8]
+"""
+import argparse
+import logging
+import os
+import random
+import time
+
+import local_servers # noqa: F401 (puts src/ on sys.path)
+import proxy_poster
+
+
+def synthetic_feed(lines, unique, seed=5):
+    rng = random.Random(seed)
+    feed = []
+    for i in range(lines):
+        n = i if i < unique else rng.randrange(unique)
+        server = f'host{n}.example.com'
+        link = f'tg://proxy?server={server}&port={443 + n % 7}&secret=ee{n:032x}'
+        variant = rng.random()
+        if variant < 0.05:
+            link = link.replace(server, server.upper())
+        elif variant < 0.10:
+            link += '&tag=abc'
+        elif variant < 0.15:
+            link = link.replace('tg://proxy?', 'https://t.me/proxy?')
+        elif variant < 0.16:
+            link = 'tg://proxy?port=443' # Unparsable: no server
+        feed.append(link)
+    return feed
+
+
+def run(label, feed, workers):
+    proxy_poster._parse_telegram_proxy_link_cached.cache_clear() # Cold parse cache for every run (workers fork from it)
+    stats = {'raw': 0, 'parsed': 0, 'duplicates': 0, 'stopped_early': False}
+    start = time.perf_counter()
+    if workers:
+        output = list(proxy_poster.iter_unique_proxies_parallel(feed, workers, stats=stats))
+    else:
+        output = list(proxy_poster.iter_unique_proxies(feed, stats=stats))
+    return output, stats, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--unique', type=int, default=100000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    feed = synthetic_feed(args.lines, args.unique)
+    print(f"lines: {args.lines}, unique endpoints: {args.unique}, cores available: {os.cpu_count()}")
+    serial, serial_stats, serial_seconds = run('serial', feed, 0)
+    print(f"{'serial':<10} {serial_seconds:8.2f}s {args.lines / serial_seconds:>12,.0f} lines/s  "
+          f"{len(serial)} unique, stats {serial_stats}")
+    for workers in args.workers:
+        output, stats, seconds = run(f'{workers} workers', feed, workers)
+        identical = output == serial and stats == serial_stats
+        print(f"{f'{workers} workers':<10} {seconds:8.2f}s {args.lines / seconds:>12,.0f} lines/s  "
+              f"({serial_seconds / seconds:.2f}x)  identical to serial: {identical}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Microbenchmark: legacy urlparse/parse_qs proxy parser vs the fast-path parser with memo cache.
+Runs both over the posted links of the archive (data/archive.txt, or data/archive.db once it has
+been migrated; generated links if neither exists), plus https://t.me variants and tricky edge
+cases, checks that their outputs are identical, and reports lines/sec.
+
+Usage: python benchmarks/bench_parser.py [--archive data/archive.txt] [--repeat 20]
+"""
+import argparse
+import logging
+import time
+from urllib.parse import urlparse, parse_qs
+
+from local_servers import read_archive_links # (also puts src/ on sys.path)
+import proxy_poster
+
+EDGE_CASES = [
+    'tg://proxy?server=1.2.3.4&port=443&secret=',
+    'tg://proxy?server=1.2.3.4&port=443',
+    'tg://proxy?server=1.2.3.4&port=443&secret=abcAAA',
+    'tg://proxy?server=1.2.3.4&port=443&secret=AAAA',
+    'tg://proxy?server=1.2.3.4&port=443&secret=' + 'b' * 60 + 'AA',
+    'tg://proxy?server=1.2.3.4&port=443&secret=ee00&tag=abc',
+    'tg://proxy?server=1.2.3.4&port=443&secret=ee00&tag=',
+    'tg://proxy?server=1.2.3.4&port=443&secret=ee00&secret=dd11',
+    'tg://proxy?secret=&secret=dd11&server=1.2.3.4&port=443',
+    'tg://proxy?server=1.2.3.4&port=443&secret=ee%2B00+11',
+    'tg://proxy?server=%31.2.3.4&po%72t=443&secret=ee00',
+    'tg://proxy?server=1.2.3.4&port=443&secret=ee00#fragment&tag=x',
+    'tg://proxy?server=1.2.3.4&port=4\t43&secret=ee00',
+    'tg://proxy?server=1.2.3.4&port&secret=ee00',
+    'tg://proxy?&&server=1.2.3.4&&port=443&secret=ee00&',
+    'tg://proxy?server=1.2.3.4;port=443&secret=ee00',
+    'tg://proxy?server=host.example.com&port=443&secret=7gAAAAAAAAAAAAAAAAAAAAAAAAA',
+    'https://t.me/proxy?server=1.2.3.4&port=443&secret=ee00?x=1',
+    'https://t.me/proxy?server=%E2%9C%93&port=443&secret=%ZZ',
+    'tg://socks?server=1.2.3.4&port=443',
+]
+
+
+def legacy_parse_telegram_proxy_link(proxy_link):
+    """The urlparse/parse_qs implementation the fast path replaced (logging and geolocation removed)."""
+    parsed = {'original_raw': proxy_link, 'type': 'Telegram'}
+    try:
+        if proxy_link.startswith('https://t.me/proxy?'):
+            link_to_parse = 'tg://proxy?' + proxy_link.split('?', 1)[1]
+        elif proxy_link.startswith('tg://proxy?'):
+            link_to_parse = proxy_link
+        else:
+            return None
+        query_params = parse_qs(urlparse(link_to_parse).query)
+        server = query_params.get('server', [None])[0]
+        port = query_params.get('port', [None])[0]
+        secret = query_params.get('secret', [None])[0]
+        if server is None or port is None:
+            return None
+        processed_secret = proxy_poster.process_secret_with_heuristic(secret)
+        if processed_secret is None:
+            return None
+        parsed['ip'] = server
+        parsed['port'] = port
+        parsed['secret'] = processed_secret
+        # Geolocation is a separate stage after deduplication; parsing leaves placeholders
+        parsed['country'] = 'Unknown'
+        parsed['country_emoji'] = ''
+        parsed['country_code'] = ''
+        parsed['raw'] = f"tg://proxy?server={parsed['ip']}&port={parsed['port']}&secret={processed_secret}"
+        if 'tag' in query_params and query_params['tag'][0] is not None:
+            parsed['raw'] += f"&tag={query_params['tag'][0]}"
+        return parsed
+    except Exception:
+        return None
+
+
+def lines_per_second(parse, lines, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            parse(line)
+    return len(lines) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', help="text file of proxy links (default: the archive in data/)")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    archive_lines, source = read_archive_links(args.archive)
+    print(f"Links from {source}")
+    lines = archive_lines + ['https://t.me/proxy?' + line.split('?', 1)[1] for line in archive_lines]
+
+    def fast_parse_without_key(line):
+        # archive_key is an extra field the legacy parser never produced
+        parsed = proxy_poster.parse_telegram_proxy_link(line)
+        if parsed is not None:
+            del parsed['archive_key']
+        return parsed
+
+    # Compare values and key order
+    mismatches = [
+        line for line in lines + EDGE_CASES
+        if list((legacy_parse_telegram_proxy_link(line) or {}).items()) != list((fast_parse_without_key(line) or {}).items())
+        or (legacy_parse_telegram_proxy_link(line) is None) != (fast_parse_without_key(line) is None)
+    ]
+    print(f"{len(lines)} archive lines + {len(EDGE_CASES)} edge cases, mismatches: {len(mismatches)}")
+    for line in mismatches[:10]:
+        print(f"  MISMATCH {line!r}")
+
+    legacy = lines_per_second(legacy_parse_telegram_proxy_link, lines, args.repeat)
+    # Cold: every line is new to the memo cache, so this measures the scanner itself
+    proxy_poster._parse_telegram_proxy_link_cached.cache_clear()
+    start = time.perf_counter()
+    for line in lines:
+        proxy_poster.parse_telegram_proxy_link(line)
+    cold = len(lines) / (time.perf_counter() - start)
+    # Warm: repeated lines, as in aggregated feeds where most lines are duplicates
+    warm = lines_per_second(proxy_poster.parse_telegram_proxy_link, lines, args.repeat)
+
+    print(f"legacy urlparse/parse_qs: {legacy:12,.0f} lines/sec")
+    print(f"fast path (cold cache):   {cold:12,.0f} lines/sec  ({cold / legacy:.1f}x)")
+    print(f"fast path (warm cache):   {warm:12,.0f} lines/sec  ({warm / legacy:.1f}x)")
+    print(proxy_poster.parse_cache_stats_line())
+
+
+if __name__ == '__main__':
+    main()
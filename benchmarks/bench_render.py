@@ -0,0 +1,113 @@
+"""
+Benchmark: message rendering, legacy formatter vs src/message_renderer.py.
+Renders chunks of synthetic proxies (including the edge cases the formatter branches on: missing
+raw link, unknown country, MarkdownV2 special characters) with the formatter that used to live in
+post_proxies_chunk_to_telegram and with render_messages, checks that text and reply markup are
+byte-identical, and reports messages rendered per second. "warm" re-renders the same records
+(as when a chunk is retried), which hits the per-proxy fragment cache.
+
+Usage: python benchmarks/bench_render.py [--messages 20000] [--per-message 9]
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+import local_servers # noqa: F401 (puts src/ on sys.path)
+from message_renderer import render_messages
+
+
+def legacy_escape_markdown_v2(text):
+    escape_chars = r'_*[]()~`>#+-=|{}.!'
+    return re.sub(r'([%s])' % re.escape(escape_chars), r'\\\1', str(text))
+
+
+def legacy_render(proxies_chunk):
+    """Message text and reply markup as built by the previous post_proxies_chunk_to_telegram."""
+    message_lines = []
+    inline_buttons = []
+    for i, proxy_details in enumerate(proxies_chunk):
+        ip_port_text = f"{proxy_details.get('ip', 'N/A')}:{proxy_details.get('port', 'N/A')}"
+        raw_link = proxy_details.get('raw', '')
+        ip_port_text_escaped = legacy_escape_markdown_v2(ip_port_text)
+        raw_link_escaped = legacy_escape_markdown_v2(raw_link)
+        address_line = f"🔒 Address & Port: [{ip_port_text_escaped}]({raw_link_escaped})" if raw_link else f"🔒 Address & Port: {ip_port_text_escaped}"
+        message_lines.append(address_line)
+        country_name = proxy_details.get('country', 'Unknown')
+        country_emoji = proxy_details.get('country_emoji', '')
+        country_line = f"🌎 Country: {country_emoji} {legacy_escape_markdown_v2(country_name)}" if country_name != 'Unknown' else f"🌎 Country: {legacy_escape_markdown_v2(country_name)}"
+        message_lines.append(country_line)
+        if i < len(proxies_chunk) - 1:
+            message_lines.append("")
+        button_url = proxy_details.get('raw', '')
+        if button_url:
+            inline_buttons.append({'text': "Connect", 'url': button_url})
+    message_lines.append("\n@NexuProxy")
+    message_text = "\n".join(message_lines)
+    reply_markup = None
+    if inline_buttons:
+        inline_keyboard = []
+        row = []
+        for i, button in enumerate(inline_buttons):
+            row.append(button)
+            if (i + 1) % 3 == 0 or (i + 1) == len(inline_buttons):
+                inline_keyboard.append(row)
+                row = []
+        reply_markup = json.dumps({'inline_keyboard': inline_keyboard})
+    return message_text, reply_markup
+
+
+COUNTRIES = [('Germany', '🇩🇪', 'DE'), ('United States', '🇺🇸', 'US'), ('Iran', '🇮🇷', 'IR'),
+             ('Bosnia and Herzegovina', '🇧🇦', 'BA'), ('Unknown', '', '')]
+
+
+def synthetic_proxy(rng, n):
+    server = rng.choice([f'10.{n >> 8 & 255}.{n & 255}.7', f'proxy-{n}.example.com', f'2001:db8::{n:x}'])
+    secret = rng.choice([f'ee{n:032x}', f'dd{n:032x}', f'7gAA_{n}-xyz', ''])
+    raw = f'tg://proxy?server={server}&port={443 + n % 5}&secret={secret}' + ('&tag=a.b' if n % 11 == 0 else '')
+    country, emoji, code = rng.choice(COUNTRIES)
+    proxy = {'ip': server, 'port': str(443 + n % 5), 'secret': secret, 'raw': raw,
+             'country': country, 'country_emoji': emoji, 'country_code': code}
+    if n % 17 == 0:
+        proxy['raw'] = '' # No link: no hyperlink and no button
+    if n % 23 == 0:
+        del proxy['ip'] # Missing fields fall back to N/A
+    return proxy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--per-message', type=int, default=9)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    chunks = []
+    for m in range(args.messages):
+        size = args.per_message if m % 10 else rng.randint(1, args.per_message) # Some short last chunks
+        chunks.append([synthetic_proxy(rng, m * args.per_message + i) for i in range(size)])
+
+    start = time.perf_counter()
+    legacy = [legacy_render(chunk) for chunk in chunks]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rendered = render_messages(chunks)
+    cold_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    render_messages(chunks)
+    warm_seconds = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(legacy, rendered) if a != b)
+    longest = max(len(text) for text, _ in rendered)
+    print(f"messages: {args.messages}, up to {args.per_message} proxies each (longest text {longest} chars)")
+    print(f"legacy formatter: {args.messages / legacy_seconds:>10,.0f} messages/s")
+    print(f"renderer (cold):  {args.messages / cold_seconds:>10,.0f} messages/s  ({legacy_seconds / cold_seconds:.1f}x)")
+    print(f"renderer (warm):  {args.messages / warm_seconds:>10,.0f} messages/s  ({legacy_seconds / warm_seconds:.1f}x)")
+    print(f"byte-identical: {mismatches == 0} ({mismatches} mismatches)")
+
+
+if __name__ == '__main__':
+    main()
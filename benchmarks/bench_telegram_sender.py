@@ -0,0 +1,139 @@
+"""
+Benchmark: legacy Telegram posting vs the rate-limited TelegramSender, against a local fake Bot API.
+The fake API enforces a per-chat interval slightly longer than the one the client is configured
+with (as when other admins or bots post to the same channel), answers violations with 429 and a
+retry_after, and fails every few requests with a 500.
+The legacy path posts with a new requests.post per message, sleeps a fixed time on 429 and never
+retries; the sender honors retry_after, retries transient errors and re-queues failed chunks.
+Times are scaled down (seconds instead of minutes).
+Finally checks with a fake clock that a 429 is resent after retry_after even when the chat interval is longer.
+
+Usage: python benchmarks/bench_telegram_sender.py [--messages 30] [--post-delay 0.25] [--server-interval 0.3]
+"""
+import argparse
+import json
+import logging
+import time
+from collections import deque
+
+from local_servers import FakeBotAPI
+
+import requests
+from telegram_sender import TelegramSender
+
+CHAT_ID = -100123
+
+
+def legacy_post(api_url, messages, post_delay, flood_sleep):
+    """The pre-sender behavior: fresh request per message, fixed sleep on 429, no retries."""
+    delivered = 0
+    for i, text in enumerate(messages):
+        try:
+            response = requests.post(f'{api_url}/sendMessage', json={'chat_id': CHAT_ID, 'text': text})
+            response.raise_for_status()
+            delivered += 1
+            if i < len(messages) - 1:
+                time.sleep(post_delay)
+        except requests.exceptions.RequestException as e:
+            if e.response is not None and e.response.status_code == 429:
+                time.sleep(flood_sleep)
+    return delivered
+
+
+def sender_post(api_url, messages, post_delay, max_chunk_attempts=3):
+    """The main() loop with TelegramSender and a retry queue for failed chunks."""
+    sender = TelegramSender(api_url, chat_interval=post_delay, max_attempts=3, backoff_seconds=0.05)
+    pending = deque((text, 1) for text in messages)
+    delivered = 0
+    while pending:
+        text, attempts = pending.popleft()
+        result = sender.send_message(CHAT_ID, {'text': text})
+        if result:
+            delivered += 1
+        elif result is None and attempts < max_chunk_attempts:
+            pending.append((text, attempts + 1))
+    sender.close()
+    return delivered
+
+
+class FakeClock:
+    """clock/sleep pair for TelegramSender that advances time instead of sleeping."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ScriptedResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+class ScriptedSession:
+    """Stands in for the sender's session, replying to each post with the next scripted (status, data)."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def post(self, url, json=None, timeout=None):
+        return ScriptedResponse(*self.replies.pop(0))
+
+    def close(self):
+        pass
+
+
+def check_retry_after(chat_interval=600.0, retry_after=5):
+    """With a long chat interval, a 429 must be retried after retry_after, not after a fresh chat token."""
+    fake = FakeClock()
+    sender = TelegramSender('http://fake', chat_interval=chat_interval, clock=fake.clock, sleep=fake.sleep)
+    sender.session = ScriptedSession([
+        (429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': retry_after}}),
+        (200, {'ok': True, 'result': {'message_id': 1}}),
+    ])
+    delivered = sender.send_message(CHAT_ID, {'text': 'message'})
+    assert delivered and fake.sleeps == [retry_after], (delivered, fake.sleeps)
+    print(f"429 with retry_after={retry_after}s at a {chat_interval:.0f}s chat interval: resent after {sum(fake.sleeps):.0f}s")
+
+
+def run(label, post, args):
+    with FakeBotAPI(min_interval=args.server_interval, flood_wait=args.flood_wait, error_every=args.error_every) as api:
+        messages = [f'message {i}' for i in range(args.messages)]
+        start = time.perf_counter()
+        delivered = post(api.api_url, messages)
+        seconds = time.perf_counter() - start
+        in_order = [text for _, text in api.messages] == sorted((text for _, text in api.messages), key=lambda t: int(t.split()[1]))
+        print(f"{label:<8} {delivered:>4}/{args.messages:<4} {api.request_count:>9} {api.rate_limited_count:>6} "
+              f"{seconds:>8.2f} {delivered / seconds:>12.2f}  {in_order}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=30)
+    parser.add_argument('--post-delay', type=float, default=0.25, help='configured delay between posts')
+    parser.add_argument('--server-interval', type=float, default=0.3, help='per-chat interval enforced by the fake API')
+    parser.add_argument('--flood-wait', type=float, default=1.0, help='retry_after returned with 429 replies')
+    parser.add_argument('--legacy-flood-sleep', type=float, default=3.0, help='fixed legacy sleep on 429 (60s scaled down)')
+    parser.add_argument('--error-every', type=int, default=7, help='every n-th request fails with a 500')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    print(f"{'':<8} {'delivered':>9} {'requests':>9} {'429s':>6} {'seconds':>8} {'delivered/s':>12}  in order")
+    run('legacy', lambda url, messages: legacy_post(url, messages, args.post_delay, args.legacy_flood_sleep), args)
+    run('sender', lambda url, messages: sender_post(url, messages, args.post_delay), args)
+    check_retry_after()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+"""
+Local HTTP stand-ins used by the benchmark scripts.
+Nothing here talks to the network; every server binds to a loopback address on a free port.
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Make the modules in src/ importable the same way `python src/proxy_poster.py` sees them
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+
+class SubscriptionServer:
+    """
+    Serves subscription feeds from memory.
+    routes maps a path (e.g. '/fast/1') to a dict with 'body' (str or bytes), optional 'delay' (seconds),
+    optional 'status' (HTTP status code, default 200) and optional 'etag' (enables 304 replies).
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.request_count = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, like a real CDN
+            disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                route = server.routes.get(self.path)
+                if route is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if route.get('delay'):
+                    time.sleep(route['delay'])
+                if route.get('etag') and self.headers.get('If-None-Match') == route['etag']:
+                    self.send_response(304)
+                    self.send_header('ETag', route['etag'])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = route.get('body', '')
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(route.get('status', 200))
+                if route.get('etag'):
+                    self.send_header('ETag', route['etag'])
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Keep benchmark output readable
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return self.base_url + path
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeBotAPI:
+    """
+    Minimal stand-in for the Telegram Bot API sendMessage method.
+    Per chat, a message arriving less than min_interval seconds after the last accepted one gets a
+    429 reply with parameters.retry_after = flood_wait, and the chat stays blocked for that long
+    (further messages in that window get 429s too, as with Telegram). Every error_every-th request
+    gets a 500. Accepted messages are kept in .messages as (chat_id, text) in arrival order.
+    Use api_url as the sender's API base URL.
+    """
+
+    def __init__(self, min_interval=0.0, flood_wait=1.0, error_every=0):
+        self.min_interval = min_interval
+        self.flood_wait = flood_wait
+        self.error_every = error_every
+        self.messages = []
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._last_accepted = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self.path.endswith('/sendMessage'):
+                    return self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                payload = json.loads(body)
+                chat_id = payload.get('chat_id')
+                with server._lock:
+                    server.request_count += 1
+                    now = time.monotonic()
+                    if server.error_every and server.request_count % server.error_every == 0:
+                        return self._reply(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+                    last = server._last_accepted.get(chat_id)
+                    if now < server._blocked_until.get(chat_id, 0) or (last is not None and now - last < server.min_interval):
+                        server.rate_limited_count += 1
+                        server._blocked_until[chat_id] = max(server._blocked_until.get(chat_id, 0), now + server.flood_wait)
+                        return self._reply(429, {'ok': False, 'error_code': 429,
+                                                 'description': f'Too Many Requests: retry after {server.flood_wait}',
+                                                 'parameters': {'retry_after': server.flood_wait}})
+                    server._last_accepted[chat_id] = now
+                    server.messages.append((chat_id, payload.get('text')))
+                    message_id = len(server.messages)
+                self._reply(200, {'ok': True, 'result': {'message_id': message_id}})
+
+            def _reply(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.api_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/botTEST'
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StubDNSServer:
+    """
+    Minimal UDP DNS server answering A queries from a {hostname: (ip, ttl)} map.
+    Unknown names get NXDOMAIN; names mapped to None are never answered (to exercise timeouts).
+    Use as nameserver=f'127.0.0.1:{server.port}'.
+    """
+
+    def __init__(self, records, delay=0.0):
+        self.records = records
+        self.delay = delay
+        self.query_count = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self):
+        while self._running:
+            try:
+                query, addr = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.query_count += 1
+            threading.Thread(target=self._answer, args=(query, addr), daemon=True).start()
+
+    def _answer(self, query, addr):
+        query_id = struct.unpack('!H', query[:2])[0]
+        offset, labels = 12, []
+        while query[offset]:
+            labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+            offset += query[offset] + 1
+        question = query[12:offset + 5]
+        hostname = '.'.join(labels)
+        if hostname in self.records and self.records[hostname] is None:
+            return
+        if self.delay:
+            time.sleep(self.delay)
+        record = self.records.get(hostname)
+        flags, answers = (0x8180, 1) if record else (0x8183, 0)
+        response = struct.pack('!HHHHHH', query_id, flags, 1, answers, 0, 0) + question
+        if record:
+            ip, ttl = record
+            response += b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, ttl, 4) + socket.inet_aton(ip)
+        self.sock.sendto(response, addr)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._running = False
+        self.sock.close()
+
+
+class FakeTLSProxyServer:
+    """
+    Loopback MTProto fake-TLS proxy stand-ins for health check benchmarks.
+    listeners is a list of dicts with 'host' (a 127.x.y.z address) and 'behavior':
+      'ok'      - verifies the client hello against key and answers with a signed server hello
+      'silent'  - accepts connections and never answers
+      'close'   - accepts connections and closes them right away
+    plus optional 'delay' (seconds before answering) and 'drop_rate' (fraction of connections
+    closed without an answer). After start, each listener dict gets its bound 'port'.
+    All listeners run on one asyncio loop in a background thread.
+    """
+
+    def __init__(self, listeners, key, seed=0):
+        self.listeners = listeners
+        self.key = key
+        self.random = random.Random(seed)
+        self.loop = asyncio.new_event_loop()
+        self._servers = []
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def _handle(self, listener, reader, writer):
+        try:
+            if listener['behavior'] == 'close' or self.random.random() < listener.get('drop_rate', 0):
+                return
+            if listener['behavior'] == 'silent':
+                await reader.read()
+                return
+            header = await reader.readexactly(5)
+            hello = header + await reader.readexactly(struct.unpack('!H', header[3:5])[0])
+            if listener.get('delay'):
+                await asyncio.sleep(listener['delay'])
+            zeroed = hello[:11] + b'\x00' * 32 + hello[43:]
+            expected = hmac.new(self.key, zeroed, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected[:28], hello[11:39]):
+                return
+            server_hello = b'\x02\x00\x00\x46\x03\x03' + b'\x00' * 32 + b'\x20' + hello[44:76] + b'\x13\x01\x00' + b'\x00' * 6
+            response = bytearray(b'\x16\x03\x03' + struct.pack('!H', len(server_hello)) + server_hello
+                                 + b'\x14\x03\x03\x00\x01\x01'
+                                 + b'\x17\x03\x03\x00\x40' + os.urandom(64))
+            response[11:43] = hmac.new(self.key, hello[11:43] + bytes(response), hashlib.sha256).digest()
+            writer.write(bytes(response))
+            await writer.drain()
+            await reader.read()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _start(self):
+        for listener in self.listeners:
+            server = await asyncio.start_server(
+                lambda r, w, listener=listener: self._handle(listener, r, w), listener['host'], 0, backlog=4096
+            )
+            listener['port'] = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+
+    async def _stop(self):
+        for server in self._servers:
+            server.close()
+
+    def __enter__(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+def unused_loopback_port(host='127.0.0.1'):
+    """Returns a port on host that nothing listens on (connections to it are refused)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def synthetic_proxy_lines(count, start=0, duplicate_every=0):
+    """Generates tg://proxy links; every duplicate_every-th line repeats an earlier one."""
+    lines = []
+    for i in range(start, start + count):
+        n = i
+        if duplicate_every and i % duplicate_every == 0 and i > start:
+            n = start + (i - start) // 2
+        lines.append(f"tg://proxy?server=10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}&port={443 + n % 7}&secret=ee{n:032x}")
+    return lines
+
+
+def read_archive_links(path=None, synthetic_count=20000):
+    """
+    Returns the posted proxy links to benchmark on: the lines of path, or else of data/archive.txt,
+    or else the raw links in data/archive.db (the first run migrates the text file into it and
+    deletes it), or else synthetic_count generated links. Also returns where they came from.
+    """
+    text_path = path or os.path.join(DATA_DIR, 'archive.txt')
+    if os.path.exists(text_path):
+        with open(text_path) as f:
+            return [line.strip() for line in f if line.strip()], text_path
+    db_path = os.path.join(DATA_DIR, 'archive.db')
+    if not path and os.path.exists(db_path):
+        connection = sqlite3.connect(db_path)
+        try:
+            links = [raw for raw, in connection.execute('SELECT raw FROM archive ORDER BY rowid')]
+        finally:
+            connection.close()
+        if links:
+            return links, db_path
+    if path:
+        raise FileNotFoundError(path)
+    return synthetic_proxy_lines(synthetic_count), f'{synthetic_count} generated links'
+
+
+def _mmdb_control(type_id, size):
+    """Control byte(s) of an MMDB data field: type (extended types take a second byte) and payload size."""
+    first, extended = (type_id << 5, b'') if type_id <= 7 else (0, bytes([type_id - 7]))
+    if size < 29:
+        return bytes([first | size]) + extended
+    if size < 285:
+        return bytes([first | 29]) + extended + bytes([size - 29])
+    if size < 65821:
+        return bytes([first | 30]) + extended + (size - 285).to_bytes(2, 'big')
+    return bytes([first | 31]) + extended + (size - 65821).to_bytes(3, 'big')
+
+
+def _mmdb_uint(value, type_id):
+    """Encodes an unsigned integer as a specific MMDB type (5 uint16, 6 uint32, 9 uint64)."""
+    payload = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return _mmdb_control(type_id, len(payload)) + payload
+
+
+def _mmdb_encode(value):
+    """
+    Encodes str, non-negative int, list and dict values in the MMDB data section format.
+    bytes are taken as an already encoded field (see _mmdb_uint).
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        payload = value.encode()
+        return _mmdb_control(2, len(payload)) + payload
+    if isinstance(value, int):
+        return _mmdb_uint(value, 5 if value < 1 << 16 else 6 if value < 1 << 32 else 9)
+    if isinstance(value, list):
+        return _mmdb_control(11, len(value)) + b''.join(map(_mmdb_encode, value))
+    if isinstance(value, dict):
+        return _mmdb_control(7, len(value)) + b''.join(_mmdb_encode(k) + _mmdb_encode(v) for k, v in value.items())
+    raise TypeError(f"Unsupported MMDB value: {value!r}")
+
+
+def write_test_mmdb(path, networks, database_type='GeoLite2-Country', build_epoch=None):
+    """
+    Writes a small IPv4 MaxMind DB (24-bit records) that geoip2.database.Reader can open.
+    networks is a list of (CIDR string, record dict) pairs that must not overlap, e.g.
+    ('10.1.0.0/16', {'country': {'iso_code': 'DE', 'names': {'en': 'Germany'}}}).
+    Addresses outside every network are not found.
+    """
+    data, offsets = b'', {}
+    nodes = [[None, None]] # [left, right]: ('node', index), ('data', offset) or None
+    for cidr, record in networks:
+        encoded = _mmdb_encode(record)
+        if encoded not in offsets:
+            offsets[encoded] = len(data)
+            data += encoded
+        network = ipaddress.IPv4Network(cidr)
+        bits, node = int(network.network_address), 0
+        for depth in range(network.prefixlen):
+            bit = (bits >> (31 - depth)) & 1
+            if depth == network.prefixlen - 1:
+                nodes[node][bit] = ('data', offsets[encoded])
+            else:
+                if nodes[node][bit] is None:
+                    nodes.append([None, None])
+                    nodes[node][bit] = ('node', len(nodes) - 1)
+                node = nodes[node][bit][1]
+
+    node_count = len(nodes)
+
+    def record_value(entry):
+        if entry is None:
+            return node_count
+        kind, value = entry
+        return value if kind == 'node' else node_count + 16 + value
+
+    tree = b''.join(record_value(left).to_bytes(3, 'big') + record_value(right).to_bytes(3, 'big') for left, right in nodes)
+    # libmaxminddb insists on the exact integer types of the metadata fields
+    metadata = {
+        'node_count': _mmdb_uint(node_count, 6),
+        'record_size': _mmdb_uint(24, 5),
+        'ip_version': _mmdb_uint(4, 5),
+        'database_type': database_type,
+        'languages': ['en'],
+        'binary_format_major_version': _mmdb_uint(2, 5),
+        'binary_format_minor_version': _mmdb_uint(0, 5),
+        'build_epoch': _mmdb_uint(int(time.time()) if build_epoch is None else build_epoch, 9),
+        'description': {'en': 'Test database written by the benchmarks'},
+    }
+    with open(path, 'wb') as f:
+        f.write(tree + bytes(16) + data + b'\xab\xcd\xefMaxMind.com' + _mmdb_encode(metadata))
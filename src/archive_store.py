@@ -0,0 +1,294 @@
+import logging
+import os
+import sqlite3
+import time
+from urllib.parse import urlparse, parse_qs
+
+from proxy_endpoint import canonical_endpoint, endpoint_hash
+
+# Version of the archive_key() scheme; archives keyed with an older one are re-keyed on open
+ARCHIVE_KEY_VERSION = 2
+# Schema version (PRAGMA user_version) from which posts are recorded per channel
+ARCHIVE_CHANNELS_VERSION = 3
+# Channel that entries archived before per-channel posts existed belong to (the TELEGRAM_CHANNEL_ID channel)
+DEFAULT_CHANNEL = 'default'
+
+
+def archive_key(server, port, secret):
+    """
+    Returns a fixed-size (64-bit) key for a proxy endpoint: a hash of its canonical endpoint
+    (see proxy_endpoint.canonical_endpoint), so the same endpoint written differently (secret
+    encoding, 'dd' prefix, host case, tag) gets the same key.
+    """
+    return endpoint_hash(canonical_endpoint(server, port, secret))
+
+
+def archive_key_from_link(proxy_link):
+    """Returns the archive key of a tg://proxy? link, or None if it has no server or port."""
+    query_params = parse_qs(urlparse(proxy_link).query)
+    server = query_params.get('server', [None])[0]
+    port = query_params.get('port', [None])[0]
+    if server is None or port is None:
+        return None
+    return archive_key(server, port, query_params.get('secret', [''])[0])
+
+
+class ArchiveStore:
+    """
+    Archive of previously posted proxies, stored in a local SQLite database.
+    Entries are keyed by archive_key() in an INTEGER PRIMARY KEY (the table's B-tree),
+    so lookups are O(log n) on disk and nothing is loaded into memory up front.
+    The processed link is kept alongside each key for reference.
+
+    Each entry records when it was first and last posted and when it was last seen in a feed.
+    Entries last posted more than ttl_seconds ago are treated as absent (so the proxy can be
+    posted again) and are removed by compact(), which also caps the archive at max_entries by
+    evicting the least recently seen entries.
+
+    A second table remembers when candidate proxies were first sighted in a feed (posted or
+    not), which the posting queue uses to prefer fresh proxies.
+
+    The archive table is shared by every output channel: an entry's last_posted time is that of
+    its latest post to any channel, and it keeps the country the proxy was posted with. A third
+    table records which channels each entry was posted to (and when), so every channel has its
+    own view of what it has already posted.
+    """
+
+    def __init__(self, db_path, legacy_text_path=None, ttl_seconds=None, max_entries=None, clock=time.time):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._seen_keys = set() # Archive hits of this run, flushed to last_seen in batches
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self._create_schema()
+        self._upgrade_keys()
+        self._adopt_channel_posts()
+        if legacy_text_path:
+            self.migrate_from_text(legacy_text_path)
+
+    def _create_schema(self):
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS archive (key INTEGER PRIMARY KEY, raw TEXT NOT NULL, '
+                'first_posted REAL NOT NULL, last_posted REAL NOT NULL, last_seen REAL NOT NULL)'
+            )
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(archive)')}
+            # Archives created before timestamps existed: treat their entries as posted now
+            now = self.clock()
+            for column in ('first_posted', 'last_posted', 'last_seen'):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE archive ADD COLUMN {column} REAL NOT NULL DEFAULT {now!r}')
+            if 'country_code' not in columns:
+                self.connection.execute("ALTER TABLE archive ADD COLUMN country_code TEXT NOT NULL DEFAULT ''")
+            self.connection.execute('CREATE INDEX IF NOT EXISTS archive_last_posted ON archive (last_posted)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS archive_last_seen ON archive (last_seen)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS sightings (key INTEGER PRIMARY KEY, first_seen REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS sightings_first_seen ON sightings (first_seen)')
+            # Keyed by (key, channel) so all channels of a key are one range read
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS channel_posts (key INTEGER NOT NULL, channel TEXT NOT NULL, '
+                'last_posted REAL NOT NULL, PRIMARY KEY (key, channel)) WITHOUT ROWID'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS channel_posts_last_posted ON channel_posts (last_posted)')
+
+    def _upgrade_keys(self):
+        """
+        Re-keys an archive written with an older archive_key() scheme, recomputing each key from
+        the entry's raw link. Entries that now share a key are merged, keeping the earliest
+        first_posted and the latest last_posted/last_seen times. Sightings cannot be re-keyed
+        (they have no link) and are dropped; they only steer the posting order.
+        """
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version >= ARCHIVE_KEY_VERSION:
+            return
+        rows = self.connection.execute('SELECT raw, first_posted, last_posted, last_seen FROM archive').fetchall()
+        merged = {}
+        for raw, first_posted, last_posted, last_seen in rows:
+            key = archive_key_from_link(raw)
+            if key is None:
+                continue
+            if key in merged:
+                entry = merged[key]
+                entry[1] = min(entry[1], first_posted)
+                if last_posted > entry[2]:
+                    entry[0], entry[2] = raw, last_posted
+                entry[3] = max(entry[3], last_seen)
+            else:
+                merged[key] = [raw, first_posted, last_posted, last_seen]
+        with self.connection:
+            self.connection.execute('DELETE FROM archive')
+            self.connection.executemany(
+                'INSERT INTO archive (key, raw, first_posted, last_posted, last_seen) VALUES (?, ?, ?, ?, ?)',
+                ((key, *entry) for key, entry in merged.items())
+            )
+            self.connection.execute('DELETE FROM sightings')
+            self.connection.execute(f'PRAGMA user_version = {ARCHIVE_KEY_VERSION}')
+        if rows:
+            logging.info(f"Re-keyed archive {self.db_path}: {len(rows)} entries became {len(merged)} canonical endpoints.")
+
+    def _adopt_channel_posts(self):
+        """Records the entries of an archive from before per-channel posts as posted to DEFAULT_CHANNEL."""
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version >= ARCHIVE_CHANNELS_VERSION:
+            return
+        with self.connection:
+            adopted = self.connection.execute(
+                'INSERT OR IGNORE INTO channel_posts (key, channel, last_posted) SELECT key, ?, last_posted FROM archive',
+                (DEFAULT_CHANNEL,)
+            ).rowcount
+            self.connection.execute(f'PRAGMA user_version = {ARCHIVE_CHANNELS_VERSION}')
+        if adopted:
+            logging.info(f"Recorded {adopted} archived entries as posted to channel '{DEFAULT_CHANNEL}'.")
+
+    def migrate_from_text(self, text_path):
+        """
+        One-shot import of the old line-per-proxy archive.txt.
+        The text file is removed once its entries are committed to the database.
+        """
+        if not os.path.exists(text_path):
+            return 0
+        with open(text_path, 'r') as f:
+            links = [line.strip() for line in f if line.strip()]
+        entries = []
+        for link in links:
+            key = archive_key_from_link(link)
+            if key is None:
+                logging.warning(f"Skipping unparsable archive line during migration: {link}")
+                continue
+            entries.append((key, link))
+        added = self.add_many(entries)
+        os.remove(text_path)
+        logging.info(f"Migrated {len(links)} lines from {text_path} into {self.db_path} ({added} entries).")
+        return added
+
+    def _expiry_cutoff(self):
+        return self.clock() - self.ttl_seconds if self.ttl_seconds else float('-inf')
+
+    def __contains__(self, key):
+        """True if the key was posted to any channel within the TTL. Hits are remembered to refresh last_seen."""
+        row = self.connection.execute(
+            'SELECT 1 FROM archive WHERE key = ? AND last_posted >= ?', (key, self._expiry_cutoff())
+        ).fetchone()
+        if row is None:
+            return False
+        self._seen_keys.add(key)
+        if len(self._seen_keys) >= 10000:
+            self.flush_seen()
+        return True
+
+    def posted_channels(self, key):
+        """
+        Returns (country code, set of channels) for a key posted within the TTL: the country it was
+        archived with and the channels it was posted to within the TTL. Returns None otherwise.
+        Hits are remembered to refresh last_seen.
+        """
+        cutoff = self._expiry_cutoff()
+        rows = self.connection.execute(
+            'SELECT a.country_code, c.channel FROM archive a '
+            'LEFT JOIN channel_posts c ON c.key = a.key AND c.last_posted >= ? '
+            'WHERE a.key = ? AND a.last_posted >= ?', (cutoff, key, cutoff)
+        ).fetchall()
+        if not rows:
+            return None
+        self._seen_keys.add(key)
+        if len(self._seen_keys) >= 10000:
+            self.flush_seen()
+        return rows[0][0], {channel for _, channel in rows if channel is not None}
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM archive').fetchone()[0]
+
+    def flush_seen(self):
+        """Writes the last_seen time of the keys hit since the last flush."""
+        if not self._seen_keys:
+            return
+        now = self.clock()
+        with self.connection:
+            self.connection.executemany('UPDATE archive SET last_seen = ? WHERE key = ?', ((now, key) for key in self._seen_keys))
+        self._seen_keys.clear()
+
+    def add(self, key, raw, channel=DEFAULT_CHANNEL):
+        """Inserts or refreshes a single entry."""
+        return self.add_many([(key, raw)], channel) == 1
+
+    def add_many(self, entries, channel=DEFAULT_CHANNEL):
+        """
+        Records entries as posted to channel in one transaction. Entries are (key, raw) pairs or
+        (key, raw, country code) triples. Keys already archived (including expired ones being
+        posted again) keep their first_posted time and get a new last_posted time.
+        Returns the number of entries inserted or refreshed.
+        """
+        now = self.clock()
+        rows = [(entry[0], entry[1], entry[2] if len(entry) > 2 else '') for entry in entries]
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                'INSERT INTO archive (key, raw, first_posted, last_posted, last_seen, country_code) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET raw = excluded.raw, last_posted = excluded.last_posted, last_seen = excluded.last_seen, '
+                "country_code = CASE WHEN excluded.country_code != '' THEN excluded.country_code ELSE archive.country_code END",
+                ((key, raw, now, now, now, country_code) for key, raw, country_code in rows)
+            )
+            changed = self.connection.total_changes - before
+            self.connection.executemany(
+                'INSERT INTO channel_posts (key, channel, last_posted) VALUES (?, ?, ?) '
+                'ON CONFLICT(key, channel) DO UPDATE SET last_posted = excluded.last_posted',
+                ((key, channel, now) for key, _, _ in rows)
+            )
+            return changed
+
+    def record_sightings(self, keys):
+        """Records keys not sighted before as first seen now. Returns {key: first_seen} for all keys."""
+        keys = list(set(keys))
+        now = self.clock()
+        first_seen = {}
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO sightings (key, first_seen) VALUES (?, ?)', ((key, now) for key in keys))
+            for start in range(0, len(keys), 500): # Stay below SQLite's bound parameter limit
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                first_seen.update(self.connection.execute(
+                    f'SELECT key, first_seen FROM sightings WHERE key IN ({placeholders})', batch
+                ))
+        return first_seen
+
+    def compact(self):
+        """
+        Removes expired entries, evicts the least recently seen entries above max_entries and
+        rewrites the database file when enough space was freed. Returns the number of removed entries.
+        """
+        self.flush_seen()
+        removed = 0
+        with self.connection:
+            if self.ttl_seconds:
+                removed += self.connection.execute('DELETE FROM archive WHERE last_posted < ?', (self._expiry_cutoff(),)).rowcount
+            if self.max_entries is not None:
+                excess = len(self) - self.max_entries
+                if excess > 0:
+                    removed += self.connection.execute(
+                        'DELETE FROM archive WHERE key IN (SELECT key FROM archive ORDER BY last_seen LIMIT ?)', (excess,)
+                    ).rowcount
+            # Channel posts and sightings follow the same retention, so they are not counted
+            if self.ttl_seconds:
+                self.connection.execute('DELETE FROM channel_posts WHERE last_posted < ?', (self._expiry_cutoff(),))
+            if removed:
+                self.connection.execute('DELETE FROM channel_posts WHERE key NOT IN (SELECT key FROM archive)')
+            if self.ttl_seconds:
+                self.connection.execute('DELETE FROM sightings WHERE first_seen < ?', (self._expiry_cutoff(),))
+            if self.max_entries is not None:
+                self.connection.execute(
+                    'DELETE FROM sightings WHERE key NOT IN (SELECT key FROM sightings ORDER BY first_seen DESC LIMIT ?)',
+                    (self.max_entries,)
+                )
+        if removed:
+            # Rewrite the file once a quarter of its pages are free, instead of on every small deletion
+            free_pages = self.connection.execute('PRAGMA freelist_count').fetchone()[0]
+            total_pages = self.connection.execute('PRAGMA page_count').fetchone()[0]
+            if total_pages and free_pages * 4 >= total_pages:
+                self.connection.execute('VACUUM')
+        return removed
+
+    def close(self):
+        self.flush_seen()
+        self.connection.close()
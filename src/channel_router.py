@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+from collections import deque
+from itertools import islice
+
+from archive_store import DEFAULT_CHANNEL
+
+CHANNEL_FIELDS = {'chat_id', 'name', 'countries', 'exclude_countries', 'min_latency_ms', 'max_latency_ms'}
+
+
+class Channel:
+    """
+    An output chat and its routing rules, with its own posting queue and retry queue.
+    - countries / exclude_countries: ISO country codes a proxy must (not) be geolocated in;
+      proxies of unknown country only go to channels without a countries list.
+    - min_latency_ms / max_latency_ms: latency tier; proxies without a measured latency
+      (health checks off) only go to channels without latency bounds.
+    name identifies the channel in the archive, so it must stay the same across runs.
+    """
+
+    def __init__(self, chat_id, name=None, countries=None, exclude_countries=None, min_latency_ms=None, max_latency_ms=None):
+        self.chat_id = chat_id
+        self.name = name or str(chat_id)
+        self.countries = {code.upper() for code in countries} if countries else None
+        self.exclude_countries = {code.upper() for code in exclude_countries or ()}
+        self.min_latency_ms = min_latency_ms
+        self.max_latency_ms = max_latency_ms
+        self.queue = None # PostingQueue, created by ChannelRouter
+        self.retry_chunks = deque() # (chunk, attempts) of chunks that could not be posted yet
+        self.posted = [] # Proxies posted and not yet saved to the archive
+        self.posted_count = 0
+        self.stopped = False # Set when the run's time limit leaves no room for its next post
+
+    def accepts_country(self, country_code):
+        if self.countries is not None and country_code not in self.countries:
+            return False
+        return country_code not in self.exclude_countries
+
+    def accepts(self, proxy):
+        if not self.accepts_country(proxy.get('country_code', '')):
+            return False
+        if self.min_latency_ms is None and self.max_latency_ms is None:
+            return True
+        latency = proxy.get('latency', -1)
+        if latency is None or latency < 0:
+            return False
+        return ((self.min_latency_ms is None or latency >= self.min_latency_ms)
+                and (self.max_latency_ms is None or latency <= self.max_latency_ms))
+
+    def has_chunks(self):
+        return bool(self.retry_chunks or len(self.queue))
+
+    def describe(self):
+        rules = []
+        if self.countries is not None:
+            rules.append(f"countries {', '.join(sorted(self.countries))}")
+        if self.exclude_countries:
+            rules.append(f"excluding {', '.join(sorted(self.exclude_countries))}")
+        if self.min_latency_ms is not None or self.max_latency_ms is not None:
+            rules.append(f"latency {self.min_latency_ms or 0}-{self.max_latency_ms if self.max_latency_ms is not None else 'any'} ms")
+        return f"Channel '{self.name}' (chat {self.chat_id}): {'; '.join(rules) or 'all proxies'}"
+
+
+def load_channels(file_path, default_chat_id=None):
+    """
+    Returns the output channels: those listed in the channels file ({"channels": [{"chat_id": ...,
+    routing rules...}, ...]}), or else a single channel for default_chat_id that takes every proxy.
+    A listed channel whose chat_id is default_chat_id keeps the default channel's archive history.
+    Returns None (after logging why) if the file is invalid or there is no channel at all.
+    """
+    if not os.path.exists(file_path):
+        if not default_chat_id:
+            logging.error(f"No output channel: set TELEGRAM_CHANNEL_ID or list channels in {file_path}.")
+            return None
+        return [Channel(default_chat_id, DEFAULT_CHANNEL)]
+    try:
+        with open(file_path, 'r') as f:
+            entries = json.load(f)['channels']
+        channels = []
+        for entry in entries:
+            unknown = set(entry) - CHANNEL_FIELDS
+            if unknown or not entry.get('chat_id'):
+                raise ValueError(f"invalid channel {entry} (needs chat_id; known fields: {', '.join(sorted(CHANNEL_FIELDS))})")
+            if not entry.get('name') and default_chat_id and str(entry['chat_id']) == str(default_chat_id):
+                entry = dict(entry, name=DEFAULT_CHANNEL)
+            channels.append(Channel(**entry))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.error(f"Error loading channels from {file_path}: {e}")
+        return None
+    names = [channel.name for channel in channels]
+    if not channels or len(set(names)) < len(names):
+        logging.error(f"{file_path} must list at least one channel, with distinct names.")
+        return None
+    return channels
+
+
+class ArchiveRoutingView:
+    """
+    The archive as the ingest pipeline sees it: a key counts as archived once every channel that
+    would take the proxy (by the country it was archived with) has posted it within the TTL.
+    Latency rules are not known at that point and are ignored, so a proxy only some latency
+    tiers took is checked again and may be posted to the others later.
+    """
+
+    def __init__(self, archive, channels):
+        self.archive = archive
+        self.channels = channels
+
+    def __contains__(self, key):
+        found = self.archive.posted_channels(key)
+        if found is None:
+            return False
+        country_code, posted = found
+        return all(channel.name in posted for channel in self.channels if channel.accepts_country(country_code))
+
+
+class ChannelRouter:
+    """
+    Fans one stream of candidate proxies out to the channels: each proxy is queued for every
+    channel whose rules accept it and that has not posted it yet (the channel's own view of the
+    shared archive). First sightings are looked up once per batch for all channels.
+    Proxies queued for several channels are the same objects, so they are rendered once.
+    """
+
+    def __init__(self, channels, archive, create_queue):
+        self.channels = channels
+        self.archive = archive
+        for channel in channels:
+            channel.queue = create_queue()
+        self.routed = 0
+        self.unrouted = 0 # Proxies no channel would take (or all had posted)
+
+    def __len__(self):
+        """Number of queued proxies, over all channels (a proxy queued for two channels counts twice)."""
+        return sum(len(channel.queue) + sum(len(chunk) for chunk, _ in channel.retry_chunks) for channel in self.channels)
+
+    def route(self, proxies):
+        if not proxies:
+            return
+        first_seen = self.archive.record_sightings(proxy['archive_key'] for proxy in proxies)
+        batches = {channel.name: [] for channel in self.channels}
+        for proxy in proxies:
+            posted = set()
+            for key in {proxy['archive_key'], proxy.get('endpoint_key', proxy['archive_key'])}:
+                found = self.archive.posted_channels(key)
+                if found:
+                    posted |= found[1]
+            targets = [channel for channel in self.channels if channel.name not in posted and channel.accepts(proxy)]
+            for channel in targets:
+                batches[channel.name].append(proxy)
+            self.routed += bool(targets)
+            self.unrouted += not targets
+        for channel in self.channels:
+            channel.queue.push_many(batches[channel.name], first_seen)
+
+    def ingest(self, proxies, count):
+        """Routes up to count proxies from the iterator. Returns False once it is exhausted."""
+        batch = list(islice(proxies, count))
+        self.route(batch)
+        return len(batch) == count
+
+    def fill(self, proxies, target_size, batch_size=500):
+        """
+        Pulls proxies from an iterator until every channel queue holds target_size of them, or
+        the queues hold target_size per channel together (so a channel that rarely matches does
+        not pull in the whole stream). Returns False once the iterator is exhausted.
+        """
+        limit = target_size * len(self.channels)
+        while any(len(channel.queue) < target_size for channel in self.channels) and len(self) < limit:
+            if not self.ingest(proxies, min(batch_size, limit - len(self))):
+                return False
+        return True
+
+    def snapshot(self):
+        """Returns every queued proxy (retries first), each once even if queued for several channels."""
+        unposted = {}
+        for channel in self.channels:
+            for chunk, _ in channel.retry_chunks:
+                for proxy in chunk:
+                    unposted.setdefault(proxy['archive_key'], proxy)
+            for proxy in channel.queue.snapshot():
+                unposted.setdefault(proxy['archive_key'], proxy)
+        return list(unposted.values())
+
+    def drain(self):
+        """Removes and returns every queued proxy, as snapshot() does."""
+        unposted = self.snapshot()
+        for channel in self.channels:
+            channel.retry_chunks.clear()
+            channel.queue.drain()
+        return unposted
+
+    @property
+    def pushed(self):
+        return sum(channel.queue.pushed for channel in self.channels)
+
+    @property
+    def popped(self):
+        return sum(channel.queue.popped for channel in self.channels)
+
+    def stats_line(self):
+        per_channel = ', '.join(f"{channel.name} {channel.posted_count} posted/{len(channel.queue)} left" for channel in self.channels)
+        return f"Channels: {self.routed} proxies routed, {self.unrouted} taken by no channel; {per_channel}"
@@ -0,0 +1,203 @@
+import asyncio
+import ipaddress
+import logging
+import random
+import socket
+import struct
+import time
+
+from state_store import load_json_state, save_json_state
+
+DNS_TYPE_A = 1
+DNS_CLASS_IN = 1
+DNS_RCODE_NXDOMAIN = 3
+
+
+def is_ip_address(server):
+    """True if server is a literal IPv4/IPv6 address rather than a hostname."""
+    try:
+        ipaddress.ip_address(server)
+        return True
+    except ValueError:
+        return False
+
+
+def system_nameserver(resolv_conf='/etc/resolv.conf'):
+    """Returns the first IPv4 nameserver from resolv.conf, or None."""
+    try:
+        with open(resolv_conf, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    try:
+                        if ipaddress.ip_address(parts[1]).version == 4:
+                            return parts[1]
+                    except ValueError:
+                        continue
+    except OSError:
+        pass
+    return None
+
+
+def build_query(query_id, hostname):
+    """Builds a recursive DNS query for the A records of hostname."""
+    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) # RD flag, one question
+    labels = b''.join(bytes([len(label)]) + label for label in hostname.rstrip('.').encode('idna').split(b'.'))
+    return header + labels + b'\x00' + struct.pack('!HH', DNS_TYPE_A, DNS_CLASS_IN)
+
+
+def _skip_name(message, offset):
+    """Returns the offset just past a (possibly compressed) domain name."""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0: # Compression pointer ends the name
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+
+def parse_response(message, query_id):
+    """
+    Parses a DNS response into (rcode, [(ip, ttl), ...]) for its A records.
+    Raises ValueError for responses that do not answer query_id.
+    """
+    response_id, flags, question_count, answer_count, _, _ = struct.unpack('!HHHHHH', message[:12])
+    if response_id != query_id or not flags & 0x8000:
+        raise ValueError("unexpected DNS response")
+    offset = 12
+    for _ in range(question_count):
+        offset = _skip_name(message, offset) + 4
+    records = []
+    for _ in range(answer_count):
+        offset = _skip_name(message, offset)
+        record_type, record_class, ttl, length = struct.unpack('!HHIH', message[offset:offset + 10])
+        offset += 10
+        if record_type == DNS_TYPE_A and record_class == DNS_CLASS_IN and length == 4:
+            records.append((socket.inet_ntoa(message[offset:offset + 4]), ttl))
+        offset += length
+    return flags & 0x000F, records
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class AsyncDNSResolver:
+    """
+    Resolves hostnames to IPv4 addresses concurrently with asyncio.
+    Queries go straight to a nameserver over UDP so record TTLs are known; results (including
+    negative answers) are cached on disk and reused until their TTL runs out.
+    nameserver may be 'host' or 'host:port' (e.g. a local stub resolver); when no nameserver is
+    configured or found, the system resolver (getaddrinfo) is used with fallback_ttl.
+    """
+
+    def __init__(self, cache_file=None, nameserver=None, concurrency=100, timeout=3.0, min_ttl=60,
+                 max_ttl=24 * 3600, negative_ttl=300, fallback_ttl=3600, max_entries=50000, clock=time.time):
+        self.cache_file = cache_file
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.fallback_ttl = fallback_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        nameserver = nameserver or system_nameserver()
+        if nameserver:
+            host, _, port = nameserver.partition(':')
+            self.nameserver = (host, int(port or 53))
+        else:
+            self.nameserver = None
+        self.cache = load_json_state(cache_file, {}) if cache_file else {} # hostname -> [ip or None, expires_at]
+        self.cache_hits = 0
+        self.queries = 0
+        self.failures = 0
+
+    def _cached(self, hostname, now):
+        entry = self.cache.get(hostname)
+        if entry and entry[1] > now:
+            return entry
+        return None
+
+    async def _query_nameserver(self, hostname):
+        loop = asyncio.get_running_loop()
+        query_id = random.getrandbits(16)
+        future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(lambda: _QueryProtocol(future), remote_addr=self.nameserver)
+        try:
+            transport.sendto(build_query(query_id, hostname))
+            rcode, records = parse_response(await future, query_id)
+        finally:
+            transport.close()
+        if records:
+            ip = min(ip for ip, _ in records) # Lowest address, so round-robin order does not matter
+            ttl = min(ttl for _, ttl in records)
+            return ip, max(self.min_ttl, min(self.max_ttl, ttl))
+        if rcode in (0, DNS_RCODE_NXDOMAIN):
+            return None, self.negative_ttl
+        raise OSError(f"DNS server returned rcode {rcode}")
+
+    async def _query_system(self, hostname):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(hostname, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+        ips = sorted({info[4][0] for info in infos})
+        return (ips[0] if ips else None), self.fallback_ttl
+
+    async def _resolve_one(self, hostname, semaphore):
+        async with semaphore:
+            self.queries += 1
+            query = self._query_nameserver if self.nameserver else self._query_system
+            try:
+                ip, ttl = await asyncio.wait_for(query(hostname), self.timeout)
+            except (asyncio.TimeoutError, OSError, ValueError, IndexError, struct.error) as e:
+                self.failures += 1
+                logging.debug(f"DNS resolution failed for {hostname}: {e!r}")
+                return hostname, None, None # Not cached; tried again next time
+            return hostname, ip, ttl
+
+    async def _resolve_all(self, hostnames):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._resolve_one(hostname, semaphore) for hostname in hostnames))
+
+    def resolve_many(self, hostnames):
+        """Resolves hostnames concurrently. Returns {hostname: ip or None}."""
+        now = self.clock()
+        resolved = {}
+        pending = []
+        for hostname in set(hostnames):
+            entry = self._cached(hostname, now)
+            if entry:
+                self.cache_hits += 1
+                resolved[hostname] = entry[0]
+            else:
+                pending.append(hostname)
+        if pending:
+            for hostname, ip, ttl in asyncio.run(self._resolve_all(pending)):
+                resolved[hostname] = ip
+                if ttl is not None:
+                    self.cache[hostname] = [ip, now + ttl]
+        return resolved
+
+    def stats_line(self):
+        return (f"DNS: {self.queries} queries ({self.failures} failed), {self.cache_hits} cache hits, "
+                f"{len(self.cache)} cached hostnames")
+
+    def save(self):
+        if not self.cache_file:
+            return
+        now = self.clock()
+        live = sorted(((hostname, entry) for hostname, entry in self.cache.items() if entry[1] > now),
+                      key=lambda item: item[1][1], reverse=True)
+        self.cache = dict(live[:self.max_entries])
+        if save_json_state(self.cache_file, self.cache):
+            logging.info(f"Saved DNS cache with {len(self.cache)} hostnames to {self.cache_file}.")
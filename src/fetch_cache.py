@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+
+from state_store import load_json_state, save_json_state
+
+
+class FetchCache:
+    """
+    Persistent per-URL cache of HTTP validators (ETag / Last-Modified) and body hashes.
+    Used to send conditional requests and to skip parsing subscription bodies that have
+    not changed since the last run.
+    """
+
+    def __init__(self, file_path, max_entries=5000, max_age_seconds=7 * 24 * 3600):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.entries = load_json_state(file_path, {})
+        self.hits_not_modified = 0 # Server answered 304 Not Modified
+        self.hits_same_content = 0 # Server sent a body identical to the cached one
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def conditional_headers(self, url):
+        """Returns If-None-Match / If-Modified-Since headers for a previously seen URL."""
+        with self._lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record_not_modified(self, url):
+        with self._lock:
+            self.hits_not_modified += 1
+            if url in self.entries:
+                self.entries[url]['last_used'] = time.time()
+
+    def record_response(self, url, etag, last_modified, content_hash):
+        """
+        Stores the validators for a fresh response.
+        Returns True if the body is identical to the one seen last time (a cache hit).
+        """
+        with self._lock:
+            entry = self.entries.get(url)
+            unchanged = entry is not None and entry.get('hash') == content_hash
+            if unchanged:
+                self.hits_same_content += 1
+            else:
+                self.misses += 1
+            self.entries[url] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'hash': content_hash,
+                'last_used': time.time(),
+            }
+            return unchanged
+
+    def forget(self, url):
+        """Drops a URL so its next fetch is unconditional (e.g. after a failed download)."""
+        with self._lock:
+            self.entries.pop(url, None)
+
+    def evict(self, now=None):
+        """Removes entries unused for max_age_seconds, then the oldest ones above max_entries."""
+        now = time.time() if now is None else now
+        with self._lock:
+            before = len(self.entries)
+            self.entries = {
+                url: entry for url, entry in self.entries.items()
+                if now - entry.get('last_used', 0) <= self.max_age_seconds
+            }
+            if len(self.entries) > self.max_entries:
+                newest = sorted(self.entries.items(), key=lambda item: item[1].get('last_used', 0), reverse=True)
+                self.entries = dict(newest[:self.max_entries])
+            self.evicted += before - len(self.entries)
+
+    def stats_line(self):
+        hits = self.hits_not_modified + self.hits_same_content
+        total = hits + self.misses
+        hit_rate = (hits / total * 100) if total else 0.0
+        return (f"Fetch cache: {hits} hits ({self.hits_not_modified} not modified, {self.hits_same_content} same content), "
+                f"{self.misses} misses, hit rate {hit_rate:.1f}%, {self.evicted} evicted, {len(self.entries)} entries")
+
+    def save(self):
+        self.evict()
+        if save_json_state(self.file_path, self.entries):
+            logging.info(f"Saved fetch cache with {len(self.entries)} entries to {self.file_path}.")
@@ -0,0 +1,90 @@
+import ipaddress
+import logging
+from collections import OrderedDict
+
+from state_store import load_json_state, save_json_state
+
+
+def _is_address_key(key):
+    """True if key is an address or (with by_prefix) a network, not a hostname."""
+    try:
+        ipaddress.ip_network(key, strict=False)
+        return True
+    except ValueError:
+        return False
+
+
+class GeoIPCache:
+    """
+    LRU memo of IP -> (country name, country code) lookups, optionally persisted between runs.
+    With by_prefix=True, addresses are memoized per /24 (IPv4) or /48 (IPv6) network, since
+    country data practically never differs inside such a network.
+    Persisted entries are tagged with the GeoIP database version and discarded when it changes.
+    Only IP addresses are memoized: a hostname that could not be resolved is looked up as it is
+    and fails, and that result must not stick once the name resolves.
+    """
+
+    def __init__(self, file_path=None, max_entries=100000, by_prefix=False, database_version=None):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.by_prefix = by_prefix
+        self.database_version = database_version
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if file_path:
+            state = load_json_state(file_path, {})
+            if state.get('database_version') == database_version and state.get('by_prefix', False) == by_prefix:
+                for key, country_name, country_code in state.get('entries', []):
+                    if _is_address_key(key): # Caches written before hostnames were excluded may hold some
+                        self.entries[key] = (country_name, country_code)
+            elif state:
+                logging.info("GeoIP database changed since the GeoIP cache was written. Starting with an empty cache.")
+
+    def cache_key(self, ip_address):
+        """The memo key of an address, or None for a hostname (not memoized)."""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        if not self.by_prefix:
+            return ip_address
+        prefix = 24 if address.version == 4 else 48
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+    def get(self, ip_address):
+        """Returns the memoized (country name, country code) or None."""
+        key = self.cache_key(ip_address)
+        value = self.entries.get(key) if key is not None else None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, ip_address, country_name, country_code):
+        key = self.cache_key(ip_address)
+        if key is None:
+            return
+        self.entries[key] = (country_name, country_code)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False) # Least recently used
+
+    def stats_line(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return (f"GeoIP: {total} addresses geolocated, {self.misses} database lookups, "
+                f"{self.hits} cache hits, hit rate {hit_rate:.1f}%, {len(self.entries)} cached")
+
+    def save(self):
+        if not self.file_path:
+            return
+        state = {
+            'database_version': self.database_version,
+            'by_prefix': self.by_prefix,
+            'entries': [[key, name, code] for key, (name, code) in self.entries.items()],
+        }
+        if save_json_state(self.file_path, state):
+            logging.info(f"Saved GeoIP cache with {len(self.entries)} entries to {self.file_path}.")
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import random
+import struct
+import time
+
+from proxy_endpoint import SECRET_PREFIX_FAKE_TLS, decode_secret
+
+TLS_RECORD_HANDSHAKE = 0x16
+TLS_RECORD_CHANGE_CIPHER_SPEC = 0x14
+TLS_RECORD_APPLICATION_DATA = 0x17
+FAKE_TLS_HELLO_LENGTH = 517 # Same size Telegram clients use
+
+# Statuses set by the checker. Proxies with any other status are dropped before posting.
+STATUS_ALIVE = 'alive' # TCP connection accepted
+STATUS_VERIFIED = 'verified' # Fake-TLS handshake answered with a valid MTProto proxy signature
+STATUS_DEAD = 'dead' # Connection refused or timed out
+STATUS_HANDSHAKE_FAILED = 'handshake_failed' # Connected, but the fake-TLS handshake failed
+HEALTHY_STATUSES = (STATUS_ALIVE, STATUS_VERIFIED)
+
+
+def fake_tls_parameters(secret):
+    """Returns (key, domain) for an 'ee' (fake-TLS) secret, or None for other secret types."""
+    secret_bytes = decode_secret(secret)
+    if not secret_bytes or len(secret_bytes) <= 17 or secret_bytes[0] != SECRET_PREFIX_FAKE_TLS:
+        return None
+    try:
+        domain = secret_bytes[17:].decode('ascii')
+    except UnicodeDecodeError:
+        return None
+    return secret_bytes[1:17], domain
+
+
+def build_fake_tls_client_hello(key, domain, now=None):
+    """
+    Builds a TLS 1.3 ClientHello for an MTProto fake-TLS proxy.
+    The client random carries HMAC-SHA256(key, hello with zeroed random), with the current unix
+    time XORed into its last four bytes; that is what the proxy checks before answering.
+    """
+    def extension(extension_type, data):
+        return struct.pack('!HH', extension_type, len(data)) + data
+
+    def vector(data, length_bytes=2):
+        return len(data).to_bytes(length_bytes, 'big') + data
+
+    name = domain.encode('ascii')
+    extensions = b''.join([
+        extension(0, vector(b'\x00' + vector(name))), # server_name
+        extension(10, vector(bytes.fromhex('001d00170018'))), # supported_groups: x25519, secp256r1, secp384r1
+        extension(11, vector(b'\x00', 1)), # ec_point_formats: uncompressed
+        extension(13, vector(bytes.fromhex('040308040401050308050501080606010201'))), # signature_algorithms
+        extension(16, vector(vector(b'h2', 1) + vector(b'http/1.1', 1))), # ALPN
+        extension(43, vector(bytes.fromhex('03040303'), 1)), # supported_versions: TLS 1.3, 1.2
+        extension(51, vector(struct.pack('!HH', 0x001D, 32) + os.urandom(32))), # key_share: x25519
+    ])
+    body = (b'\x03\x03' + b'\x00' * 32 + vector(os.urandom(32), 1)
+            + vector(bytes.fromhex('130113021303c02bc02fc02cc030cca9cca8c013c014009c009d002f0035'))
+            + b'\x01\x00')
+    # Pad the record to the usual client hello size with a padding extension
+    padding = FAKE_TLS_HELLO_LENGTH - (5 + 4 + len(body) + 2 + len(extensions)) - 4
+    if padding >= 0:
+        extensions += extension(21, b'\x00' * padding)
+    body += vector(extensions)
+    handshake = b'\x01' + len(body).to_bytes(3, 'big') + body
+    hello = bytearray(bytes([TLS_RECORD_HANDSHAKE, 3, 1]) + vector(handshake))
+
+    digest = bytearray(hmac.new(key, bytes(hello), hashlib.sha256).digest())
+    timestamp = struct.unpack('<I', digest[28:32])[0] ^ (int(time.time() if now is None else now) & 0xFFFFFFFF)
+    digest[28:32] = struct.pack('<I', timestamp)
+    hello[11:43] = digest
+    return bytes(hello)
+
+
+def verify_fake_tls_server_hello(key, client_random, response):
+    """Checks the server random of a fake-TLS response: HMAC(key, client random + response with zeroed random)."""
+    if len(response) < 43:
+        return False
+    zeroed = response[:11] + b'\x00' * 32 + response[43:]
+    expected = hmac.new(key, client_random + zeroed, hashlib.sha256).digest()
+    return hmac.compare_digest(expected, response[11:43])
+
+
+async def read_tls_record(reader, expected_type):
+    header = await reader.readexactly(5)
+    if header[0] != expected_type or header[1] != 3:
+        raise ValueError(f"unexpected TLS record type {header[0]:#x}")
+    length = struct.unpack('!H', header[3:5])[0]
+    return header + await reader.readexactly(length)
+
+
+class ProxyHealthChecker:
+    """
+    Checks many proxies concurrently with asyncio.
+    Each check opens a TCP connection (latency = connect time) and, for fake-TLS ('ee') secrets
+    when fake_tls_handshake is enabled, performs the fake-TLS handshake and verifies the proxy's
+    signed answer. Concurrency is bounded globally and per host; failed checks are retried with
+    exponential backoff plus random jitter.
+    """
+
+    def __init__(self, concurrency=500, per_host_concurrency=4, connect_timeout=5.0, handshake_timeout=5.0,
+                 retries=1, retry_jitter=0.5, fake_tls_handshake=False):
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.connect_timeout = connect_timeout
+        self.handshake_timeout = handshake_timeout
+        self.retries = retries
+        self.retry_jitter = retry_jitter
+        self.fake_tls_handshake = fake_tls_handshake
+        self.checked = 0
+        self.status_counts = {}
+
+    async def _handshake(self, reader, writer, key, domain):
+        hello = build_fake_tls_client_hello(key, domain)
+        writer.write(hello)
+        await writer.drain()
+        response = await read_tls_record(reader, TLS_RECORD_HANDSHAKE)
+        response += await read_tls_record(reader, TLS_RECORD_CHANGE_CIPHER_SPEC)
+        response += await read_tls_record(reader, TLS_RECORD_APPLICATION_DATA)
+        return verify_fake_tls_server_hello(key, hello[11:43], response)
+
+    async def _check_once(self, host, port, secret):
+        """Returns (status, latency_ms)."""
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError, ValueError, OverflowError):
+            # ValueError covers UnicodeError from hostnames the idna codec rejects
+            return STATUS_DEAD, -1
+        latency_ms = int((time.perf_counter() - start) * 1000)
+        try:
+            tls = fake_tls_parameters(secret) if self.fake_tls_handshake else None
+            if tls is None:
+                return STATUS_ALIVE, latency_ms
+            try:
+                verified = await asyncio.wait_for(self._handshake(reader, writer, *tls), self.handshake_timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                verified = False
+            return (STATUS_VERIFIED if verified else STATUS_HANDSHAKE_FAILED), latency_ms
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+    async def _check(self, proxy, semaphore, host_semaphores):
+        host = proxy.get('resolved_ip') or proxy['ip']
+        try:
+            port = int(proxy['port'])
+        except (TypeError, ValueError):
+            return proxy, STATUS_DEAD, -1
+        if not 0 < port <= 65535:
+            return proxy, STATUS_DEAD, -1
+        host_semaphore = host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host_concurrency))
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Back off without holding a slot, so other checks can use it meanwhile
+                await asyncio.sleep(random.uniform(0, self.retry_jitter * 2 ** (attempt - 1)))
+            # The host's slot first: checks queued behind a busy host must not hold global slots while they wait
+            async with host_semaphore, semaphore:
+                status, latency_ms = await self._check_once(host, port, proxy.get('secret'))
+            if status in HEALTHY_STATUSES:
+                break
+        return proxy, status, latency_ms
+
+    async def _check_all(self, proxies):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = {}
+        return await asyncio.gather(*(self._check(proxy, semaphore, host_semaphores) for proxy in proxies))
+
+    def check_many(self, proxies):
+        """Checks proxies concurrently, setting 'status' and 'latency' (ms, -1 if unreachable) on each."""
+        if not proxies:
+            return proxies
+        for proxy, status, latency_ms in asyncio.run(self._check_all(proxies)):
+            proxy['status'] = status
+            proxy['latency'] = latency_ms
+            self.checked += 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return proxies
+
+    def stats_line(self):
+        counts = ', '.join(f"{count} {status}" for status, count in sorted(self.status_counts.items()))
+        return f"Health checks: {self.checked} proxies checked ({counts or 'none'})"
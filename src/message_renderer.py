@@ -0,0 +1,94 @@
+import json
+
+TELEGRAM_MESSAGE_MAX_LENGTH = 4096 # Bot API limit for sendMessage text, in UTF-16 code units
+CHANNEL_HANDLE = '@NexuProxy'
+BUTTON_TEXT = 'Connect'
+BUTTONS_PER_ROW = 3
+
+# See https://core.telegram.org/bots/api#markdownv2-style
+MARKDOWN_V2_SPECIAL_CHARS = '_*[]()~`>#+-=|{}.!'
+MARKDOWN_V2_ESCAPE_TABLE = str.maketrans({char: '\\' + char for char in MARKDOWN_V2_SPECIAL_CHARS})
+
+# Templates, bound once
+ADDRESS_LINK_LINE = '🔒 Address & Port: [{}]({})'.format
+ADDRESS_LINE = '🔒 Address & Port: {}'.format
+COUNTRY_WITH_EMOJI_LINE = '🌎 Country: {} {}'.format
+COUNTRY_LINE = '🌎 Country: {}'.format
+FRAGMENT = '{}\n{}'.format
+FRAGMENT_SEPARATOR = '\n\n'
+MESSAGE_FOOTER = '\n\n' + CHANNEL_HANDLE
+BUTTON_SEPARATOR = ', ' # json.dumps' default item separator, so the markup matches json.dumps output
+KEYBOARD = '{{"inline_keyboard": [{}]}}'.format
+ROW = '[{}]'.format
+
+
+def escape_markdown_v2(text):
+    """Escapes MarkdownV2 special characters."""
+    return str(text).translate(MARKDOWN_V2_ESCAPE_TABLE)
+
+
+def utf16_length(text):
+    """Length of text as Telegram counts it: in UTF-16 code units (emojis outside the BMP count twice)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def render_proxy(proxy):
+    """
+    Returns (fragment, button) for a proxy: its escaped message lines and the JSON of its "Connect"
+    button (None without a raw link). Rendered once per record and cached on it, so retried or
+    re-rendered chunks reuse the result. Render after geolocation, which sets the country fields.
+    """
+    cached = proxy.get('rendered')
+    if cached is not None:
+        return cached
+    address = escape_markdown_v2(f"{proxy.get('ip', 'N/A')}:{proxy.get('port', 'N/A')}")
+    raw_link = proxy.get('raw', '')
+    address_line = ADDRESS_LINK_LINE(address, escape_markdown_v2(raw_link)) if raw_link else ADDRESS_LINE(address)
+    country_name = proxy.get('country', 'Unknown')
+    if country_name != 'Unknown':
+        country_line = COUNTRY_WITH_EMOJI_LINE(proxy.get('country_emoji', ''), escape_markdown_v2(country_name))
+    else:
+        country_line = COUNTRY_LINE(escape_markdown_v2(country_name))
+    button = json.dumps({'text': BUTTON_TEXT, 'url': raw_link}) if raw_link else None
+    proxy['rendered'] = (FRAGMENT(address_line, country_line), button)
+    return proxy['rendered']
+
+
+def render_message(proxies):
+    """
+    Renders one message for a chunk of proxies. Returns (text, reply_markup), where reply_markup
+    is the inline keyboard JSON (buttons in rows of BUTTONS_PER_ROW) or None without buttons.
+    """
+    rendered = [render_proxy(proxy) for proxy in proxies]
+    text = FRAGMENT_SEPARATOR.join(fragment for fragment, _ in rendered) + MESSAGE_FOOTER
+    buttons = [button for _, button in rendered if button is not None]
+    if not buttons:
+        return text, None
+    rows = [ROW(BUTTON_SEPARATOR.join(buttons[i:i + BUTTONS_PER_ROW])) for i in range(0, len(buttons), BUTTONS_PER_ROW)]
+    return text, KEYBOARD(BUTTON_SEPARATOR.join(rows))
+
+
+def render_messages(chunks):
+    """Renders a batch of chunks. Returns a list of (text, reply_markup), one per chunk."""
+    return [render_message(chunk) for chunk in chunks]
+
+
+def fit_to_message(proxies, max_length=TELEGRAM_MESSAGE_MAX_LENGTH):
+    """
+    Splits proxies into (fitting, rest): the longest prefix whose message stays within max_length
+    UTF-16 code units, and the remaining proxies. A single proxy too long for any message is returned
+    in neither list. (The length is checked before MarkdownV2 escapes are removed, so the check
+    errs on the safe side.)
+    """
+    fitting = []
+    footer_length = utf16_length(MESSAGE_FOOTER)
+    length = footer_length
+    for i, proxy in enumerate(proxies):
+        added = utf16_length(render_proxy(proxy)[0]) + (utf16_length(FRAGMENT_SEPARATOR) if fitting else 0)
+        if length + added > max_length:
+            if not fitting and footer_length + added > max_length:
+                continue # Too long even on its own; skipped
+            return fitting, proxies[i:]
+        fitting.append(proxy)
+        length += added
+    return fitting, []
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import time
+
+from archive_store import DEFAULT_CHANNEL
+from state_store import load_json_state, save_json_state
+
+
+class PostingJournal:
+    """
+    Append-only journal of posted chunks, one JSON line per chunk holding its archive entries.
+    Each line is flushed and fsync'd as soon as Telegram has acknowledged the chunk, so a run that
+    is killed before it saves the archive does not post those proxies again: the next run replays
+    the journal into the archive and then clears it.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = None
+        self.recorded = 0
+
+    def record(self, channel, entries):
+        """Appends one chunk posted to channel: entries is a list of (archive key, raw link, country code) triples."""
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+                self._file = open(self.file_path, 'a')
+            line = json.dumps({'time': time.time(), 'channel': channel, 'entries': entries}, separators=(',', ':'))
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.recorded += 1
+        except Exception as e:
+            logging.error(f"Error writing to posting journal {self.file_path}: {e}")
+
+    def read(self):
+        """
+        Returns {channel: archive entries} of every journaled chunk. A line cut short by a crash
+        mid-write is skipped (its chunk was never recorded as posted). Lines written before
+        channels were journaled belong to the default channel.
+        """
+        entries = {}
+        if not os.path.exists(self.file_path):
+            return entries
+        try:
+            with open(self.file_path, 'r') as f:
+                for line in f:
+                    try:
+                        chunk = json.loads(line)
+                        entries.setdefault(chunk.get('channel', DEFAULT_CHANNEL), []).extend(tuple(entry) for entry in chunk['entries'])
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        logging.warning(f"Skipping a damaged line in posting journal {self.file_path}.")
+        except Exception as e:
+            logging.error(f"Error reading posting journal {self.file_path}: {e}")
+        return entries
+
+    def replay(self, archive):
+        """Adds the journaled entries to the archive, then clears the journal. Returns the entries added."""
+        entries = self.read()
+        if not entries:
+            return 0
+        added = sum(archive.add_many(channel_entries, channel) for channel, channel_entries in entries.items())
+        logging.info(f"Replayed {sum(map(len, entries.values()))} journaled entries of {len(entries)} channels into the archive "
+                     f"({added} were missing).")
+        self.clear()
+        return added
+
+    def clear(self):
+        """Empties the journal. Call only once the journaled entries are in the archive."""
+        self.close()
+        try:
+            if os.path.exists(self.file_path):
+                os.remove(self.file_path)
+        except OSError as e:
+            logging.error(f"Error clearing posting journal {self.file_path}: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def save_pending_queue(file_path, fetched_at, proxies):
+    """
+    Saves proxies that were fetched and filtered but not posted yet, best first, so the next run
+    can post them without fetching again. fetched_at is when they were fetched; it is kept when a
+    resumed queue is saved again, so proxies cannot be carried over forever.
+    The cached message rendering is not saved; it is rebuilt on demand.
+    Returns False if the proxies could not be saved.
+    """
+    if not proxies:
+        remove_pending_queue(file_path)
+        return True
+    records = [{field: value for field, value in proxy.items() if field != 'rendered'} for proxy in proxies]
+    if not save_json_state(file_path, {'fetched_at': fetched_at, 'proxies': records}):
+        return False
+    logging.info(f"Saved {len(records)} unposted proxies to {file_path}.")
+    return True
+
+
+def load_pending_queue(file_path, max_age_seconds, now=None):
+    """
+    Returns (fetched_at, proxies) of the saved pending queue, or None if there is none or it was
+    fetched more than max_age_seconds ago.
+    """
+    state = load_json_state(file_path, None)
+    if not isinstance(state, dict) or not state.get('proxies'):
+        return None
+    fetched_at = state.get('fetched_at', 0)
+    age = (time.time() if now is None else now) - fetched_at
+    if age > max_age_seconds:
+        logging.info(f"Pending queue {file_path} is {age:.0f} seconds old. Fetching subscriptions again.")
+        return None
+    return fetched_at, state['proxies']
+
+
+def remove_pending_queue(file_path):
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    except OSError as e:
+        logging.error(f"Error removing pending queue {file_path}: {e}")
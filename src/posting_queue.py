@@ -0,0 +1,123 @@
+import heapq
+import time
+
+
+class PostingQueue:
+    """
+    Priority queue of proxies waiting to be posted, best first.
+    A proxy's score (lower is better) is a weighted sum of three terms, each scaled to 0..1:
+    - latency: measured connect latency, capped at latency_cap_ms (unknown latency counts as the cap)
+    - age: time since the proxy was first sighted, capped at age_cap_seconds
+    - unreliability: 1 - reliability of the subscription the proxy came from
+    Scores are computed once, when a proxy is pushed, and kept in a heap, so taking the best
+    chunk costs O(k log n) and the whole candidate set is never sorted.
+    pop_chunk() spreads each chunk over countries: at most max_per_country proxies of one
+    country are taken while proxies of other countries are near the head of the queue.
+    A proxy whose archive key is already queued is not queued again, so the queue can be refilled
+    from later fetches while it still holds proxies from earlier ones.
+    """
+
+    def __init__(self, max_per_country=3, latency_weight=1.0, freshness_weight=0.5, reliability_weight=0.5,
+                 latency_cap_ms=2000, age_cap_seconds=7 * 24 * 3600, source_reliability=None,
+                 first_seen_lookup=None, clock=time.time):
+        self.max_per_country = max_per_country
+        self.latency_weight = latency_weight
+        self.freshness_weight = freshness_weight
+        self.reliability_weight = reliability_weight
+        self.latency_cap_ms = latency_cap_ms
+        self.age_cap_seconds = age_cap_seconds
+        self.source_reliability = source_reliability # Callable: source -> 0..1, or None to ignore sources
+        self.first_seen_lookup = first_seen_lookup # Callable: [proxies] -> {archive_key: first_seen}, or None
+        self.clock = clock
+        self._heap = []
+        self._keys = set() # Archive keys of the queued proxies
+        self._sequence = 0 # Tie breaker: equal scores keep arrival order
+        self.pushed = 0
+        self.popped = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def score(self, proxy, first_seen=None, now=None):
+        latency = proxy.get('latency', -1)
+        latency_term = min(latency, self.latency_cap_ms) / self.latency_cap_ms if latency is not None and latency >= 0 else 1.0
+        age_term = 0.0
+        if first_seen is not None:
+            now = self.clock() if now is None else now
+            age_term = min(max(now - first_seen, 0), self.age_cap_seconds) / self.age_cap_seconds
+        reliability_term = 0.0
+        if self.source_reliability:
+            reliability_term = 1.0 - self.source_reliability(proxy.get('source'))
+        return (self.latency_weight * latency_term + self.freshness_weight * age_term
+                + self.reliability_weight * reliability_term)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def push_many(self, proxies, first_seen=None):
+        """Queues proxies. first_seen ({archive_key: first_seen}) may be given if already looked up."""
+        proxies = [proxy for proxy in proxies if proxy['archive_key'] not in self._keys]
+        now = self.clock()
+        if first_seen is None:
+            first_seen = self.first_seen_lookup(proxies) if self.first_seen_lookup and proxies else {}
+        for proxy in proxies:
+            self._keys.add(proxy['archive_key'])
+            entry = (self.score(proxy, first_seen.get(proxy['archive_key']), now), self._sequence, proxy)
+            heapq.heappush(self._heap, entry)
+            self._sequence += 1
+            self.pushed += 1
+
+    def fill(self, proxies, target_size, batch_size=500):
+        """
+        Pulls proxies from an iterator until the queue holds target_size of them.
+        Returns False once the iterator is exhausted.
+        """
+        while len(self._heap) < target_size:
+            batch = []
+            for proxy in proxies:
+                batch.append(proxy)
+                if len(batch) >= min(batch_size, target_size - len(self._heap)):
+                    break
+            if not batch:
+                return False
+            self.push_many(batch)
+        return True
+
+    def pop_chunk(self, size):
+        """Removes and returns the best proxies for one post, spread over countries."""
+        chunk = []
+        deferred = [] # Entries skipped because their country already filled its share of the chunk
+        per_country = {}
+        # Look at most max_deferred entries past the ones taken, so a queue dominated by one
+        # country still costs O(k log n) per chunk
+        max_deferred = size * 4
+        while self._heap and len(chunk) < size and len(deferred) < max_deferred:
+            entry = heapq.heappop(self._heap)
+            country = entry[2].get('country_code') # Proxies that could not be geolocated are not limited
+            if country and per_country.get(country, 0) >= self.max_per_country:
+                deferred.append(entry)
+                continue
+            per_country[country] = per_country.get(country, 0) + 1
+            chunk.append(entry[2])
+        # Not enough other countries queued: fill up with the best skipped entries
+        while deferred and len(chunk) < size:
+            chunk.append(deferred.pop(0)[2])
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        self.popped += len(chunk)
+        self._keys.difference_update(proxy['archive_key'] for proxy in chunk)
+        return chunk
+
+    def snapshot(self):
+        """Returns every queued proxy, best first, leaving the queue as it is."""
+        return [entry[2] for entry in sorted(self._heap)]
+
+    def drain(self):
+        """Removes and returns every queued proxy, best first."""
+        proxies = self.snapshot()
+        self._heap = []
+        self._keys.clear()
+        return proxies
+
+    def stats_line(self):
+        return f"Posting queue: {self.pushed} proxies queued, {self.popped} taken for posting, {len(self._heap)} left"
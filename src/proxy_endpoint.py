@@ -0,0 +1,87 @@
+import base64
+import hashlib
+import re
+import socket
+import struct
+
+SECRET_PREFIX_PADDED = 0xDD # 'dd' + 16-byte key: the client adds random padding
+SECRET_PREFIX_FAKE_TLS = 0xEE # 'ee' + 16-byte key + domain: the client disguises traffic as TLS to the domain
+
+HEX_DIGITS = '0123456789abcdefABCDEF'
+BASE64_SECRET = re.compile(r'[A-Za-z0-9+/_-]*={0,2}') # Standard or url-safe alphabet, optionally padded
+
+HOST_IPV4 = 4
+HOST_IPV6 = 6
+HOST_NAME = 0
+PORT_INVALID = 0xFFFFFFFF
+
+
+def decode_secret(secret):
+    """Decodes a proxy secret given in hex or base64 (url-safe or standard) form. Returns bytes or None."""
+    if not secret:
+        return None
+    try:
+        if len(secret) % 2 == 0 and not secret.strip(HEX_DIGITS):
+            return bytes.fromhex(secret)
+        if not BASE64_SECRET.fullmatch(secret):
+            return None # urlsafe_b64decode would silently drop the other characters
+        secret = secret.rstrip('=')
+        return base64.urlsafe_b64decode(secret + '=' * (-len(secret) % 4))
+    except ValueError:
+        return None
+
+
+def canonical_secret(secret):
+    """
+    Returns the bytes identifying a proxy secret, however it is written:
+    - hex (any case) and base64/base64url forms of the same bytes are equal;
+    - 'dd' + key is the plain key (the prefix only asks the client to pad its traffic);
+    - 'ee' secrets keep their domain (lowercased), since a fake-TLS proxy may only accept its own.
+    Secrets that decode in neither form are kept as their text.
+    """
+    secret_bytes = decode_secret(secret)
+    if secret_bytes is None:
+        return (secret or '').encode('utf-8', 'replace')
+    if len(secret_bytes) == 17 and secret_bytes[0] == SECRET_PREFIX_PADDED:
+        return secret_bytes[1:]
+    if len(secret_bytes) > 17 and secret_bytes[0] == SECRET_PREFIX_FAKE_TLS:
+        return secret_bytes[:17] + secret_bytes[17:].lower()
+    return secret_bytes
+
+
+def canonical_host(server):
+    """
+    Returns (host type, host bytes): the packed address for IPv4/IPv6 literals (so every way of
+    writing an address is equal), or the lowercased hostname without a trailing dot.
+    """
+    host = (server or '').strip().lower()
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    # inet_pton is strict (no shortened or zero-padded IPv4 forms) and fast; this runs for every new line
+    try:
+        if ':' in host:
+            return HOST_IPV6, socket.inet_pton(socket.AF_INET6, host)
+        return HOST_IPV4, socket.inet_pton(socket.AF_INET, host)
+    except (OSError, ValueError):
+        return HOST_NAME, host.rstrip('.').encode('utf-8', 'replace')
+
+
+def canonical_endpoint(server, port, secret):
+    """
+    Returns a compact binary key for a proxy endpoint: host type, host length and bytes, port and
+    canonical secret bytes. Links to the same endpoint give the same key regardless of secret
+    encoding, 'dd' prefix, host case, address notation or tag.
+    """
+    host_type, host = canonical_host(server)
+    port = str(port or '').strip()
+    if port.isascii() and port.isdigit() and int(port) <= 0xFFFF:
+        port_number = int(port)
+    else:
+        port_number = PORT_INVALID
+        host += b':' + port.encode('utf-8', 'replace') # Keeps malformed ports apart from each other
+    return struct.pack('!BHI', host_type, len(host), port_number) + host + canonical_secret(secret)
+
+
+def endpoint_hash(canonical):
+    """64-bit hash of a canonical endpoint key, signed so it fits SQLite's INTEGER."""
+    return int.from_bytes(hashlib.blake2b(canonical, digest_size=8).digest(), 'big', signed=True)
@@ -1,10 +1,31 @@
 import requests
 import time
-import re
+import argparse
+import signal
 import os
 import logging
-import json
-from urllib.parse import urlparse, unquote, parse_qs
+import hashlib
+import tempfile
+import threading
+import heapq
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from urllib.parse import urlparse, unquote
+from requests.adapters import HTTPAdapter
+
+from archive_store import ArchiveStore, DEFAULT_CHANNEL, archive_key
+from channel_router import ArchiveRoutingView, ChannelRouter, load_channels
+from dns_resolver import AsyncDNSResolver, is_ip_address
+from fetch_cache import FetchCache
+from geoip_cache import GeoIPCache
+from health_check import ProxyHealthChecker, HEALTHY_STATUSES
+from message_renderer import fit_to_message, render_message
+from posting_journal import PostingJournal, load_pending_queue, save_pending_queue
+from posting_queue import PostingQueue
+from run_metrics import RunMetrics, run_profiled
+from source_scheduler import SourceScheduler, FETCH_OK, FETCH_NOT_MODIFIED, FETCH_SOURCE_ERROR, FETCH_HOST_ERROR
+from telegram_sender import TelegramSender
 
 # GeoIP library
 try:
@@ -15,46 +36,174 @@ except ImportError:
     GEOIP_ENABLED = False
 
 # --- Configuration ---
-# Get these from GitHub Secrets
-TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
-TELEGRAM_CHANNEL_ID = os.environ.get('TELEGRAM_CHANNEL_ID') # Your channel ID (e.g., -100123456789)
+# Get these from GitHub Secrets (read from the environment by load_environment() when run as a script)
+TELEGRAM_BOT_TOKEN = None
+TELEGRAM_CHANNEL_ID = None # Your channel ID (e.g., -100123456789)
 
 # File paths relative to the script's execution location (repo root in GitHub Actions)
 SUBSCRIPTION_FILE = 'data/subscriptions.txt'
-ARCHIVE_FILE = 'data/archive.txt'
+ARCHIVE_FILE = 'data/archive.db' # SQLite archive of posted proxies, keyed by a hash of (server, port, secret)
+LEGACY_ARCHIVE_FILE = 'data/archive.txt' # Old line-per-proxy archive, migrated into ARCHIVE_FILE on first run
+FETCH_CACHE_FILE = 'data/fetch_cache.json' # ETag / Last-Modified / body hash per subscription link
 # Updated path for the GeoLite2 Country database
 GEOIP_DATABASE_PATH = 'data/GeoLite2-Country.mmdb'
+GEOIP_CACHE_FILE = 'data/geoip_cache.json' # IP -> country memo persisted between runs
+DNS_CACHE_FILE = 'data/dns_cache.json' # Hostname -> IP cache persisted between runs (respects record TTLs)
+POSTING_JOURNAL_FILE = 'data/post_journal.jsonl' # Chunks posted but not yet saved to the archive (survives a killed run)
+PENDING_QUEUE_FILE = 'data/pending_queue.json' # Fetched proxies left unposted, for the next run to resume from
+CHANNELS_FILE = 'data/channels.json' # Output channels and their routing rules; without it everything goes to TELEGRAM_CHANNEL_ID
 
-POST_DELAY_SECONDS = 600 # Delay between posts (e.g., 600 seconds = 10 minutes)
+POST_DELAY_SECONDS = 600 # Minimum delay between posts (e.g., 600 seconds = 10 minutes)
 PROXIES_PER_POST = 9 # Number of proxies to include in each Telegram message
 MAX_EXECUTION_TIME_SECONDS = 3300 # Maximum execution time in seconds (55 minutes)
 
+# Telegram sending
+TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = 30 # Bot API limit across all chats
+TELEGRAM_CHAT_MESSAGES_PER_MINUTE = 20 # Bot API limit per group/channel
+TELEGRAM_SEND_MAX_ATTEMPTS = 3 # Attempts per message before the chunk goes to the retry queue
+TELEGRAM_SEND_BACKOFF_SECONDS = 2.0 # Wait before retrying a failed send (doubling per attempt; 429s wait retry_after instead)
+POST_CHUNK_MAX_ATTEMPTS = 3 # Times a chunk is taken from the retry queue before it is given up
+
+# Subscription fetching
+FETCH_WORKERS = 16 # Number of subscription links fetched concurrently
+FETCH_TIMEOUT_SECONDS = 15 # Timeout for fetching a single subscription link
+FETCH_MAX_CONNECTIONS_PER_HOST = 8 # Max concurrent (keep-alive) connections to the same host
+FETCH_TOTAL_DEADLINE_SECONDS = 600 # Total time allowed for the whole fetch stage (10 minutes)
+FETCH_CACHE_MAX_ENTRIES = 5000 # Max subscription links remembered in the fetch cache
+FETCH_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600 # Forget links not fetched for a week
+FETCH_STREAM_CHUNK_BYTES = 64 * 1024 # Read size when streaming subscription bodies
+FETCH_SPOOL_MAX_MEMORY_BYTES = 1024 * 1024 # Filtered lines of a subscription beyond this size are spooled to disk
+
+# Subscription scheduling from per-source statistics kept between runs (latency, failures, yield of new proxies, duplicates)
+SOURCE_SCHEDULER_ENABLED = True
+SOURCE_STATS_FILE = 'data/source_stats.json'
+SOURCE_STATS_SMOOTHING = 0.3 # Weight of the latest fetch in the moving averages
+SOURCE_LOW_YIELD_GRACE_FETCHES = 3 # Fetches in a row without a new proxy before a source is fetched less often...
+SOURCE_LOW_YIELD_INTERVAL_SECONDS = 2 * 3600 # ...at most this often, doubling with each further empty fetch...
+SOURCE_LOW_YIELD_MAX_INTERVAL_SECONDS = 24 * 3600 # ...up to this
+SOURCE_BREAKER_FAILURE_THRESHOLD = 2 # Failed fetches in a row before a host (or source) is skipped...
+SOURCE_BREAKER_BASE_SECONDS = 3600 # ...for this long, doubling with each further failure...
+SOURCE_BREAKER_MAX_SECONDS = 7 * 24 * 3600 # ...up to this
+
+# Geolocation
+GEOIP_CACHE_MAX_ENTRIES = 100000 # Max addresses kept in the GeoIP memo (least recently used are dropped)
+GEOIP_CACHE_BY_PREFIX = False # Memoize per /24 (IPv4) or /48 (IPv6) network instead of per address
+GEOIP_BATCH_SIZE = 500 # Candidate proxies geolocated together (unique addresses are looked up once)
+
+# Hostname resolution for proxies whose server is not a literal IP address
+DNS_RESOLUTION_ENABLED = True
+DNS_NAMESERVER = None # 'host' or 'host:port' (DNS_NAMESERVER environment variable); defaults to the first nameserver in /etc/resolv.conf
+DNS_CONCURRENCY = 100 # Max DNS queries in flight
+DNS_QUERY_TIMEOUT_SECONDS = 3 # Timeout per DNS query
+DNS_BATCH_SIZE = 1000 # Unique proxies collected before their hostnames are resolved together
+
+# Reachability checks (TCP connect, optionally the MTProto fake-TLS handshake) before posting
+HEALTH_CHECK_ENABLED = True
+HEALTH_CHECK_CONCURRENCY = 500 # Max checks in flight
+HEALTH_CHECK_PER_HOST_CONCURRENCY = 4 # Max checks in flight against the same address
+HEALTH_CHECK_CONNECT_TIMEOUT_SECONDS = 5 # TCP connect timeout per attempt
+HEALTH_CHECK_HANDSHAKE_TIMEOUT_SECONDS = 5 # Fake-TLS handshake timeout per attempt
+HEALTH_CHECK_RETRIES = 1 # Extra attempts for proxies that fail a check
+HEALTH_CHECK_RETRY_JITTER_SECONDS = 0.5 # Retries wait a random time up to this (doubling per attempt)
+HEALTH_CHECK_FAKE_TLS_HANDSHAKE = False # Verify 'ee' (fake-TLS) proxies with a signed handshake, not just a TCP connect
+HEALTH_CHECK_BATCH_SIZE = 500 # New proxies collected before they are checked together
+
+# Posting order: new proxies are queued and posted best first (lower score = better)
+POSTING_QUEUE_LOOKAHEAD = 5000 # Candidates pulled into the queue ahead of the chunk being posted
+POSTING_QUEUE_MAX_PER_COUNTRY = 3 # Max proxies from one country per post while other countries are queued
+POSTING_QUEUE_LATENCY_WEIGHT = 1.0 # Weight of measured latency (capped at POSTING_QUEUE_LATENCY_CAP_MS)
+POSTING_QUEUE_FRESHNESS_WEIGHT = 0.5 # Weight of time since first sighting (capped at POSTING_QUEUE_AGE_CAP_SECONDS)
+POSTING_QUEUE_RELIABILITY_WEIGHT = 0.5 # Weight of the source's share of unreachable proxies
+POSTING_QUEUE_LATENCY_CAP_MS = 2000
+POSTING_QUEUE_AGE_CAP_SECONDS = 7 * 24 * 3600
+PENDING_QUEUE_MAX_AGE_SECONDS = 2 * 3600 # A run resumes from the saved queue (skipping the fetch stage) if it was fetched this recently...
+PENDING_QUEUE_MIN_PROXIES = 100 # ...and still holds at least this many proxies; otherwise subscriptions are fetched again
+
+# Daemon mode (--daemon): one long-running process instead of one run per cron tick
+DAEMON_FETCH_INTERVAL_SECONDS = 3600 # Time between fetch cycles (subscriptions.txt changes trigger one right away)
+DAEMON_TICK_SECONDS = 5 # Max time the scheduler sleeps before checking for due work and file changes
+DAEMON_INGEST_BATCH_SIZE = 500 # Candidates ingested per scheduler step, so due posts are not held up by a fetch cycle
+DAEMON_QUEUE_MAX_SIZE = 50000 # A fetch cycle stops ingesting once this many proxies are queued
+
+# Archive retention
+ARCHIVE_TTL_SECONDS = 30 * 24 * 3600 # Proxies last posted more than 30 days ago may be posted again
+ARCHIVE_MAX_ENTRIES = 500000 # Cap on archived proxies; the least recently seen ones are evicted first
+
+# Number of distinct raw proxy lines whose parse result is memoized within a run.
+# Aggregated feeds repeat the same lines many times; repeats are parsed only once.
+PARSE_CACHE_MAX_ENTRIES = 65536
+# Parse and deduplicate in this many worker processes (0 = in the main process). Helps on
+# multi-core runners with feeds of millions of lines; the output is the same either way.
+PARSE_WORKERS = 0
+PARSE_BLOCK_LINES = 50000 # Raw lines handed out to the parse workers per round
+
 # Threshold length for secret heuristic (secrets longer than this with trailing A's are skipped)
 # Secrets shorter than this with trailing A's will have the A's trimmed.
 # Adjusted based on user feedback and provided proxy list.
 SECRET_HEURISTIC_LENGTH_THRESHOLD = 60 # Adjusted threshold
 
-# Telegram Bot API base URL
-TELEGRAM_API_URL = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}'
+# Run metrics: per-stage times, call counts, fetch latency histograms and cache/dedup ratios of each run
+RUN_REPORT_FILE = 'data/run_report.json' # JSON run report
+METRICS_FILE = 'data/metrics.prom' # The same metrics in Prometheus text format (e.g. for node_exporter's textfile collector)
+PROFILER = None # 'cprofile' or 'pyinstrument' to profile the run (PROXY_POSTER_PROFILE environment variable)
+PROFILE_OUTPUT_FILE = 'data/profile' # Profile output path; the profiler adds .prof or .html
+
+# Telegram Bot API base URL (TELEGRAM_API_BASE_URL can point at a self-hosted Bot API server)
+TELEGRAM_API_BASE_URL = 'https://api.telegram.org'
+
+
+def load_environment(environ=None):
+    """
+    Reads the secrets and environment overrides into the configuration above.
+    Called when the script starts, not at import, so the module can be driven programmatically
+    (e.g. by the benchmarks) with the configuration set directly.
+    """
+    global TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID, TELEGRAM_API_BASE_URL, DNS_NAMESERVER, PROFILER
+    environ = os.environ if environ is None else environ
+    TELEGRAM_BOT_TOKEN = environ.get('TELEGRAM_BOT_TOKEN')
+    TELEGRAM_CHANNEL_ID = environ.get('TELEGRAM_CHANNEL_ID')
+    TELEGRAM_API_BASE_URL = environ.get('TELEGRAM_API_BASE_URL', TELEGRAM_API_BASE_URL)
+    DNS_NAMESERVER = environ.get('DNS_NAMESERVER')
+    PROFILER = environ.get('PROXY_POSTER_PROFILE')
+
+def telegram_api_url():
+    return f'{TELEGRAM_API_BASE_URL}/bot{TELEGRAM_BOT_TOKEN}'
 
-# --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Run Metrics ---
+run_metrics = RunMetrics()
 
 # --- GeoIP Setup ---
-geoip_reader = None
-if GEOIP_ENABLED:
-    if os.path.exists(GEOIP_DATABASE_PATH):
+geoip_reader = None # Opened by open_geoip_database() at the start of a run
+
+def open_geoip_database(path=None):
+    """Opens the GeoIP Country database (GEOIP_DATABASE_PATH by default). Geolocation is disabled if it can't be."""
+    global geoip_reader
+    path = path or GEOIP_DATABASE_PATH
+    close_geoip_database()
+    if not GEOIP_ENABLED:
+        return
+    if not os.path.exists(path):
+        logging.warning(f"GeoIP Country database not found at {path}. Geolocation will be disabled.")
+        return
+    try:
+        # Use geoip2.database.Reader for the Country database, memory-mapped so the
+        # database is paged in on demand instead of being read into memory
         try:
-            # Use geoip2.database.Reader for the Country database
-            geoip_reader = geoip2.database.Reader(GEOIP_DATABASE_PATH)
-            logging.info("GeoIP Country database loaded successfully.")
-        except Exception as e:
-            logging.error(f"Error loading GeoIP Country database: {e}")
-            geoip_reader = None # Disable GeoIP if loading fails
-            GEOIP_ENABLED = False
-    else:
-        logging.warning(f"GeoIP Country database not found at {GEOIP_DATABASE_PATH}. Geolocation will be disabled.")
-        GEOIP_ENABLED = False
+            geoip_reader = geoip2.database.Reader(path, mode=geoip2.database.MODE_MMAP_EXT)
+        except ValueError:
+            # The maxminddb C extension is not installed; use the pure-Python memory-mapped reader
+            geoip_reader = geoip2.database.Reader(path, mode=geoip2.database.MODE_MMAP)
+        logging.info("GeoIP Country database loaded successfully.")
+    except Exception as e:
+        logging.error(f"Error loading GeoIP Country database: {e}")
+        geoip_reader = None # Disable GeoIP if loading fails
+
+def close_geoip_database():
+    global geoip_reader
+    if geoip_reader:
+        geoip_reader.close()
+        geoip_reader = None
 
 
 def get_geolocation(ip_address):
@@ -87,6 +236,52 @@ def get_country_emoji(country_code):
     # (Regional Indicator Symbol Letter U + Regional Indicator Symbol Letter S)
     return ''.join(chr(0x1F1E6 + ord(c) - ord('A')) for c in country_code.upper())
 
+def get_geoip_database_version():
+    """Returns the build time of the loaded GeoIP database, used to invalidate the GeoIP cache."""
+    if not GEOIP_ENABLED or not geoip_reader:
+        return None
+    try:
+        return geoip_reader.metadata().build_epoch
+    except Exception:
+        return None
+
+def geolocate_proxies(proxies, geoip_cache):
+    """
+    Fills in country details for a batch of parsed proxies.
+    Each unique address in the batch is resolved once, through the GeoIP memo cache.
+    """
+    countries = {}
+    # Resolved addresses of hostnames are used when available (see iter_resolved_proxies)
+    for ip_address in {proxy.get('resolved_ip') or proxy['ip'] for proxy in proxies}:
+        if not is_ip_address(ip_address):
+            # A hostname that did not resolve: no lookup, and nothing cached, so it is located once it resolves
+            countries[ip_address] = ('Unknown', '')
+            continue
+        cached = geoip_cache.get(ip_address)
+        if cached is None:
+            country_name, _, country_code = get_geolocation(ip_address)
+            geoip_cache.put(ip_address, country_name, country_code)
+            cached = (country_name, country_code)
+        countries[ip_address] = cached
+
+    for proxy in proxies:
+        country_name, country_code = countries[proxy.get('resolved_ip') or proxy['ip']]
+        proxy['country'] = country_name
+        proxy['country_emoji'] = get_country_emoji(country_code) if country_code else ''
+        proxy['country_code'] = country_code # Store the country code
+    return proxies
+
+def iter_geolocated_proxies(proxies, geoip_cache, batch_size=GEOIP_BATCH_SIZE):
+    """Geolocates a stream of proxies in batches of batch_size and yields them in order."""
+    batch = []
+    for proxy in proxies:
+        batch.append(proxy)
+        if len(batch) >= batch_size:
+            yield from geolocate_proxies(batch, geoip_cache)
+            batch = []
+    if batch:
+        yield from geolocate_proxies(batch, geoip_cache)
+
 def process_secret_with_heuristic(secret):
     """
     Applies a heuristic to process secrets based on trailing 'A's and length.
@@ -128,230 +323,608 @@ def process_secret_with_heuristic(secret):
 
 # --- Helper Functions ---
 
-def get_proxies_from_links(file_path):
-    """Reads subscription links from a file and fetches raw proxy strings."""
-    raw_proxies = []
+def create_http_session(max_connections_per_host=FETCH_MAX_CONNECTIONS_PER_HOST):
+    """Creates a keep-alive requests session with a bounded connection pool per host."""
+    session = requests.Session()
+    # pool_maxsize caps the connections kept per host; pool_block makes extra requests wait
+    # for a free connection instead of opening (and discarding) additional ones.
+    adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=max_connections_per_host, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def is_telegram_proxy_line(line):
+    """Checks whether a stripped subscription line is a tg:// or https://t.me/proxy link."""
+    return line.startswith('tg://proxy?') or line.startswith('https://t.me/proxy?')
+
+
+def write_proxy_lines(spool, lines):
+    """Writes the Telegram proxy links among raw (bytes) lines to the spool. Returns how many were kept."""
+    # Assuming subscription links provide lists of tg:// or https://t.me/proxy links
+    text = b'\n'.join(lines).decode('utf-8', 'replace')
+    kept = [line for line in map(str.strip, text.splitlines()) if is_telegram_proxy_line(line)]
+    if kept:
+        spool.write('\n'.join(kept) + '\n')
+    return len(kept)
+
+
+def fetch_subscription(session, link, fetch_cache=None, deadline=None):
+    """
+    Streams a single subscription link chunk by chunk and keeps only the Telegram proxy links.
+    The kept lines are spooled to a temporary file (in memory while small, on disk beyond
+    FETCH_SPOOL_MAX_MEMORY_BYTES), so large bodies are never held in memory as a whole.
+    Returns (spool, line_count) with the spool rewound, or None if the body is unchanged
+    since the last run according to the fetch cache (its lines were already processed then).
+    """
+    headers = fetch_cache.conditional_headers(link) if fetch_cache else {}
+    with session.get(link, timeout=FETCH_TIMEOUT_SECONDS, headers=headers, stream=True) as response: # Timeout for fetching the link
+        if response.status_code == 304 and fetch_cache:
+            fetch_cache.record_not_modified(link)
+            logging.info(f"Subscription {link} not modified since last run. Skipping.")
+            return None
+        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+
+        body_hash = hashlib.sha256()
+        spool = tempfile.SpooledTemporaryFile(max_size=FETCH_SPOOL_MAX_MEMORY_BYTES, mode='w+', encoding='utf-8')
+        line_count = 0
+        pending = b'' # Incomplete last line of the previous chunk
+        try:
+            # Read the body chunk by chunk and filter the complete lines of each chunk as they arrive
+            for chunk in response.iter_content(chunk_size=FETCH_STREAM_CHUNK_BYTES):
+                body_hash.update(chunk)
+                run_metrics.increment('fetch_bytes', len(chunk), {'url': link})
+                if deadline and time.monotonic() > deadline:
+                    raise TimeoutError(f"fetch deadline reached while reading {link}")
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                line_count += write_proxy_lines(spool, lines)
+            line_count += write_proxy_lines(spool, [pending])
+        except BaseException:
+            spool.close()
+            raise
+
+    if fetch_cache:
+        unchanged = fetch_cache.record_response(
+            link, response.headers.get('ETag'), response.headers.get('Last-Modified'), body_hash.hexdigest()
+        )
+        if unchanged:
+            spool.close()
+            logging.info(f"Subscription {link} content unchanged since last run. Skipping.")
+            return None
+
+    spool.seek(0)
+    return spool, line_count
+
+
+def iter_proxies_from_links(file_path, workers=FETCH_WORKERS, deadline_seconds=FETCH_TOTAL_DEADLINE_SECONDS,
+                            max_connections_per_host=FETCH_MAX_CONNECTIONS_PER_HOST, fetch_cache=None, with_source=False,
+                            session=None, scheduler=None):
+    """
+    Reads subscription links from a file, fetches them concurrently and yields raw proxy strings
+    (or (subscription link, raw proxy string) pairs if with_source is True).
+    Links are fetched by a pool of worker threads sharing one keep-alive session, with at most
+    max_connections_per_host requests in flight per host and a total deadline for the stage.
+    Lines are yielded in the order the links appear in the file, regardless of completion order,
+    as soon as each subscription (and every one before it) has been downloaded.
+    If a fetch_cache is given, unchanged subscriptions contribute no lines, and subscriptions
+    whose lines were not all read (the stream was closed first) are forgotten by it, so they are
+    fetched and parsed again next time.
+    A long-lived session may be passed in to keep connections warm between calls; otherwise
+    a session is created for this call and closed when it is done.
+    With a SourceScheduler, only the links it considers due are fetched, in its order (most
+    productive first), and each fetch is reported back to it.
+    """
     try:
         with open(file_path, 'r') as f:
             links = [line.strip() for line in f if line.strip()]
     except FileNotFoundError:
         logging.error(f"Subscription file not found at {file_path}")
-        return raw_proxies
-
-    logging.info(f"Fetching proxies from {len(links)} subscription links...")
-    for link in links:
+        return
+    if scheduler:
+        listed = len(links)
+        links = scheduler.plan(links)
+        logging.info(f"{len(links)} of {listed} subscription links are due. {scheduler.stats_line()}")
+
+    logging.info(f"Fetching proxies from {len(links)} subscription links using {workers} workers...")
+    deadline = time.monotonic() + deadline_seconds
+    own_session = session is None
+    if own_session:
+        session = create_http_session(max_connections_per_host)
+    host_semaphores = {}
+    host_semaphores_lock = threading.Lock()
+
+    def get_host_semaphore(link):
+        host = urlparse(link).netloc.lower()
+        with host_semaphores_lock:
+            if host not in host_semaphores:
+                host_semaphores[host] = threading.BoundedSemaphore(max_connections_per_host)
+            return host_semaphores[host]
+
+    def fetch_with_limits(link):
+        semaphore = get_host_semaphore(link)
+        # Wait for a free slot on this host, but never past the stage deadline
+        if not semaphore.acquire(timeout=max(0, deadline - time.monotonic())):
+            logging.warning(f"Fetch deadline reached before {link} could be fetched. Skipping.")
+            run_metrics.increment('fetch_results', labels={'result': 'skipped'})
+            return None
+        outcome = 'error'
+        start = time.perf_counter()
         try:
-            response = requests.get(link, timeout=15) # Timeout for fetching the link
-            response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-            content = response.text
-
-            # Assuming subscription links provide lists of tg:// or https://t.me/proxy links
-            # Split content by lines and filter for relevant links
-            proxy_links_from_link = [
-                line.strip() for line in content.splitlines()
-                if line.strip().startswith('tg://proxy?') or line.strip().startswith('https://t.me/proxy?')
-            ]
-            logging.info(f"Fetched {len(proxy_links_from_link)} Telegram proxy links from {link}")
-            raw_proxies.extend(proxy_links_from_link)
-
+            if time.monotonic() >= deadline:
+                logging.warning(f"Fetch deadline reached before {link} could be fetched. Skipping.")
+                outcome = 'skipped'
+                return None
+            result = fetch_subscription(session, link, fetch_cache, deadline)
+            outcome = 'fetched' if result else 'unchanged'
+            if result:
+                logging.info(f"Fetched {result[1]} Telegram proxy links from {link}")
+            if scheduler:
+                scheduler.record_fetch(link, time.perf_counter() - start, FETCH_OK if result else FETCH_NOT_MODIFIED,
+                                       result[1] if result else 0)
+            return result
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching proxies from {link}: {e}")
+            if scheduler:
+                # An HTTP error other than 5xx is specific to this link; anything else counts against its host
+                status = e.response.status_code if e.response is not None else None
+                scheduler.record_fetch(link, time.perf_counter() - start,
+                                       FETCH_SOURCE_ERROR if status and status < 500 else FETCH_HOST_ERROR)
         except Exception as e:
             logging.error(f"An unexpected error occurred while processing {link}: {e}")
+            if fetch_cache:
+                fetch_cache.forget(link)
+        finally:
+            semaphore.release()
+            run_metrics.increment('fetch_results', labels={'result': outcome})
+            if outcome != 'skipped':
+                run_metrics.observe('fetch_duration_seconds', time.perf_counter() - start, {'url': link})
+        return None
 
-    # Filter out empty strings and potential headers/comments
-    raw_proxies = [p.strip() for p in raw_proxies if p.strip() and not p.strip().startswith('#')]
-    logging.info(f"Total raw Telegram proxy links fetched: {len(raw_proxies)}")
-    return raw_proxies
-
-
-def parse_telegram_proxy_link(proxy_link):
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    futures = []
+    consumed = set() # Positions of subscriptions whose lines were all yielded
+    total_yielded = 0
+    try:
+        futures = [executor.submit(fetch_with_limits, link) for link in links]
+        # Consume in subscription file order so the output does not depend on completion order
+        for position, future in enumerate(futures):
+            try:
+                # Time spent waiting for downloads is the fetch stage's share of the run
+                with run_metrics.timed('fetch'):
+                    result = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FuturesTimeoutError:
+                not_fetched = sum(1 for f in futures[position:] if not f.done())
+                logging.warning(f"Fetch deadline of {deadline_seconds}s reached. {not_fetched} subscription links were not fetched in time.")
+                break
+            if result is None:
+                continue
+            with result[0] as spool:
+                for line in spool:
+                    total_yielded += 1
+                    yield (links[position], line.rstrip('\n')) if with_source else line.rstrip('\n')
+            consumed.add(position)
+            if scheduler:
+                scheduler.mark_consumed(links[position])
+    finally:
+        # Don't wait for fetches still running past the deadline; they are bounded by the request timeout.
+        # Fetches not started yet are cancelled first, so no new request can use the session below.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        def release(position, future):
+            # Releases the spool of a subscription that was fetched but not consumed (including one
+            # that finishes after the deadline), and the session once the last fetch is done
+            if position not in consumed and not future.cancelled() and future.exception() is None and future.result():
+                future.result()[0].close()
+                if fetch_cache:
+                    fetch_cache.forget(links[position]) # Its validators were recorded, but its lines were not all read
+            if own_session and all(f.done() for f in futures):
+                session.close()
+
+        for position, future in enumerate(futures):
+            future.add_done_callback(lambda future, position=position: release(position, future)) # Runs right away if done
+        if own_session and not futures:
+            session.close()
+        logging.info(f"Total raw Telegram proxy links fetched: {total_yielded}")
+        if fetch_cache:
+            logging.info(fetch_cache.stats_line())
+
+
+def get_proxies_from_links(file_path, **kwargs):
+    """Reads subscription links from a file and fetches raw proxy strings into a list."""
+    return list(iter_proxies_from_links(file_path, **kwargs))
+
+
+TG_PROXY_PREFIX = 'tg://proxy?'
+TME_PROXY_PREFIX = 'https://t.me/proxy?'
+
+
+def parse_proxy_query(query):
     """
-    Parses a Telegram proxy link (tg://proxy? or https://t.me/proxy?).
-    Extracts server, port, and secret. Processes secret using heuristic.
-    Returns a dictionary with parsed details, including 'raw' with the processed secret,
-    or None if parsing/processing fails or heuristic skips the proxy.
+    Splits a proxy link query string into a {name: first_value} dict.
+    Matches parse_qs(query) (taking the first value of each name): blank values are dropped,
+    '+' and %-escapes are decoded, and anything after '#' (the URL fragment) is ignored.
     """
-    parsed = {'original_raw': proxy_link, 'type': 'Telegram'} # Store original raw link
-
-    try:
-        # Convert https://t.me/proxy? to tg://proxy? for consistent parsing
-        if proxy_link.startswith('https://t.me/proxy?'):
-            link_to_parse = 'tg://proxy?' + proxy_link.split('?', 1)[1]
-        elif proxy_link.startswith('tg://proxy?'):
-            link_to_parse = proxy_link
-        else:
-            logging.warning(f"Unsupported link format for parsing: {proxy_link}")
-            return None
+    if '\t' in query or '\r' in query or '\n' in query:
+        # urlparse removes these characters anywhere in the URL
+        query = query.replace('\t', '').replace('\r', '').replace('\n', '')
+    query = query.split('#', 1)[0]
+
+    params = {}
+    for pair in query.split('&'):
+        name, separator, value = pair.partition('=')
+        if not separator or not value:
+            continue # parse_qs skips pairs without '=' and pairs with blank values
+        if '%' in name or '+' in name:
+            name = unquote(name.replace('+', ' '))
+        if name in params:
+            continue # Only the first value of each parameter is used
+        if '%' in value or '+' in value:
+            value = unquote(value.replace('+', ' '))
+        params[name] = value
+    return params
+
+
+@lru_cache(maxsize=PARSE_CACHE_MAX_ENTRIES)
+def _parse_telegram_proxy_link_cached(proxy_link):
+    """
+    Parses a proxy link into a compact tuple (ip, port, secret, raw, archive_key).
+    Memoized on the raw line, so duplicate lines are parsed and hashed only once.
+    """
+    # Convert https://t.me/proxy? to tg://proxy? for consistent parsing
+    if proxy_link.startswith(TME_PROXY_PREFIX):
+        query = proxy_link[len(TME_PROXY_PREFIX):]
+    elif proxy_link.startswith(TG_PROXY_PREFIX):
+        query = proxy_link[len(TG_PROXY_PREFIX):]
+    else:
+        logging.warning(f"Unsupported link format for parsing: {proxy_link}")
+        return None
 
-        parsed_url = urlparse(link_to_parse)
-        query_params = parse_qs(parsed_url.query)
+    query_params = parse_proxy_query(query)
+    server = query_params.get('server')
+    port = query_params.get('port')
+    secret = query_params.get('secret')
 
-        server = query_params.get('server', [None])[0]
-        port = query_params.get('port', [None])[0]
-        secret = query_params.get('secret', [None])[0]
+    # --- Basic Parameter Check ---
+    # Check if server or port parameter is missing (None)
+    if server is None or port is None:
+        logging.warning(f"Missing server or port parameter in link: {proxy_link}")
+        return None
 
-        # --- Basic Parameter Check ---
-        # Check if server or port parameter is missing (None)
-        if server is None or port is None:
-            logging.warning(f"Missing server or port parameter in link: {proxy_link}")
-            return None
+    # --- Process Secret using Heuristic ---
+    # If secret parameter is missing (None), process_secret_with_heuristic handles it.
+    processed_secret = process_secret_with_heuristic(secret)
 
-        # --- Process Secret using Heuristic ---
-        # If secret parameter is missing (None), process_secret_with_heuristic handles it.
-        processed_secret = process_secret_with_heuristic(secret)
+    # If process_secret_with_heuristic returned None, skip this proxy
+    if processed_secret is None:
+        logging.warning(f"Secret processing heuristic resulted in skipping link: {proxy_link}")
+        return None
 
-        # If process_secret_with_heuristic returned None, skip this proxy
-        if processed_secret is None:
-             logging.warning(f"Secret processing heuristic resulted in skipping link: {proxy_link}")
-             return None
+    # --- Rebuild raw link with processed secret ---
+    # This is crucial so the raw link used for the hyperlink and button
+    # contains the potentially trimmed secret.
+    raw = f"tg://proxy?server={server}&port={port}&secret={processed_secret}"
+    # If there's a tag, include it in the rebuilt link
+    if 'tag' in query_params:
+        raw += f"&tag={query_params['tag']}"
 
-        parsed['ip'] = server
-        parsed['port'] = port
-        parsed['secret'] = processed_secret # Use the processed secret
+    result = (server, port, processed_secret, raw, archive_key(server, port, processed_secret))
+    logging.debug("Parsed Telegram proxy link %s: %s", proxy_link, result)
+    return result
 
-        # Get Geolocation (Country name, emoji, and code)
-        country_name, country_emoji, country_code = get_geolocation(parsed['ip'])
-        parsed['country'] = country_name
-        parsed['country_emoji'] = country_emoji
-        parsed['country_code'] = country_code # Store the country code
 
-        # --- Rebuild raw link with processed secret ---
-        # This is crucial so the raw link used for the hyperlink and button
-        # contains the potentially trimmed secret.
-        if processed_secret is not None: # Should not be None if we reached here, but good practice
-             parsed['raw'] = f"tg://proxy?server={parsed['ip']}&port={parsed['port']}&secret={processed_secret}"
-             # If there's a tag, include it in the rebuilt link
-             if 'tag' in query_params and query_params['tag'][0] is not None:
-                  parsed['raw'] += f"&tag={query_params['tag'][0]}"
+def parse_telegram_proxy_link(proxy_link):
+    """
+    Parses a Telegram proxy link (tg://proxy? or https://t.me/proxy?).
+    Extracts server, port, and secret. Processes secret using heuristic.
+    Returns a dictionary with parsed details, including 'raw' with the processed secret,
+    or None if parsing/processing fails or heuristic skips the proxy.
+    Each call returns a new dictionary, so callers may modify it freely.
+    Country details are placeholders until the proxy is geolocated (see geolocate_proxies),
+    which happens after deduplication so discarded duplicates are never looked up.
+    """
+    result = parse_telegram_proxy_tuple(proxy_link)
+    if result is None:
+        return None
 
+    return build_proxy_details(proxy_link, result)
 
-        logging.debug(f"Parsed Telegram proxy link: {parsed}")
-        return parsed
 
+def parse_telegram_proxy_tuple(proxy_link):
+    """The memoized compact parse result of a link (see _parse_telegram_proxy_link_cached), or None."""
+    try:
+        return _parse_telegram_proxy_link_cached(proxy_link)
     except Exception as e:
         logging.error(f"Error parsing Telegram proxy link {proxy_link}: {e}")
         return None
 
+
+def build_proxy_details(proxy_link, parsed_tuple):
+    """Builds the proxy dictionary from a compact parse result (see _parse_telegram_proxy_link_cached)."""
+    server, port, secret, raw, key = parsed_tuple
+    parsed = {
+        'original_raw': proxy_link, # Store original raw link
+        'type': 'Telegram',
+        'ip': server,
+        'port': port,
+        'secret': secret, # Use the processed secret
+        'country': 'Unknown',
+        'country_emoji': '',
+        'country_code': '', # Store the country code
+        'raw': raw,
+        'archive_key': key, # Hash of the normalized (server, port, secret), used for deduplication
+    }
+    return parsed
+
+
+def parse_cache_stats_line():
+    """Summarizes the parse memo cache for the run log."""
+    info = _parse_telegram_proxy_link_cached.cache_info()
+    total = info.hits + info.misses
+    hit_rate = (info.hits / total * 100) if total else 0.0
+    return f"Parse cache: {info.hits} hits, {info.misses} misses, hit rate {hit_rate:.1f}%"
+
 def check_proxy(proxy_details):
     """
-    For Telegram proxies, we cannot perform a standard connectivity check
-    with requests. This function primarily confirms parsing was successful.
+    Confirms parsing was successful and marks the proxy as not yet checked.
+    The actual reachability check runs in batches (see iter_checked_proxies).
     """
     if proxy_details and proxy_details.get('type') == 'Telegram':
         # Mark as successfully parsed, but not connectivity checked
         proxy_details['status'] = 'parsed'
-        proxy_details['latency'] = -1 # Not applicable
+        proxy_details['latency'] = -1 # Filled in by the health checker
         return proxy_details
     else:
         # Should not happen if get_proxies_from_links and parse_telegram_proxy_link work correctly
         return None
 
+def iter_checked_proxies(proxies, checker, batch_size=HEALTH_CHECK_BATCH_SIZE, source_stats=None):
+    """
+    Checks a stream of proxies concurrently in batches, filling in 'status' and 'latency',
+    and yields the reachable ones in order. Unreachable proxies are dropped (and not archived,
+    so they are checked again when they show up in a later run).
+    If source_stats (a dict) is given, it counts [checked, reachable] proxies per source.
+    """
+    def check_batch(batch):
+        checker.check_many(batch)
+        for proxy in batch:
+            healthy = proxy['status'] in HEALTHY_STATUSES
+            if source_stats is not None:
+                counts = source_stats.setdefault(proxy.get('source'), [0, 0])
+                counts[0] += 1
+                counts[1] += healthy
+            if healthy:
+                yield proxy
+            else:
+                logging.debug("Dropping unreachable proxy (%s): %s", proxy['status'], proxy['raw'])
+
+    batch = []
+    for proxy in proxies:
+        batch.append(proxy)
+        if len(batch) >= batch_size:
+            yield from check_batch(batch)
+            batch = []
+    if batch:
+        yield from check_batch(batch)
+
+
+def get_proxy_archive_key(proxy_details):
+    """Returns the archive key of a parsed proxy (hash of its normalized server, port and secret)."""
+    return archive_key(proxy_details.get('ip'), proxy_details.get('port'), proxy_details.get('secret'))
+
+
+def load_archive(db_path, legacy_text_path=None):
+    """
+    Opens the archive of previously posted *processed* proxies.
+    If the old line-per-proxy text archive still exists, it is migrated into the database first.
+    """
+    try:
+        with run_metrics.timed('archive_load'):
+            archive = ArchiveStore(db_path, legacy_text_path, ARCHIVE_TTL_SECONDS, ARCHIVE_MAX_ENTRIES)
+        logging.info(f"Opened archive {db_path} with {len(archive)} processed proxies.")
+        return archive
+    except Exception as e:
+        logging.error(f"Error loading archive database {db_path}: {e}")
+        logging.warning("Starting with an empty in-memory archive for this run.")
+        return ArchiveStore(':memory:', ttl_seconds=ARCHIVE_TTL_SECONDS, max_entries=ARCHIVE_MAX_ENTRIES)
 
-def load_archive(file_path):
-    """Loads previously posted *processed* proxies from the archive file."""
-    archived_proxies = set()
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, 'r') as f:
-                # Load the processed raw links that were previously saved
-                archived_proxies = {line.strip() for line in f if line.strip()}
-            logging.info(f"Loaded {len(archived_proxies)} processed proxies from archive.")
-        except Exception as e:
-            logging.error(f"Error loading archive file {file_path}: {e}")
-    else:
-        logging.info("Archive file not found. Starting with an empty archive.")
-    return archived_proxies
-
-def save_archive(file_path, new_processed_proxies):
-    """Appends newly posted *processed* proxies to the archive file."""
+def get_archive_entries(proxies):
+    """
+    Returns the (archive key, processed raw link, country code) triples to archive for posted proxies.
+    The key of the resolved endpoint is saved too, so other hostnames for it are recognized later.
+    """
+    entries = []
+    for proxy in proxies:
+        key = proxy.get('archive_key', get_proxy_archive_key(proxy))
+        entries.append((key, proxy['raw'], proxy.get('country_code', '')))
+        if proxy.get('endpoint_key', key) != key:
+            entries.append((proxy['endpoint_key'], proxy['raw'], proxy.get('country_code', '')))
+    return entries
+
+def save_archive(archive, new_processed_proxies, channel=DEFAULT_CHANNEL):
+    """Adds *processed* proxies newly posted to a channel to the archive. Returns False if they could not be saved."""
     if not new_processed_proxies:
-        return
+        return True
 
     try:
-        with open(file_path, 'a') as f:
-            # Save the processed raw links
-            for proxy_string in new_processed_proxies:
-                f.write(proxy_string + '\n')
-        logging.info(f"Saved {len(new_processed_proxies)} new processed proxies to archive.")
+        with run_metrics.timed('archive_save'):
+            added = archive.add_many(get_archive_entries(new_processed_proxies), channel)
+        logging.info(f"Saved {added} processed proxies posted to channel '{channel}' to archive.")
+        return True
     except Exception as e:
-        logging.error(f"Error saving to archive file {file_path}: {e}")
-
-def escape_markdown_v2(text):
-    """Escapes MarkdownV2 special characters."""
-    # See https://core.telegram.org/bots/api#markdownv2-style
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(r'([%s])' % re.escape(escape_chars), r'\\\1', str(text))
-
-
-def post_proxies_chunk_to_telegram(chat_id, proxies_chunk):
-    """Formats and posts a chunk of Telegram proxies to the Telegram channel."""
-    if not proxies_chunk:
+        logging.error(f"Error saving to archive {archive.db_path}: {e}")
         return False
 
-    message_lines = []
-    inline_buttons = []
+def replay_posting_journal(archive):
+    """
+    Opens the posting journal and adds the chunks it holds to the archive. They were posted by a
+    run that stopped before saving them to the archive, and must not be posted again.
+    """
+    journal = PostingJournal(POSTING_JOURNAL_FILE)
+    try:
+        journal.replay(archive)
+    except Exception as e:
+        logging.error(f"Error replaying posting journal {POSTING_JOURNAL_FILE}: {e}")
+    return journal
 
-    # Build the message text and collect button data for each proxy in the chunk
-    for i, proxy_details in enumerate(proxies_chunk):
-        # --- Message Text Format ---
-        # 🔒 Address & Port: [IP]:[Port] (proxy Link)
-        ip_port_text = f"{proxy_details.get('ip', 'N/A')}:{proxy_details.get('port', 'N/A')}"
-        # Use the potentially modified raw link for the hyperlink
-        raw_link = proxy_details.get('raw', '')
+def load_pending_proxies(archive, min_proxies=0):
+    """
+    Returns (fetched_at, proxies) of the queue saved by the previous run, without the proxies
+    archived since (archive is the channels' ArchiveRoutingView), or None if it is missing, older
+    than PENDING_QUEUE_MAX_AGE_SECONDS or holds fewer than min_proxies proxies.
+    """
+    pending = load_pending_queue(PENDING_QUEUE_FILE, PENDING_QUEUE_MAX_AGE_SECONDS)
+    if not pending:
+        return None
+    fetched_at, proxies = pending
+    proxies = [proxy for proxy in proxies if not any(key in archive for key, *_ in get_archive_entries([proxy]))]
+    if len(proxies) < max(min_proxies, 1):
+        logging.info(f"Pending queue holds only {len(proxies)} unposted proxies. Fetching subscriptions again.")
+        return None
+    return fetched_at, proxies
 
-        # Escape MarkdownV2 characters in the IP:Port text and the URL itself
-        ip_port_text_escaped = escape_markdown_v2(ip_port_text)
-        raw_link_escaped = escape_markdown_v2(raw_link) # Escape URL for MarkdownV2 link
 
-        address_line = f"🔒 Address & Port: [{ip_port_text_escaped}]({raw_link_escaped})" if raw_link else f"🔒 Address & Port: {ip_port_text_escaped}"
-        message_lines.append(address_line)
+def compact_archive(archive):
+    """Drops expired archive entries and enforces the archive size cap."""
+    try:
+        with run_metrics.timed('archive_compact'):
+            removed = archive.compact()
+        logging.info(f"Compacted archive: removed {removed} expired or evicted entries, {len(archive)} remain.")
+    except Exception as e:
+        logging.error(f"Error compacting archive {archive.db_path}: {e}")
 
-        # 🌎 Country: 🇩🇪 Germany
-        country_name = proxy_details.get('country', 'Unknown')
-        country_emoji = proxy_details.get('country_emoji', '')
-        country_line = f"🌎 Country: {country_emoji} {escape_markdown_v2(country_name)}" if country_name != 'Unknown' else f"🌎 Country: {escape_markdown_v2(country_name)}"
-        message_lines.append(country_line)
+def source_reliability(source_stats, prior_checks=5):
+    """
+    Returns a function rating a source 0..1 by the share of its proxies that were reachable in
+    this run. Sources with few checks are pulled towards 0.5 (as if prior_checks were split evenly).
+    """
+    def reliability(source):
+        checked, reachable = source_stats.get(source, (0, 0))
+        return (reachable + prior_checks / 2) / (checked + prior_checks)
+    return reliability
 
-        # Add a blank line between proxies if not the last one
-        if i < len(proxies_chunk) - 1:
-            message_lines.append("")
+def create_posting_queue(archive, source_stats=None):
+    """Creates the posting queue, with first sightings recorded in the archive."""
+    return PostingQueue(
+        POSTING_QUEUE_MAX_PER_COUNTRY, POSTING_QUEUE_LATENCY_WEIGHT, POSTING_QUEUE_FRESHNESS_WEIGHT,
+        POSTING_QUEUE_RELIABILITY_WEIGHT, POSTING_QUEUE_LATENCY_CAP_MS, POSTING_QUEUE_AGE_CAP_SECONDS,
+        source_reliability=source_reliability(source_stats) if source_stats is not None else None,
+        first_seen_lookup=lambda proxies: archive.record_sightings(proxy['archive_key'] for proxy in proxies),
+    )
 
-        # --- Prepare data for simple "Connect" inline button ---
-        button_text = "Connect"
-        # Use the potentially modified raw link for the button URL
-        button_url = proxy_details.get('raw', '')
 
-        if button_url:
-             inline_buttons.append({'text': button_text, 'url': button_url})
+def create_telegram_sender():
+    """Creates the rate-limited Telegram sender; posts to a chat are at least POST_DELAY_SECONDS apart."""
+    chat_interval = max(POST_DELAY_SECONDS, 60 / TELEGRAM_CHAT_MESSAGES_PER_MINUTE)
+    return TelegramSender(telegram_api_url(), chat_interval, TELEGRAM_GLOBAL_MESSAGES_PER_SECOND, TELEGRAM_SEND_MAX_ATTEMPTS,
+                          backoff_seconds=TELEGRAM_SEND_BACKOFF_SECONDS)
 
 
-    # Add the channel handle at the end of the message text
-    message_lines.append("\n@NexuProxy")
+def pop_postable_chunk(posting_queue):
+    """
+    Takes the next chunk of up to PROXIES_PER_POST proxies from the posting queue, trimmed to what
+    fits in one Telegram message. Proxies that do not fit go back into the queue.
+    """
+    with run_metrics.timed('posting_queue'):
+        return _pop_postable_chunk(posting_queue)
+
+def fill_posting_queue(router, proxies, target_size):
+    """ChannelRouter.fill, timed (the candidate pipeline it pulls from is timed per stage)."""
+    with run_metrics.timed('posting_queue'):
+        return router.fill(proxies, target_size)
+
+def _pop_postable_chunk(posting_queue):
+    while len(posting_queue):
+        chunk = posting_queue.pop_chunk(PROXIES_PER_POST)
+        fitting, rest = fit_to_message(chunk)
+        if len(fitting) + len(rest) < len(chunk):
+            logging.warning(f"Skipping {len(chunk) - len(fitting) - len(rest)} proxies too long to fit in a Telegram message.")
+        if rest:
+            posting_queue.push_many(rest)
+        if fitting:
+            return fitting
+    return []
+
+def create_channel_router(channels, archive, source_stats=None):
+    """Creates the router that fans candidates out to a posting queue per channel."""
+    for channel in channels:
+        logging.info(channel.describe())
+        if not HEALTH_CHECK_ENABLED and (channel.min_latency_ms is not None or channel.max_latency_ms is not None):
+            logging.warning(f"Channel '{channel.name}' routes by latency, but health checks are off. It will get no proxies.")
+    return ChannelRouter(channels, archive, lambda: create_posting_queue(archive, source_stats))
+
+def next_channel_chunk(channel):
+    """Returns (chunk, attempts) of a channel's next post: a chunk due for retry, else a new one from its queue."""
+    if channel.retry_chunks:
+        return channel.retry_chunks.popleft()
+    return pop_postable_chunk(channel.queue), 1
+
+def post_channel_chunks(sender, executor, posts, deadline=None):
+    """
+    Posts (channel, chunk, attempts) chunks to their channels concurrently, one thread per chat; the
+    sender still spaces posts to each chat and keeps the global rate limit.
+    Returns (channel, chunk, attempts, result) for each, with result as in post_proxies_chunk_to_telegram.
+    """
+    futures = [(channel, chunk, attempts, executor.submit(post_proxies_chunk_to_telegram, sender, channel.chat_id, chunk, deadline))
+               for channel, chunk, attempts in posts]
+    return [(channel, chunk, attempts, future.result()) for channel, chunk, attempts, future in futures]
 
+def record_post_result(channel, chunk, attempts, success, journal):
+    """
+    Handles the result of posting a chunk to a channel. Posted chunks are journaled right away in
+    case the run is killed before the archive is saved; chunks that could not be sent for now go
+    to the channel's retry queue. Returns False if the chunk was given up.
+    """
+    if success:
+        channel.posted.extend(chunk)
+        channel.posted_count += len(chunk)
+        journal.record(channel.name, get_archive_entries(chunk))
+    elif success is None and attempts < POST_CHUNK_MAX_ATTEMPTS:
+        logging.warning(f"Could not post chunk of {len(chunk)} proxies to channel '{channel.name}'. Queued for retry.")
+        channel.retry_chunks.append((chunk, attempts + 1))
+    else:
+        logging.warning(f"Failed to post chunk of {len(chunk)} proxies to channel '{channel.name}'. Giving up on it.")
+        return False
+    return True
 
-    message_text = "\n".join(message_lines)
+def save_channel_archives(archive, channels, journal):
+    """
+    Saves the proxies each channel posted since the last save to the archive. The journal is
+    cleared once all are saved. Returns False if some could not be saved.
+    """
+    saved = True
+    for channel in channels:
+        if save_archive(archive, channel.posted, channel.name):
+            channel.posted = []
+        else:
+            saved = False
+    if saved:
+        journal.clear()
+    return saved
 
-    # Create the inline keyboard markup
-    reply_markup = None
-    if inline_buttons:
-        # --- Button Layout: 3x3 Grid ---
-        inline_keyboard = []
-        row = []
-        for i, button in enumerate(inline_buttons):
-            row.append(button)
-            # Start a new row after every 3 buttons, or if it's the last button
-            if (i + 1) % 3 == 0 or (i + 1) == len(inline_buttons):
-                inline_keyboard.append(row)
-                row = [] # Start a new row list
+def checkpoint_pending_queue(router, fetched_at):
+    """
+    Saves what is queued now as the pending queue, so a run killed before it finishes (e.g. by the
+    workflow timeout) leaves its filtered candidates to the next run. Chunks already posted are in
+    the journal and are filtered out again when the queue is loaded.
+    """
+    save_pending_queue(PENDING_QUEUE_FILE, fetched_at, router.snapshot())
 
-        reply_markup = json.dumps({'inline_keyboard': inline_keyboard})
+def post_proxies_chunk_to_telegram(sender, chat_id, proxies_chunk, deadline=None):
+    """
+    Formats and posts a chunk of Telegram proxies to the Telegram channel.
+    Returns True if posted, False if Telegram rejected the message, or None if it could not be
+    sent for now (see TelegramSender.send_message) and the chunk should be retried later.
+    """
+    if not proxies_chunk:
+        return False
 
+    # Each proxy's lines and "Connect" button are rendered once and cached on the record;
+    # buttons are laid out in a 3x3 grid
+    message_text, reply_markup = render_message(proxies_chunk)
 
-    # --- Send message using requests ---
-    send_message_url = f'{TELEGRAM_API_URL}/sendMessage'
+    # --- Send message through the rate-limited sender ---
     payload = {
-        'chat_id': chat_id,
         'text': message_text,
         'parse_mode': 'MarkdownV2',
         'reply_markup': reply_markup # Add the inline keyboard
@@ -364,157 +937,649 @@ def post_proxies_chunk_to_telegram(chat_id, proxies_chunk):
 
     logging.info(f"Attempting to post a chunk of {len(proxies_chunk)} proxies to chat ID {chat_id}...")
     try:
-        response = requests.post(send_message_url, json=payload)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        logging.info(f"Successfully posted a chunk of {len(proxies_chunk)} proxies to Telegram. Status Code: {response.status_code}")
-        logging.debug(f"Telegram API response: {response.text}") # Log full response for debugging
-        return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error posting chunk of proxies to Telegram: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-             logging.error(f"Telegram API error response status code: {e.response.status_code}")
-             logging.error(f"Telegram API error response body: {e.response.text}")
-             try:
-                 error_response = e.response.json()
-                 if 'error_code' in error_response and error_response['error_code'] == 429: # Too Many Requests (Flood)
-                      logging.warning("Flood control exceeded. Waiting longer before next post.")
-                      time.sleep(60) # Wait an extra minute on flood error
-             except:
-                 pass # Ignore JSON parsing errors if response is not JSON
-
-        return False
+        # Includes waiting for a send slot, so rate limiting shows up in this stage's time
+        with run_metrics.timed('telegram_post'):
+            result = sender.send_message(chat_id, payload, deadline)
     except Exception as e:
         logging.error(f"An unexpected error occurred during Telegram post: {e}")
-        return False
+        result = None
+    run_metrics.increment('telegram_posts', labels={'result': 'posted' if result else 'rejected' if result is False else 'deferred'})
+    if result:
+        logging.info(f"Successfully posted a chunk of {len(proxies_chunk)} proxies to Telegram.")
+    return result
 
 
-# --- Main Execution ---
+def iter_unique_proxies(raw_proxy_links, start_time=None, stats=None):
+    """
+    Parses raw Telegram proxy links one at a time as they arrive and yields each proxy the first
+    time its archive key (server, port, secret) is seen in this run.
+    Items may also be (subscription link, raw link) pairs; the proxy's 'source' is then the
+    subscription it was first seen in.
+    Only the set of keys seen in this run is kept in memory, not the raw input.
+    """
+    stats = stats if stats is not None else {}
+    keys_encountered = set() # Use a set to track archive keys encountered in this run
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG) # Checked once; this loop runs per raw line
 
-def main():
-    # Record the start time of execution
-    start_time = time.time()
+    for item in raw_proxy_links:
+        source, original_raw_link = item if isinstance(item, tuple) else (None, item)
+        stats['raw'] += 1
+        # Check if parsing this link would exceed the time limit
+        if start_time is not None:
+            elapsed_time = time.time() - start_time
+            if elapsed_time + 5 > MAX_EXECUTION_TIME_SECONDS: # Add a buffer (e.g., 5 seconds)
+                logging.warning(f"Execution time approaching limit ({MAX_EXECUTION_TIME_SECONDS}s) during parsing. Skipping remaining links.")
+                stats['stopped_early'] = True
+                return # Stop parsing if time is running out
 
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID:
-        logging.error("TELEGRAM_BOT_TOKEN or TELEGRAM_CHANNEL_ID environment variables not set.")
-        logging.error("Please set these as GitHub Secrets.")
-        return
+        # Parse and process the link (secret heuristic applied, raw link rebuilt) into the memoized
+        # compact tuple; the proxy dictionary is only built for the first occurrence of a key
+        result = parse_telegram_proxy_tuple(original_raw_link)
 
-    # 1. Get raw Telegram proxy links from subscription links
-    raw_telegram_proxy_links = get_proxies_from_links(SUBSCRIPTION_FILE)
+        # If parsing and processing was successful
+        if not result:
+            continue
+        stats['parsed'] += 1
+        key = result[4]
 
-    if not raw_telegram_proxy_links:
-        logging.info("No raw Telegram proxy links fetched. Exiting.")
-        return
+        # Check if this proxy has already been encountered in this run (deduplication within current fetch)
+        if key in keys_encountered:
+            if debug_enabled:
+                logging.debug("Skipping duplicate processed link encountered in this run: %s", result[3])
+            stats['duplicates'] += 1
+            continue # Skip to the next link
 
-    # 2. Load archive of previously posted *processed* proxies
-    archived_processed_proxies = load_archive(ARCHIVE_FILE)
-    logging.info(f"Loaded {len(archived_processed_proxies)} processed proxies from archive.")
+        # Add the key to the set encountered in this run, even if archived,
+        # to handle cases where the same proxy appears multiple times in the source.
+        keys_encountered.add(key)
+        proxy_details = build_proxy_details(original_raw_link, result)
+        proxy_details['source'] = source
+        yield proxy_details
 
 
-    # 3. Parse and process all fetched links, and filter against the archive (based on processed link)
-    logging.info("Parsing and processing fetched Telegram proxy links...")
-    proxies_to_post = []
-    processed_links_encountered = set() # Use a set to track processed links encountered in this run
+_shard_keys_seen = set() # In a parse worker process: archive keys this shard has already returned
 
-    for original_raw_link in raw_telegram_proxy_links:
-        # Check if parsing this link would exceed the time limit
-        elapsed_time = time.time() - start_time
-        if elapsed_time + 5 > MAX_EXECUTION_TIME_SECONDS: # Add a buffer (e.g., 5 seconds)
-             logging.warning(f"Execution time approaching limit ({MAX_EXECUTION_TIME_SECONDS}s) during parsing. Skipping remaining links.")
-             break # Stop parsing if time is running out
+def _init_parse_worker():
+    _shard_keys_seen.clear()
 
-        # Parse and process the link (secret heuristic applied, parsed['raw'] updated)
-        proxy_details = parse_telegram_proxy_link(original_raw_link)
+def _parse_shard(lines):
+    """
+    Parse worker: parses (index, raw link) pairs of one shard. Returns the number of lines that
+    parsed and [(index, compact parse tuple)] for keys this shard has not returned before.
+    """
+    parsed_count = 0
+    first_seen = []
+    for index, line in lines:
+        result = parse_telegram_proxy_tuple(line)
+        if result is None:
+            continue
+        parsed_count += 1
+        if result[4] not in _shard_keys_seen:
+            _shard_keys_seen.add(result[4])
+            first_seen.append((index, result))
+    return parsed_count, first_seen
+
+
+def iter_unique_proxies_parallel(raw_proxy_links, workers, start_time=None, stats=None, block_lines=PARSE_BLOCK_LINES):
+    """
+    Same output (and stats) as iter_unique_proxies, with parsing spread over worker processes.
+    Raw lines are read in blocks and sharded by a hash of the line, so repeats of a line always
+    reach the same worker, which parses it once and deduplicates it locally across blocks.
+    Each shard runs in its own process, keeping that state between blocks. Workers return
+    compact tuples. The merge walks each block's results in line order and drops keys already
+    seen in another shard (the same endpoint written differently), which reproduces the serial
+    first-occurrence order exactly. One block is parsed while the previous one is merged.
+    """
+    stats = stats if stats is not None else {}
+    keys_encountered = set()
+    executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_parse_worker) for _ in range(workers)]
+    raw_proxy_links = iter(raw_proxy_links)
+
+    def submit_block():
+        if start_time is not None and time.time() - start_time + 5 > MAX_EXECUTION_TIME_SECONDS:
+            logging.warning(f"Execution time approaching limit ({MAX_EXECUTION_TIME_SECONDS}s) during parsing. Skipping remaining links.")
+            stats['stopped_early'] = True
+            return None
+        block = [item if isinstance(item, tuple) else (None, item) for item in islice(raw_proxy_links, block_lines)]
+        if not block:
+            return None
+        shards = [[] for _ in range(workers)]
+        for index, (_, line) in enumerate(block):
+            shards[hash(line) % workers].append((index, line))
+        return block, [executor.submit(_parse_shard, shard) for executor, shard in zip(executors, shards)]
 
-        # If parsing and processing was successful
-        if proxy_details:
-            processed_raw_link = proxy_details['raw']
-
-            # Check if this processed link has already been encountered in this run (deduplication within current fetch)
-            if processed_raw_link in processed_links_encountered:
-                 logging.debug(f"Skipping duplicate processed link encountered in this run: {processed_raw_link}")
-                 continue # Skip to the next link
-
-            # Check if this processed link is already in the archive (deduplication against history)
-            if processed_raw_link in archived_processed_proxies:
-                logging.debug(f"Skipping processed link already found in archive: {processed_raw_link}")
-                # Add the processed link to the set encountered in this run, even if archived,
-                # to handle cases where the same processed link appears multiple times in the source.
-                processed_links_encountered.add(processed_raw_link)
-                continue # Skip to the next link
+    try:
+        pending = submit_block()
+        while pending:
+            block, futures = pending
+            pending = submit_block() # Parsed by the workers while this block is merged
+            results = [future.result() for future in futures]
+            stats['raw'] += len(block)
+            block_parsed = sum(parsed_count for parsed_count, _ in results)
+            stats['parsed'] += block_parsed
+            block_unique = 0
+            for index, result in heapq.merge(*(first_seen for _, first_seen in results)):
+                if result[4] in keys_encountered:
+                    continue
+                keys_encountered.add(result[4])
+                block_unique += 1
+                source, line = block[index]
+                proxy_details = build_proxy_details(line, result)
+                proxy_details['source'] = source
+                yield proxy_details
+            stats['duplicates'] += block_parsed - block_unique
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_resolved_proxies(proxies, resolver, batch_size=DNS_BATCH_SIZE):
+    """
+    Resolves the hostnames of a stream of proxies in concurrent batches and yields them in order.
+    Each proxy gets 'resolved_ip' (None if the server is a hostname that did not resolve) and
+    'endpoint_key', the archive key of the resolved address, so the same endpoint reached through
+    different hostnames (or a hostname and its literal IP) deduplicates to one key.
+    """
+    def resolve_batch(batch):
+        hostnames = {proxy['ip'] for proxy in batch if not is_ip_address(proxy['ip'])}
+        with run_metrics.timed('dns'):
+            resolved = resolver.resolve_many(hostnames) if hostnames else {}
+        for proxy in batch:
+            ip = proxy['ip'] if proxy['ip'] not in hostnames else resolved.get(proxy['ip'])
+            proxy['resolved_ip'] = ip
+            proxy['endpoint_key'] = archive_key(ip, proxy['port'], proxy['secret']) if ip else proxy['archive_key']
+        return batch
+
+    batch = []
+    for proxy in proxies:
+        batch.append(proxy)
+        if len(batch) >= batch_size:
+            yield from resolve_batch(batch)
+            batch = []
+    if batch:
+        yield from resolve_batch(batch)
+
+
+def iter_proxies_to_post(raw_proxy_links, archived_processed_proxies, start_time=None, stats=None, resolver=None,
+                         parse_workers=PARSE_WORKERS):
+    """
+    Parses, deduplicates and archive-checks raw Telegram proxy links as they arrive,
+    and yields the new, unique proxies that are ready to post.
+    Deduplication uses the archive key (server, port, secret) both within the run and against the
+    archive. With a DNS resolver, hostnames are resolved in batches and proxies are additionally
+    deduplicated on their resolved endpoint. With parse_workers, parsing runs in that many processes.
+    If stats (a dict) is given, it is filled with counters; stats['stopped_early'] is set to True
+    if the time limit cut the stream short.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({'raw': 0, 'parsed': 0, 'duplicates': 0, 'archived': 0, 'new': 0, 'stopped_early': False})
+    per_source = stats['per_source'] = {} # source -> {'unique': n, 'new': n}, for the source scheduler
+    if parse_workers:
+        unique_proxies = iter_unique_proxies_parallel(raw_proxy_links, parse_workers, start_time, stats)
+    else:
+        unique_proxies = iter_unique_proxies(raw_proxy_links, start_time, stats)
+    proxies = iter_resolved_proxies(unique_proxies, resolver) if resolver else unique_proxies
+    endpoints_encountered = set() # Resolved endpoints seen in this run (only used with a resolver)
 
+    try:
+        for proxy_details in proxies:
+            key = proxy_details['archive_key']
+            endpoint_key = proxy_details.get('endpoint_key', key)
+            if resolver:
+                if endpoint_key in endpoints_encountered:
+                    logging.debug("Skipping proxy whose resolved endpoint was already encountered in this run: %s", proxy_details['raw'])
+                    stats['duplicates'] += 1
+                    continue
+                endpoints_encountered.add(endpoint_key)
+            source_counts = per_source.get(proxy_details.get('source'))
+            if source_counts is None:
+                source_counts = per_source[proxy_details.get('source')] = {'unique': 0, 'new': 0}
+            source_counts['unique'] += 1
+
+            # Check if this proxy is already in the archive (deduplication against history)
+            if key in archived_processed_proxies or (endpoint_key != key and endpoint_key in archived_processed_proxies):
+                logging.debug("Skipping processed link already found in archive: %s", proxy_details['raw'])
+                stats['archived'] += 1
+                continue # Skip to the next link
 
             # If the processed link is new (not encountered in this run or in archive)
-            logging.debug(f"Found new processed link to potentially post: {processed_raw_link}")
-            processed_proxy = check_proxy(proxy_details) # This just sets status to 'parsed'
+            logging.debug("Found new processed link to potentially post: %s", proxy_details['raw'])
+            processed_proxy = check_proxy(proxy_details) # Sets status to 'parsed'; reachability is checked later in batches
             if processed_proxy:
-                 proxies_to_post.append(processed_proxy)
-                 # Add the processed link to the set encountered in this run
-                 processed_links_encountered.add(processed_raw_link)
+                stats['new'] += 1
+                source_counts['new'] += 1
+                yield processed_proxy
+    finally:
+        proxies.close()
+        unique_proxies.close()
+        logging.info(f"Processed {stats['raw']} raw links: {stats['parsed']} parsed, {stats['duplicates']} duplicates, "
+                     f"{stats['archived']} already archived, {stats['new']} new proxies.")
+        logging.info(parse_cache_stats_line())
+
+
+def create_resolver():
+    return AsyncDNSResolver(DNS_CACHE_FILE, DNS_NAMESERVER, DNS_CONCURRENCY, DNS_QUERY_TIMEOUT_SECONDS) if DNS_RESOLUTION_ENABLED else None
+
+def create_health_checker():
+    if not HEALTH_CHECK_ENABLED:
+        return None
+    return ProxyHealthChecker(HEALTH_CHECK_CONCURRENCY, HEALTH_CHECK_PER_HOST_CONCURRENCY,
+                              HEALTH_CHECK_CONNECT_TIMEOUT_SECONDS, HEALTH_CHECK_HANDSHAKE_TIMEOUT_SECONDS,
+                              HEALTH_CHECK_RETRIES, HEALTH_CHECK_RETRY_JITTER_SECONDS, HEALTH_CHECK_FAKE_TLS_HANDSHAKE)
 
+def create_source_scheduler():
+    if not SOURCE_SCHEDULER_ENABLED:
+        return None
+    return SourceScheduler(SOURCE_STATS_FILE, SOURCE_STATS_SMOOTHING, SOURCE_LOW_YIELD_GRACE_FETCHES,
+                           SOURCE_LOW_YIELD_INTERVAL_SECONDS, SOURCE_LOW_YIELD_MAX_INTERVAL_SECONDS,
+                           SOURCE_BREAKER_FAILURE_THRESHOLD, SOURCE_BREAKER_BASE_SECONDS, SOURCE_BREAKER_MAX_SECONDS)
+
+def finish_source_cycle(scheduler, parse_stats):
+    """Hands the fetch cycle's per-source yields to the source scheduler and saves its statistics."""
+    if not scheduler:
+        return
+    scheduler.finish_cycle(parse_stats.get('per_source', {}))
+    run_metrics.set_gauge('sources_skipped', scheduler.skipped_low_yield, {'reason': 'low_yield'})
+    run_metrics.set_gauge('sources_skipped', scheduler.skipped_breaker, {'reason': 'circuit_breaker'})
+    logging.info(scheduler.stats_line())
+    scheduler.save()
+
+def iter_candidate_proxies(archive, fetch_cache, resolver, checker, geoip_cache, start_time=None, parse_stats=None,
+                           source_stats=None, session=None, scheduler=None):
+    """
+    The ingest pipeline: streams raw Telegram proxy links from the subscription links, then parses,
+    deduplicates and filters them against the archive as they arrive, checks the new ones for
+    reachability and geolocates them. Yields proxies ready to be queued for posting.
+    Closing this generator stops every stage (including fetches still running). Proxies still held
+    in a batching stage are dropped then, so their subscriptions are forgotten by the fetch cache.
+    """
+    # Subscriptions whose content did not change since the last fetch are skipped via the fetch cache
+    # The source scheduler picks which subscriptions are due and fetches the most productive ones first
+    raw_telegram_proxy_links = iter_proxies_from_links(SUBSCRIPTION_FILE, fetch_cache=fetch_cache, with_source=True, session=session,
+                                                       scheduler=scheduler)
+    sources = [] # Subscriptions in the order their lines entered the pipeline
+    def track_sources(links):
+        for source, line in links:
+            if not sources or sources[-1] != source:
+                sources.append(source)
+            yield source, line
+    tracked_links = track_sources(raw_telegram_proxy_links)
+    # Hostnames are resolved concurrently in batches so proxies can be deduplicated and geolocated by address
+    new_proxies = iter_proxies_to_post(tracked_links, archive, start_time, parse_stats, resolver)
+    # Each stage is timed separately (see RunMetrics.timed_iter), so the run report shows where the time went
+    timed_new_proxies = run_metrics.timed_iter('parse_dedup', new_proxies)
+    # New proxies are checked for reachability concurrently in batches; unreachable ones are dropped
+    checked_proxies = iter_checked_proxies(timed_new_proxies, checker, source_stats=source_stats) if checker else timed_new_proxies
+    timed_checked_proxies = run_metrics.timed_iter('health_check', checked_proxies) if checker else checked_proxies
+    # Geolocation runs only on new, unique, reachable proxies, in batches, through a persistent memo cache
+    proxies_to_post = iter_geolocated_proxies(timed_checked_proxies, geoip_cache)
+    last_source = None # Subscription of the latest proxy out of the last stage
+    exhausted = False
+    try:
+        for proxy in run_metrics.timed_iter('geolocation', proxies_to_post):
+            last_source = proxy.get('source')
+            yield proxy
+        exhausted = True
+    finally:
+        proxies_to_post.close()
+        checked_proxies.close()
+        new_proxies.close()
+        tracked_links.close()
+        raw_telegram_proxy_links.close()
+        if not exhausted and fetch_cache:
+            # Every stage keeps the order of its input, so only subscriptions from the latest one that got
+            # a proxy out onwards can have proxies left in a batch (DNS, health check, GeoIP). Those are
+            # dropped here, so the subscriptions are fetched and parsed again next time.
+            for source in sources[sources.index(last_source) if last_source in sources else 0:]:
+                fetch_cache.forget(source)
+
+
+def ratio(part, total):
+    return part / total if total else 0.0
+
+def save_run_metrics(parse_stats, fetch_cache, geoip_cache, resolver, checker, sender, router):
+    """Adds the run's counts and cache/dedup ratios to the run metrics and writes the run report."""
+    gauges = {
+        'proxies_posted': sum(channel.posted_count for channel in router.channels),
+        'parse_lines': parse_stats.get('raw', 0),
+        'parse_parsed': parse_stats.get('parsed', 0),
+        'dedup_duplicates': parse_stats.get('duplicates', 0),
+        'dedup_ratio': ratio(parse_stats.get('duplicates', 0), parse_stats.get('parsed', 0)),
+        'archive_hits': parse_stats.get('archived', 0),
+        'archive_hit_ratio': ratio(parse_stats.get('archived', 0), parse_stats.get('parsed', 0) - parse_stats.get('duplicates', 0)),
+        'new_proxies': parse_stats.get('new', 0),
+        'geoip_cache_hits': geoip_cache.hits,
+        'geoip_cache_misses': geoip_cache.misses,
+        'geoip_cache_hit_ratio': ratio(geoip_cache.hits, geoip_cache.hits + geoip_cache.misses),
+        'telegram_messages_sent': sender.sent,
+        'telegram_rate_limited': sender.rate_limited,
+        'telegram_errors': sender.errors,
+        'telegram_throttled_seconds': sender.throttled_seconds,
+        'posting_queue_pushed': router.pushed,
+        'posting_queue_popped': router.popped,
+        'channel_unrouted': router.unrouted,
+    }
+    # Parse memo cache of this process (workers keep their own with PARSE_WORKERS)
+    parse_cache = _parse_telegram_proxy_link_cached.cache_info()
+    gauges.update({'parse_cache_hits': parse_cache.hits, 'parse_cache_misses': parse_cache.misses,
+                   'parse_cache_hit_ratio': ratio(parse_cache.hits, parse_cache.hits + parse_cache.misses)})
+    fetch_cache_hits = fetch_cache.hits_not_modified + fetch_cache.hits_same_content
+    gauges.update({'fetch_cache_hits': fetch_cache_hits, 'fetch_cache_misses': fetch_cache.misses,
+                   'fetch_cache_hit_ratio': ratio(fetch_cache_hits, fetch_cache_hits + fetch_cache.misses)})
+    if resolver:
+        gauges.update({'dns_queries': resolver.queries, 'dns_failures': resolver.failures, 'dns_cache_hits': resolver.cache_hits})
+    for name, value in gauges.items():
+        run_metrics.set_gauge(name, value)
+    for channel in router.channels:
+        run_metrics.set_gauge('channel_proxies_posted', channel.posted_count, {'channel': channel.name})
+        run_metrics.set_gauge('channel_queue_size', len(channel.queue), {'channel': channel.name})
+    if checker:
+        for status, count in checker.status_counts.items():
+            run_metrics.set_gauge('health_check_proxies', count, {'status': status})
+    logging.info(run_metrics.stats_line())
+    run_metrics.save(RUN_REPORT_FILE, METRICS_FILE)
 
-    logging.info(f"Found {len(proxies_to_post)} new, unique, and valid proxies to potentially post after filtering.")
 
+# --- Main Execution ---
 
-    if not proxies_to_post:
-        logging.info("No new proxies to post after filtering. Exiting.")
-        # If no new proxies, still save the archive in case any new processed links were encountered
-        # that weren't in the archive (though they wouldn't be posted).
-        # However, the most reliable approach is to only archive links that were successfully posted.
-        # Let's stick to archiving only successfully posted links.
-        return
+def main():
+    # Record the start time of execution
+    start_time = time.time()
+    run_metrics.reset()
 
-    # 4. Chunk and post proxies_to_post to Telegram with delay
-    logging.info(f"Starting posting process for {len(proxies_to_post)} proxies in chunks of {PROXIES_PER_POST} with a delay of {POST_DELAY_SECONDS} seconds between chunks...")
+    if not TELEGRAM_BOT_TOKEN:
+        logging.error("TELEGRAM_BOT_TOKEN environment variable not set.")
+        logging.error("Please set it (and TELEGRAM_CHANNEL_ID, unless channels are listed in CHANNELS_FILE) as GitHub Secrets.")
+        return
+    # Output channels: every one is fed from the same fetch, parse, check and geolocation pass
+    channels = load_channels(CHANNELS_FILE, TELEGRAM_CHANNEL_ID)
+    if not channels:
+        return
+    open_geoip_database()
+
+    # 1. Open archive of previously posted *processed* proxies (lookups happen on disk).
+    # Chunks journaled by a previous run that was killed before saving its archive are added first.
+    # The ingest stage sees it through the channels' routing view: a proxy is only skipped once
+    # every channel it would be routed to has posted it.
+    archived_processed_proxies = load_archive(ARCHIVE_FILE, LEGACY_ARCHIVE_FILE)
+    journal = replay_posting_journal(archived_processed_proxies)
+    archive_view = ArchiveRoutingView(archived_processed_proxies, channels)
+
+    # 2. Stream raw Telegram proxy links from subscription links, then parse, deduplicate and
+    # filter them against the archive (based on processed link) as they arrive.
+    # If the previous run left enough unposted proxies, and fetched them recently, post those instead.
+    fetch_cache = FetchCache(FETCH_CACHE_FILE, FETCH_CACHE_MAX_ENTRIES, FETCH_CACHE_MAX_AGE_SECONDS)
+    resolver = create_resolver()
+    checker = create_health_checker()
+    geoip_cache = GeoIPCache(GEOIP_CACHE_FILE, GEOIP_CACHE_MAX_ENTRIES, GEOIP_CACHE_BY_PREFIX, get_geoip_database_version())
+    scheduler = create_source_scheduler()
+    parse_stats = {}
+    source_stats = {} if checker else None
+    pending = load_pending_proxies(archive_view, PENDING_QUEUE_MIN_PROXIES)
+    if pending:
+        fetched_at, pending_proxies = pending
+        logging.info(f"Resuming {len(pending_proxies)} unposted proxies saved by the previous run. Skipping the fetch stage.")
+        proxies_to_post = (proxy for proxy in pending_proxies)
+    else:
+        fetched_at = start_time
+        proxies_to_post = iter_candidate_proxies(archive_view, fetch_cache, resolver, checker, geoip_cache,
+                                                 start_time, parse_stats, source_stats, scheduler=scheduler)
+
+    # 3. Chunk and post the best queued proxies to Telegram.
+    # Candidates are routed into a priority queue per channel (up to POSTING_QUEUE_LOOKAHEAD ahead)
+    # and each chunk is taken from the head of its channel's queue, so a run cut short by the time
+    # limit has posted the best ones. Posting goes in rounds of one chunk per channel, sent to the
+    # different chats concurrently. The sender spaces posts to a chat POST_DELAY_SECONDS apart and
+    # honors Telegram's rate limits; fetching and ranking the next chunks happens while the delay runs.
+    logging.info(f"Starting posting process to {len(channels)} channels in chunks of {PROXIES_PER_POST} "
+                 f"with at least {POST_DELAY_SECONDS} seconds between chunks...")
+    router = create_channel_router(channels, archived_processed_proxies, source_stats)
+    sender = create_telegram_sender()
+    executor = ThreadPoolExecutor(max_workers=len(channels))
+    send_deadline = time.monotonic() + MAX_EXECUTION_TIME_SECONDS - (time.time() - start_time)
 
     posted_chunks_count = 0
-    proxies_actually_posted_processed_links = [] # Keep track of *processed* raw links that were successfully posted
-
-    # Iterate through proxies_to_post in chunks
-    for i in range(0, len(proxies_to_post), PROXIES_PER_POST):
-        chunk = proxies_to_post[i:i + PROXIES_PER_POST]
-        logging.info(f"Processing chunk starting with proxy {i+1} (containing {len(chunk)} proxies).")
-
-        # Calculate time needed for this post and the subsequent delay
-        time_needed_for_post = 5 # Estimate time for API call (can vary)
-        if (i + PROXIES_PER_POST) < len(proxies_to_post):
-             time_needed_for_post += POST_DELAY_SECONDS # Add delay if not the last chunk
-
-        # Check if posting this chunk and waiting would exceed the time limit
-        elapsed_time = time.time() - start_time
-        if elapsed_time + time_needed_for_post > MAX_EXECUTION_TIME_SECONDS:
-            logging.warning(f"Execution time approaching limit ({MAX_EXECUTION_TIME_SECONDS}s) during posting. Skipping remaining posts.")
-            break # Stop posting if time is running out
-
-        success = post_proxies_chunk_to_telegram(TELEGRAM_CHANNEL_ID, chunk)
-
-        if success:
-            posted_chunks_count += 1
-            # Add the *processed* raw links from the proxies in this chunk to the list of actually posted links
-            proxies_actually_posted_processed_links.extend([p['raw'] for p in chunk])
-            # Wait before posting the next chunk, unless it's the last one
-            if (i + PROXIES_PER_POST) < len(proxies_to_post):
-                logging.info(f"Waiting {POST_DELAY_SECONDS} seconds before next chunk...")
-                time.sleep(POST_DELAY_SECONDS)
-        else:
-            logging.warning(f"Failed to post chunk starting with proxy {i+1}. Skipping wait and moving to next chunk.")
-            # If posting fails, we might not want to wait the full delay.
-            # Flood error handling is inside post_proxies_chunk_to_telegram.
-
 
+    fill_posting_queue(router, proxies_to_post, POSTING_QUEUE_LOOKAHEAD)
+    checkpoint_pending_queue(router, fetched_at)
+    while True:
+        posts = []
+        for channel in channels:
+            if channel.stopped or not channel.has_chunks():
+                continue
+            # Check if waiting for the channel's next send slot and posting would exceed the time limit
+            time_needed_for_post = sender.wait_time(channel.chat_id) + 5 # Estimate time for API call (can vary)
+            elapsed_time = time.time() - start_time
+            if elapsed_time + time_needed_for_post > MAX_EXECUTION_TIME_SECONDS:
+                logging.warning(f"Execution time approaching limit ({MAX_EXECUTION_TIME_SECONDS}s) during posting. "
+                                f"Skipping remaining posts to channel '{channel.name}'.")
+                channel.stopped = True
+                continue
+            chunk, attempts = next_channel_chunk(channel)
+            if not chunk:
+                continue
+            if attempts == 1:
+                logging.info(f"Processing chunk of {len(chunk)} proxies for channel '{channel.name}'.")
+            else:
+                logging.info(f"Retrying a chunk of {len(chunk)} proxies for channel '{channel.name}' (attempt {attempts}/{POST_CHUNK_MAX_ATTEMPTS}).")
+            posts.append((channel, chunk, attempts))
+        if not posts:
+            break
+
+        for channel, chunk, attempts, success in post_channel_chunks(sender, executor, posts, send_deadline):
+            if success:
+                posted_chunks_count += 1
+            record_post_result(channel, chunk, attempts, success, journal)
+
+        # Top the queues up so the next chunks are chosen from a full lookahead window
+        fill_posting_queue(router, proxies_to_post, POSTING_QUEUE_LOOKAHEAD)
+        checkpoint_pending_queue(router, fetched_at)
+
+    # Whatever was queued but not posted (including chunks cut off by the time limit) is saved for the next run
+    unposted_proxies = router.drain()
+    executor.shutdown()
+    sender.close()
+    logging.info(sender.stats_line())
+
+    # Stop fetching/parsing anything left in the stream (e.g. after a timeout).
+    # Subscriptions whose proxies did not all reach the posting queue are dropped from the fetch cache here.
+    proxies_to_post.close()
+    if not pending:
+        finish_source_cycle(scheduler, parse_stats)
+    if checker:
+        logging.info(checker.stats_line())
+    logging.info(router.stats_line())
+    logging.info(geoip_cache.stats_line())
+    geoip_cache.save()
+    if resolver:
+        logging.info(resolver.stats_line())
+        resolver.save()
+    if not pending and parse_stats.get('new', 0) == 0:
+        logging.info("No new proxies to post after filtering.")
+
+    posted_count = sum(channel.posted_count for channel in channels)
     logging.info(f"Finished posting process. {posted_chunks_count} chunks were successfully posted.")
-    logging.info(f"Total proxies successfully posted: {len(proxies_actually_posted_processed_links)}")
+    logging.info(f"Total proxies successfully posted: {posted_count}")
 
 
-    # 5. Save the *processed* raw proxies that were *actually posted* to the archive
+    # 4. Save the *processed* proxies that were *actually posted* to the archive, per channel
     # This ensures we don't archive proxies that were skipped due to the timeout or parsing issues.
-    save_archive(ARCHIVE_FILE, proxies_actually_posted_processed_links)
-    logging.info(f"Archived {len(proxies_actually_posted_processed_links)} processed proxies that were successfully posted.")
+    if not save_channel_archives(archived_processed_proxies, channels, journal):
+        journal.close() # Replayed into the archive next run
+    compact_archive(archived_processed_proxies)
+    archived_processed_proxies.close()
+    logging.info(f"Archived {posted_count} processed proxies that were successfully posted.")
+    pending_saved = save_pending_queue(PENDING_QUEUE_FILE, fetched_at, unposted_proxies)
+    save_run_metrics(parse_stats, fetch_cache, geoip_cache, resolver, checker, sender, router)
+
+    # Fetched proxies that were not posted are in the pending queue, so unchanged subscriptions
+    # need not be parsed again; only a stream cut off during parsing leaves proxies behind
+    if pending:
+        logging.info("Resumed from the pending queue. Fetch cache left unchanged.")
+    elif pending_saved and not parse_stats.get('stopped_early'):
+        fetch_cache.save()
+    else:
+        logging.warning("Not all fetched proxies reached the posting queue. Fetch cache not saved so every subscription is parsed again next run.")
 
 
     # Close the GeoIP database reader when the script finishes
-    if geoip_reader:
-        geoip_reader.close()
+    close_geoip_database()
+
+def get_file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def run_daemon():
+    """
+    Runs until SIGTERM/SIGINT, keeping the GeoIP reader, archive, HTTP sessions and caches open
+    between cycles. Fetching and posting run on their own schedules in one scheduler loop:
+    - a fetch cycle starts every DAEMON_FETCH_INTERVAL_SECONDS, or as soon as the subscription
+      file changes, and routes DAEMON_INGEST_BATCH_SIZE candidates per step to the channel queues;
+    - a chunk is posted to each channel whenever the sender allows it (POST_DELAY_SECONDS apart),
+      to several channels concurrently when their posts are due together.
+    On shutdown the current step finishes and all state is flushed to disk.
+    """
+    if not TELEGRAM_BOT_TOKEN:
+        logging.error("TELEGRAM_BOT_TOKEN environment variable not set.")
+        return
+    channels = load_channels(CHANNELS_FILE, TELEGRAM_CHANNEL_ID)
+    if not channels:
+        return
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info(f"Received signal {signum}. Shutting down after the current step...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    open_geoip_database()
+    archive = load_archive(ARCHIVE_FILE, LEGACY_ARCHIVE_FILE)
+    journal = replay_posting_journal(archive)
+    archive_view = ArchiveRoutingView(archive, channels)
+    fetch_cache = FetchCache(FETCH_CACHE_FILE, FETCH_CACHE_MAX_ENTRIES, FETCH_CACHE_MAX_AGE_SECONDS)
+    resolver = create_resolver()
+    checker = create_health_checker()
+    geoip_cache = GeoIPCache(GEOIP_CACHE_FILE, GEOIP_CACHE_MAX_ENTRIES, GEOIP_CACHE_BY_PREFIX, get_geoip_database_version())
+    source_stats = {} if checker else None
+    router = create_channel_router(channels, archive, source_stats)
+    sender = create_telegram_sender()
+    executor = ThreadPoolExecutor(max_workers=len(channels))
+    session = create_http_session()
+    scheduler = create_source_scheduler()
+    # Proxies left unposted by the previous run or daemon are posted alongside the first fetch cycle
+    pending = load_pending_proxies(archive_view)
+    fetched_at = time.time()
+    if pending:
+        fetched_at, pending_proxies = pending
+        router.route(pending_proxies)
+        logging.info(f"Queued {len(pending_proxies)} unposted proxies saved by the previous run.")
+    candidates = None # Ingest stream of the fetch cycle in progress
+    parse_stats = {} # Counters of the latest fetch cycle
+    # The fetch cache goes to disk on shutdown, once the unposted proxies are in the pending queue (see main());
+    # in between, its in-memory validators let later cycles skip unchanged subscriptions
+    next_fetch_at = time.monotonic()
+    subscriptions_mtime = None
+    logging.info(f"Daemon started. Fetching every {DAEMON_FETCH_INTERVAL_SECONDS} seconds, posting at least {POST_DELAY_SECONDS} seconds apart.")
+
+    def finish_fetch_cycle():
+        nonlocal candidates
+        # Subscriptions of a cycle ended early whose proxies did not all reach the posting queues
+        # leave the fetch cache here, so the next cycle fetches them again
+        candidates.close()
+        candidates = None
+        finish_source_cycle(scheduler, parse_stats)
+        logging.info(router.stats_line())
+        geoip_cache.save()
+        if resolver:
+            resolver.save()
+        compact_archive(archive)
+        save_run_metrics(parse_stats, fetch_cache, geoip_cache, resolver, checker, sender, router)
+
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if candidates is None:
+                mtime = get_file_mtime(SUBSCRIPTION_FILE)
+                if subscriptions_mtime is not None and mtime != subscriptions_mtime:
+                    logging.info(f"{SUBSCRIPTION_FILE} changed. Starting a fetch cycle now.")
+                    next_fetch_at = now
+                if now >= next_fetch_at:
+                    logging.info("Starting fetch cycle...")
+                    subscriptions_mtime = mtime
+                    fetched_at = time.time()
+                    parse_stats = {}
+                    candidates = iter_candidate_proxies(archive_view, fetch_cache, resolver, checker, geoip_cache,
+                                                        parse_stats=parse_stats, source_stats=source_stats, session=session,
+                                                        scheduler=scheduler)
+                    next_fetch_at = now + DAEMON_FETCH_INTERVAL_SECONDS
+
+            # Posting comes first whenever a post is due (to every channel it is due for at once)
+            posts = []
+            for channel in channels:
+                if channel.has_chunks() and sender.wait_time(channel.chat_id) <= 0:
+                    chunk, attempts = next_channel_chunk(channel)
+                    if chunk:
+                        posts.append((channel, chunk, attempts))
+            if posts:
+                # Don't block the scheduler on a long retry_after; the chunk is retried once it has passed
+                for channel, chunk, attempts, success in post_channel_chunks(sender, executor, posts, time.monotonic() + DAEMON_TICK_SECONDS):
+                    record_post_result(channel, chunk, attempts, success, journal)
+                if any(channel.posted for channel in channels):
+                    save_channel_archives(archive, channels, journal)
+                checkpoint_pending_queue(router, fetched_at)
+                continue
+
+            if candidates is not None:
+                with run_metrics.timed('posting_queue'):
+                    more = router.ingest(candidates, DAEMON_INGEST_BATCH_SIZE)
+                if not more:
+                    finish_fetch_cycle()
+                elif len(router) >= DAEMON_QUEUE_MAX_SIZE:
+                    logging.warning(f"Posting queues reached {DAEMON_QUEUE_MAX_SIZE} proxies. Ending fetch cycle early.")
+                    finish_fetch_cycle()
+                continue
+
+            # Nothing to do until the next post or fetch cycle is due
+            wait = min(DAEMON_TICK_SECONDS, next_fetch_at - now)
+            for channel in channels:
+                if channel.has_chunks():
+                    wait = min(wait, sender.wait_time(channel.chat_id))
+            stop_event.wait(max(wait, 0.01))
+    finally:
+        logging.info("Flushing state before exit...")
+        if candidates is not None:
+            finish_fetch_cycle()
+        if checker:
+            logging.info(checker.stats_line())
+        logging.info(geoip_cache.stats_line())
+        logging.info(sender.stats_line())
+        if save_pending_queue(PENDING_QUEUE_FILE, fetched_at, router.drain()):
+            fetch_cache.save()
+        else:
+            logging.warning("Unposted proxies could not be saved. Fetch cache not saved so every subscription is parsed again next run.")
+        save_run_metrics(parse_stats, fetch_cache, geoip_cache, resolver, checker, sender, router)
+        journal.close()
+        archive.close()
+        executor.shutdown()
+        sender.close()
+        session.close()
+        close_geoip_database()
+        logging.info(f"Daemon stopped. {sum(channel.posted_count for channel in channels)} proxies were posted.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetches Telegram proxies from subscription links and posts new ones to a Telegram channel.")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and fetch/post on internal schedules until SIGTERM, instead of a single run")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_environment()
+    run = run_daemon if args.daemon else main
+    if PROFILER:
+        run_profiled(run, PROFILER, PROFILE_OUTPUT_FILE)
+    else:
+        run()
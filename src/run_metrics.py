@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from state_store import save_json_state, save_text_state
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_PREFIX = 'proxy_poster_'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+class RunMetrics:
+    """
+    Instruments one run: time and calls per pipeline stage, counters, gauges and latency
+    histograms, written out as a JSON run report and a Prometheus text-format file.
+    Stage times are exclusive: time spent in a stage nested inside another one (in the same
+    thread) is only counted for the inner stage, so the stages of the streaming pipeline, which
+    pull from each other, add up to the run's wall time instead of overlapping.
+    Safe to update from several threads.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._started = self.clock()
+            self.stages = {} # stage -> [seconds, calls]
+            self.counters = {} # name -> {label key: value}
+            self.gauges = {} # name -> {label key: value}
+            self.histograms = {} # name -> {label key: [bucket counts..., +Inf count], sum}
+
+    def _frames(self):
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+    @contextmanager
+    def timed(self, stage):
+        """Times the block as one call of stage."""
+        frames = self._frames()
+        frame = [0.0] # Time spent in nested stages
+        frames.append(frame)
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            frames.pop()
+            if frames:
+                frames[-1][0] += elapsed
+            self.add_time(stage, elapsed - frame[0])
+
+    def timed_iter(self, stage, iterable):
+        """Yields from iterable, timing each item it takes to produce as one call of stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.timed(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def increment(self, name, amount=1, labels=None):
+        with self._lock:
+            values = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            values[key] = values.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None):
+        with self._lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, labels=None):
+        """Adds a value (seconds) to a latency histogram."""
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            counts, _ = series[key]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[key][1] += value
+
+    def report(self):
+        """Returns the metrics as a JSON-serializable dict."""
+        with self._lock:
+            def labeled(values):
+                return [{'labels': dict(key), 'value': value} for key, value in sorted(values.items())]
+
+            histograms = {}
+            for name, series in self.histograms.items():
+                histograms[name] = []
+                for key, (counts, total) in sorted(series.items()):
+                    cumulative, buckets = 0, {}
+                    for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], counts):
+                        cumulative += count
+                        buckets[str(bound)] = cumulative
+                    histograms[name].append({'labels': dict(key), 'count': cumulative, 'sum': total, 'buckets': buckets})
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': self.clock() - self._started,
+                'stages': {stage: {'seconds': seconds, 'calls': calls} for stage, (seconds, calls) in self.stages.items()},
+                'counters': {name: labeled(values) for name, values in self.counters.items()},
+                'gauges': {name: labeled(values) for name, values in self.gauges.items()},
+                'histograms': histograms,
+            }
+
+    def prometheus_text(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        lines = [
+            f'# TYPE {PROMETHEUS_PREFIX}run_started_timestamp_seconds gauge',
+            f'{PROMETHEUS_PREFIX}run_started_timestamp_seconds {report["started_at"]}',
+            f'# TYPE {PROMETHEUS_PREFIX}run_duration_seconds gauge',
+            f'{PROMETHEUS_PREFIX}run_duration_seconds {report["duration_seconds"]}',
+            f'# TYPE {PROMETHEUS_PREFIX}stage_seconds gauge',
+        ]
+        for stage, totals in sorted(report['stages'].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}stage_seconds{{stage="{stage}"}} {totals["seconds"]}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}stage_calls counter')
+        for stage, totals in sorted(report['stages'].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}stage_calls_total{{stage="{stage}"}} {totals["calls"]}')
+        for name, series in sorted(report['counters'].items()):
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}{name} counter')
+            for sample in series:
+                lines.append(f'{PROMETHEUS_PREFIX}{name}_total{_format_labels(sorted(sample["labels"].items()))} {sample["value"]}')
+        for name, series in sorted(report['gauges'].items()):
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}{name} gauge')
+            for sample in series:
+                lines.append(f'{PROMETHEUS_PREFIX}{name}{_format_labels(sorted(sample["labels"].items()))} {sample["value"]}')
+        for name, series in sorted(report['histograms'].items()):
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}{name} histogram')
+            for sample in series:
+                label_key = sorted(sample['labels'].items())
+                for bound, count in sample['buckets'].items():
+                    lines.append(f'{PROMETHEUS_PREFIX}{name}_bucket{_format_labels(label_key, [("le", bound)])} {count}')
+                lines.append(f'{PROMETHEUS_PREFIX}{name}_sum{_format_labels(label_key)} {sample["sum"]}')
+                lines.append(f'{PROMETHEUS_PREFIX}{name}_count{_format_labels(label_key)} {sample["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def stats_line(self):
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][0])
+        return "Stage times: " + (', '.join(f"{stage} {seconds:.2f}s" for stage, (seconds, _) in stages) or 'none')
+
+    def save(self, report_path=None, prometheus_path=None):
+        """Writes the JSON run report and/or the Prometheus text file."""
+        if report_path and save_json_state(report_path, self.report()):
+            logging.info(f"Saved run report to {report_path}.")
+        if prometheus_path and save_text_state(prometheus_path, self.prometheus_text()):
+            logging.info(f"Saved Prometheus metrics to {prometheus_path}.")
+
+
+def run_profiled(func, mode, output_path):
+    """
+    Runs func under a profiler: mode 'cprofile' writes output_path + '.prof' (pstats format),
+    'pyinstrument' writes output_path + '.html' (needs the optional pyinstrument package).
+    cProfile only sees the main thread, so fetch and health check workers show up as waits.
+    """
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            profiler.dump_stats(output_path + '.prof')
+            logging.info(f"Saved cProfile stats to {output_path}.prof")
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.warning("pyinstrument library not found. Running without profiling.")
+            return func()
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return func()
+        finally:
+            profiler.stop()
+            save_text_state(output_path + '.html', profiler.output_html())
+            logging.info(f"Saved pyinstrument profile to {output_path}.html")
+    logging.warning(f"Unknown profiler '{mode}' (expected 'cprofile' or 'pyinstrument'). Running without profiling.")
+    return func()
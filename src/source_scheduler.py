@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from state_store import load_json_state, save_json_state
+
+# Fetch outcomes passed to record_fetch()
+FETCH_OK = 'ok' # Body downloaded (changed or not)
+FETCH_NOT_MODIFIED = 'not_modified' # 304, or same body as last time
+FETCH_SOURCE_ERROR = 'source_error' # The server answered with an HTTP error for this URL
+FETCH_HOST_ERROR = 'host_error' # Connection error, timeout or 5xx: the host is in trouble
+
+
+class SourceScheduler:
+    """
+    Decides which subscription links to fetch in a run, and in which order, from persistent
+    per-source statistics: fetch latency, failure rate, new-proxy yield and duplicate ratio
+    (all exponentially weighted moving averages, with smoothing as the weight of the latest fetch).
+    - Sources are fetched best first: highest expected yield of new proxies, then lowest latency.
+      Sources without statistics go first, so they get measured.
+    - After low_yield_grace fetches in a row without a new proxy, a source is fetched at most every
+      low_yield_interval seconds, doubling with each further empty fetch up to low_yield_max_interval.
+    - Circuit breakers with exponential backoff: after breaker_threshold failures in a row, a host
+      (connection errors, timeouts, 5xx) or a single source (other HTTP errors) is skipped for
+      breaker_base_seconds, doubling per further failure up to breaker_max_seconds. One fetch is
+      let through once that time has passed; a success closes the breaker. Host failures are
+      counted when the cycle finishes, and only if no link on the host got an answer in it, so a
+      few slow files on a busy shared host do not shut out all the others.
+    Times are wall-clock times, since they are persisted between runs. A source or host is due
+    up to slack_seconds early, so hourly runs started a little early are not skipped.
+    """
+
+    def __init__(self, file_path=None, smoothing=0.3, low_yield_grace=3, low_yield_interval=2 * 3600,
+                 low_yield_max_interval=24 * 3600, breaker_threshold=2, breaker_base_seconds=3600,
+                 breaker_max_seconds=7 * 24 * 3600, slack_seconds=300, clock=time.time):
+        self.file_path = file_path
+        self.smoothing = smoothing
+        self.low_yield_grace = low_yield_grace
+        self.low_yield_interval = low_yield_interval
+        self.low_yield_max_interval = low_yield_max_interval
+        self.breaker_threshold = breaker_threshold
+        self.breaker_base_seconds = breaker_base_seconds
+        self.breaker_max_seconds = breaker_max_seconds
+        self.slack_seconds = slack_seconds
+        self.clock = clock
+        state = load_json_state(file_path, {}) if file_path else {}
+        self.sources = state.get('sources', {}) # url -> statistics
+        self.breakers = state.get('breakers', {}) # host or url -> {'failures': n, 'open_until': time}
+        self._fetched = {} # url -> line count, for sources downloaded in the current cycle
+        self._consumed = set() # Sources whose lines were all read by the pipeline
+        self._host_failures = {} # host -> failed fetches in the current cycle
+        self._hosts_answered = set() # Hosts that answered a fetch in the current cycle
+        self.skipped_low_yield = 0
+        self.skipped_breaker = 0
+        self._lock = threading.Lock()
+
+    def _average(self, stats, name, value):
+        previous = stats.get(name)
+        stats[name] = value if previous is None else previous + self.smoothing * (value - previous)
+
+    def _breaker_open(self, key, now):
+        breaker = self.breakers.get(key)
+        return breaker is not None and now < breaker['open_until'] - self.slack_seconds
+
+    def _trip(self, key, now, failures=1):
+        breaker = self.breakers.setdefault(key, {'failures': 0, 'open_until': 0})
+        breaker['failures'] += failures
+        if breaker['failures'] >= self.breaker_threshold:
+            backoff = min(self.breaker_max_seconds, self.breaker_base_seconds * 2 ** (breaker['failures'] - self.breaker_threshold))
+            breaker['open_until'] = now + backoff
+            logging.warning(f"Circuit breaker for {key} open for {backoff} seconds after {breaker['failures']} failures in a row.")
+
+    def plan(self, links):
+        """Returns the links to fetch now, best first. Statistics of links no longer listed are dropped."""
+        now = self.clock()
+        links = list(dict.fromkeys(links))
+        listed = set(links)
+        self.sources = {link: stats for link, stats in self.sources.items() if link in listed}
+        hosts = {urlparse(link).netloc.lower() for link in links}
+        self.breakers = {key: breaker for key, breaker in self.breakers.items() if key in hosts or key in listed}
+        self._fetched = {}
+        self._consumed = set()
+        self._host_failures = {}
+        self._hosts_answered = set()
+        due = []
+        for position, link in enumerate(links):
+            stats = self.sources.get(link, {})
+            if self._breaker_open(urlparse(link).netloc.lower(), now) or self._breaker_open(link, now):
+                self.skipped_breaker += 1
+                logging.info(f"Skipping {link}: circuit breaker open.")
+                continue
+            if now < stats.get('next_fetch_at', 0) - self.slack_seconds:
+                self.skipped_low_yield += 1
+                logging.info(f"Skipping {link}: no new proxies in its last {stats.get('empty_fetches', 0)} fetches.")
+                continue
+            if not stats:
+                rank = (0, 0.0, position) # Unmeasured sources first
+            else:
+                rank = (1, -stats.get('yield', 0.0), stats.get('latency', 0.0))
+            due.append((rank, position, link))
+        return [link for _, _, link in sorted(due)]
+
+    def record_fetch(self, link, seconds, outcome, lines=0):
+        """Records a fetch attempt (called from the fetch worker threads)."""
+        with self._lock:
+            self._record_fetch(link, seconds, outcome, lines)
+
+    def _record_fetch(self, link, seconds, outcome, lines):
+        now = self.clock()
+        stats = self.sources.setdefault(link, {})
+        stats['last_fetched'] = now
+        self._average(stats, 'latency', seconds)
+        failed = outcome in (FETCH_SOURCE_ERROR, FETCH_HOST_ERROR)
+        self._average(stats, 'failure_rate', 1.0 if failed else 0.0)
+        host = urlparse(link).netloc.lower()
+        if outcome == FETCH_HOST_ERROR:
+            self._host_failures[host] = self._host_failures.get(host, 0) + 1 # Charged in finish_cycle()
+        elif outcome == FETCH_SOURCE_ERROR:
+            self._hosts_answered.add(host)
+            self._trip(link, now)
+        else:
+            self._hosts_answered.add(host)
+            self.breakers.pop(link, None)
+            self._fetched[link] = lines if outcome == FETCH_OK else 0
+
+    def mark_consumed(self, link):
+        """Records that every line of a fetched source went through the pipeline."""
+        self._consumed.add(link)
+
+    def finish_cycle(self, per_source):
+        """
+        Updates yield and duplicate ratio of the sources downloaded and fully consumed in this
+        cycle. per_source maps a source to its {'unique': n, 'new': n} proxies, where unique
+        proxies were first seen in this source in this cycle and new ones were also not archived.
+        Sources cut off by the time limit are left alone, so they are not mistaken for empty ones.
+        Host breakers are updated from the cycle's fetches: hosts that answered close theirs, and
+        the others are charged their failures.
+        """
+        now = self.clock()
+        with self._lock:
+            for host in self._hosts_answered:
+                self.breakers.pop(host, None)
+            for host, failures in self._host_failures.items():
+                if host not in self._hosts_answered:
+                    self._trip(host, now, failures)
+            self._host_failures = {}
+            self._hosts_answered = set()
+        for link, lines in self._fetched.items():
+            if lines and link not in self._consumed:
+                continue
+            counts = per_source.get(link, {})
+            new = counts.get('new', 0)
+            stats = self.sources.setdefault(link, {})
+            self._average(stats, 'yield', new)
+            if lines:
+                self._average(stats, 'duplicate_ratio', 1.0 - counts.get('unique', 0) / lines)
+            if new:
+                stats['empty_fetches'] = 0
+                stats.pop('next_fetch_at', None)
+            else:
+                stats['empty_fetches'] = stats.get('empty_fetches', 0) + 1
+                excess = stats['empty_fetches'] - self.low_yield_grace
+                if excess >= 0:
+                    stats['next_fetch_at'] = now + min(self.low_yield_max_interval, self.low_yield_interval * 2 ** excess)
+        self._fetched = {}
+        self._consumed = set()
+
+    def stats_line(self):
+        open_breakers = sum(1 for breaker in self.breakers.values() if breaker.get('open_until', 0) > self.clock())
+        return (f"Source scheduler: {len(self.sources)} sources tracked, {self.skipped_low_yield} skipped for low yield, "
+                f"{self.skipped_breaker} skipped by {open_breakers} open circuit breakers")
+
+    def save(self):
+        if self.file_path and save_json_state(self.file_path, {'sources': self.sources, 'breakers': self.breakers}):
+            logging.info(f"Saved statistics of {len(self.sources)} subscription sources to {self.file_path}.")
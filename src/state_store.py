@@ -0,0 +1,49 @@
+import json
+import logging
+import os
+import tempfile
+
+
+def load_json_state(file_path, default):
+    """Loads a JSON state file, returning default if it is missing or unreadable."""
+    if not os.path.exists(file_path):
+        return default
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading state file {file_path}: {e}")
+        return default
+
+
+def save_json_state(file_path, data):
+    """
+    Writes a JSON state file atomically (write to a temp file, then rename),
+    so a run killed mid-write never leaves a truncated file behind.
+    """
+    directory = os.path.dirname(file_path) or '.'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'), sort_keys=True)
+        os.replace(tmp_path, file_path)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving state file {file_path}: {e}")
+        return False
+
+
+def save_text_state(file_path, text):
+    """Writes a text file atomically, like save_json_state."""
+    directory = os.path.dirname(file_path) or '.'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, file_path)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving file {file_path}: {e}")
+        return False
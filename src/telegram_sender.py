@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second, holding at most capacity tokens.
+    Not thread-safe on its own; TelegramSender guards its buckets with a lock.
+    """
+
+    def __init__(self, rate, capacity=1.0, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def refund(self):
+        """Gives back a token taken for a message that was not delivered."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class TelegramSender:
+    """
+    Sends Bot API messages over one pooled keep-alive session, within Telegram's rate limits.
+    Every message takes a token from a global bucket (global_rate messages per second) and from
+    its chat's bucket (one message per chat_interval seconds). A 429 reply gives the chat's token
+    back and blocks the chat for exactly the retry_after seconds Telegram asks for, after which
+    the message is sent again;
+    connection errors and 5xx replies are retried with exponential backoff. Either way a message
+    is tried at most max_attempts times per send_message call.
+    Safe to share between threads posting to different chats.
+    """
+
+    def __init__(self, api_url, chat_interval=3.0, global_rate=30.0, max_attempts=3, timeout=30,
+                 backoff_seconds=2.0, clock=time.monotonic, sleep=time.sleep):
+        self.api_url = api_url
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff_seconds = backoff_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate), clock)
+        self.chat_buckets = {}
+        self.blocked_until = {} # chat_id -> clock time before which Telegram asked us not to send
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=8))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=8))
+        self.sent = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.throttled_seconds = 0.0 # Time spent waiting for send slots (rate limits and retry_after)
+
+    def _chat_bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(1.0 / self.chat_interval, 1.0, self.clock)
+        return self.chat_buckets[chat_id]
+
+    def wait_time(self, chat_id):
+        """Seconds until a message to chat_id could be sent."""
+        with self._lock:
+            blocked = self.blocked_until.get(chat_id, 0) - self.clock()
+            return max(0.0, blocked, self.global_bucket.wait_time(), self._chat_bucket(chat_id).wait_time())
+
+    def _acquire(self, chat_id, deadline):
+        """Waits for a send slot for chat_id. Returns False if it would only come after deadline."""
+        while True:
+            with self._lock:
+                chat_bucket = self._chat_bucket(chat_id)
+                wait = max(0.0, self.blocked_until.get(chat_id, 0) - self.clock(),
+                           self.global_bucket.wait_time(), chat_bucket.wait_time())
+                if wait <= 0:
+                    self.global_bucket.consume()
+                    chat_bucket.consume()
+                    return True
+            if deadline is not None and self.clock() + wait > deadline:
+                return False
+            self.sleep(wait)
+            self.throttled_seconds += wait
+
+    def _backoff(self, attempt):
+        if attempt < self.max_attempts:
+            self.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+    def send_message(self, chat_id, payload, deadline=None):
+        """
+        Sends a sendMessage payload to chat_id.
+        Returns True once Telegram accepted it, False if Telegram rejected it (not worth retrying),
+        or None if it could not be delivered for now (rate limited past the deadline, or still
+        failing after max_attempts) and should be retried later.
+        deadline is a clock() time by which the message must have been sent.
+        """
+        payload = dict(payload, chat_id=chat_id)
+        attempt = 0
+        while attempt < self.max_attempts:
+            if not self._acquire(chat_id, deadline):
+                logging.warning(f"Not enough time left to send to chat {chat_id} within the rate limits.")
+                return None
+            attempt += 1
+            try:
+                response = self.session.post(f'{self.api_url}/sendMessage', json=payload, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                self.errors += 1
+                logging.error(f"Error sending message to Telegram (attempt {attempt}/{self.max_attempts}): {e}")
+                self._backoff(attempt)
+                continue
+
+            if response.status_code == 200:
+                self.sent += 1
+                logging.debug(f"Telegram API response: {response.text}")
+                return True
+            try:
+                error_response = response.json()
+            except ValueError:
+                error_response = {}
+            if response.status_code == 429:
+                self.rate_limited += 1
+                retry_after = error_response.get('parameters', {}).get('retry_after', self.chat_interval)
+                logging.warning(f"Flood control exceeded for chat {chat_id}. Retrying after {retry_after} seconds.")
+                with self._lock:
+                    self.blocked_until[chat_id] = self.clock() + retry_after
+                    # The message was not posted, so only the block (not chat_interval) delays the next attempt
+                    self._chat_bucket(chat_id).refund()
+                continue # _acquire waits out the block before the next attempt
+
+            self.errors += 1
+            logging.error(f"Telegram API error response status code: {response.status_code}")
+            logging.error(f"Telegram API error response body: {response.text}")
+            if response.status_code < 500:
+                return False # Bad request, bot not in chat, ...: sending again would not help
+            self._backoff(attempt)
+        return None
+
+    def stats_line(self):
+        return (f"Telegram sender: {self.sent} messages sent, {self.rate_limited} rate limited replies, {self.errors} errors, "
+                f"{self.throttled_seconds:.1f}s waiting for rate limits")
+
+    def close(self):
+        self.session.close()